@@ -0,0 +1,17 @@
+import pytest
+
+from vsbutil import VerySeriousButton
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    # Keep the CLI away from real devices, daemons and the user's files
+    monkeypatch.setenv("VSBUTIL_SOCKET", str(tmp_path / "vsbutil.sock"))
+    monkeypatch.delenv("VSBUTIL_DEVINFO_CACHE", raising=False)
+    monkeypatch.delenv("VSBUTIL_INVENTORY", raising=False)
+    yield
+    VerySeriousButton.backend = None
+    VerySeriousButton.retry_policy = None
+    VerySeriousButton.info_cache = None
+    VerySeriousButton.inventory = None
+    VerySeriousButton.global_listeners[:] = []
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from vsbutil import (
+    AsyncVerySeriousButton,
+    SimulatedBackend,
+    VerySeriousButton,
+    VerySeriousButtonTimeout,
+    )
+
+
+class _TrackingBackend(SimulatedBackend):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.opened = []
+
+    def device(self):
+        dev = super().device()
+        self.opened.append(dev)
+        return dev
+
+
+def test_open_timeout_closes_device_opened_later():
+    backend = _TrackingBackend(
+        latency={VerySeriousButton.VSB_CMD_GETDEVINFO: 0.2})
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await AsyncVerySeriousButton.open(
+                "SIM00001", backend=backend, call_timeout=0.02)
+        await asyncio.sleep(0.5)
+
+    asyncio.run(main())
+    assert backend.opened
+    assert all(dev.firmware is None for dev in backend.opened)
+
+
+def test_open_and_close():
+    backend = _TrackingBackend()
+
+    async def main():
+        vsb = await AsyncVerySeriousButton.open("SIM00001", backend=backend)
+        async with vsb:
+            return (await vsb.get_config())["mode"]
+
+    assert asyncio.run(main()) == VerySeriousButton.MODE_GAMEPAD
+    assert all(dev.firmware is None for dev in backend.opened)
+
+
+def test_timeout_reaches_the_device():
+    backend = _TrackingBackend(
+        latency={VerySeriousButton.VSB_CMD_GETCFG: 0.3})
+
+    async def main():
+        async with await AsyncVerySeriousButton.open(
+                "SIM00001", backend=backend) as vsb:
+            with pytest.raises(VerySeriousButtonTimeout):
+                await vsb.do_query(
+                    VerySeriousButton.VSB_CMD_GETCFG, timeout=0.02,
+                    call_timeout=5.)
+
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+import sys
+
+import pytest
+
+from vsbutil import bench
+from vsbutil.cli import run
+
+
+def _codec(cpu_time, alloc_bytes=200):
+    return {"getconfig": dict(
+        iterations=10, cpu_time=cpu_time, alloc_bytes=alloc_bytes)}
+
+
+def test_microbenchmarks_have_their_own_tolerance():
+    baseline = dict(codec=_codec(10e-6), hidraw=dict(ioctl=_codec(10e-6)))
+    result = dict(codec=_codec(14e-6), hidraw=dict(ioctl=_codec(14e-6)))
+    assert bench.compare(result, baseline, tolerance=0.25) == []
+    result = dict(codec=_codec(16e-6), hidraw=dict(ioctl=_codec(10e-6, 300)))
+    regressions = bench.compare(result, baseline, tolerance=0.25)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("codec getconfig")
+    assert regressions[1].startswith("hidraw ioctl getconfig")
+
+
+def test_old_hidapi_loopback_baseline_is_ignored():
+    baseline = dict(hidraw=dict(hidapi=_codec(1e-6), ioctl=_codec(10e-6)))
+    result = dict(hidraw=dict(ioctl=_codec(10e-6)))
+    assert bench.compare(result, baseline, tolerance=0.25) == []
+
+
+def test_measure_codec_reports_fastest_run():
+    results = bench.measure_codec(2, iterations=10)
+    assert set(results) == set(bench.CODEC_COMMANDS)
+    assert all(r["cpu_time"] > 0 for r in results.values())
+
+
+def test_repeat_must_be_positive(monkeypatch, capsys):
+    monkeypatch.setattr(
+        sys, "argv", ["vsbutil", "bench", "getconfig", "--repeat", "0"])
+    with pytest.raises(SystemExit) as e:
+        run()
+    assert e.value.code == 2
+    assert "must be at least 1" in capsys.readouterr().err
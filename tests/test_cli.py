@@ -0,0 +1,108 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from vsbutil import SimulatedBackend, VerySeriousButton
+from vsbutil.bench import STARTUP_FORBIDDEN_MODULES
+from vsbutil.cli import run
+
+
+def test_cli_import_stays_lean():
+    modules = subprocess.run(
+        [sys.executable, "-c",
+         "import sys, vsbutil.cli; print('\\n'.join(sys.modules))"],
+        check=True, capture_output=True, text=True,
+        ).stdout.split()
+    assert not [name for name in STARTUP_FORBIDDEN_MODULES if name in modules]
+
+
+@pytest.fixture
+def simulated(monkeypatch):
+    VerySeriousButton.backend = SimulatedBackend(count=2)
+    return VerySeriousButton.backend
+
+
+def _run(monkeypatch, capsys, *args):
+    monkeypatch.setattr(sys, "argv", ["vsbutil", "--no-daemon"] + list(args))
+    status = run()
+    return status, capsys.readouterr().out
+
+
+def test_json_after_command(simulated, monkeypatch, capsys):
+    status, out = _run(monkeypatch, capsys, "getconfig", "--json")
+    assert status == 0
+    device, = [json.loads(line) for line in out.splitlines()]
+    assert device["serial"] == "SIM00001"
+    assert device["ok"]
+
+
+def test_json_after_several_commands(simulated, monkeypatch, capsys):
+    status, out = _run(
+        monkeypatch, capsys,
+        "--all", "getdevinfo", "getconfig", "getkeyseq", "--json")
+    assert status == 0
+    devices = [json.loads(line) for line in out.splitlines()]
+    assert sorted(device["serial"] for device in devices) == [
+        "SIM00001", "SIM00002"]
+    for device in devices:
+        assert device["ok"]
+        assert sorted(device["results"]) == [
+            "getconfig", "getdevinfo", "getkeyseq"]
+
+
+def test_without_json_prints_text(simulated, monkeypatch, capsys):
+    status, out = _run(monkeypatch, capsys, "getserial")
+    assert status == 0
+    assert out.strip() == "SIM00001"
+
+
+@pytest.mark.parametrize("jobs", ["0", "-1"])
+def test_jobs_must_be_positive(jobs, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["vsbutil", "--all", "--jobs", jobs,
+                                      "getserial"])
+    with pytest.raises(SystemExit) as e:
+        run()
+    assert e.value.code == 2
+    assert "must be at least 1" in capsys.readouterr().err
+
+
+def test_no_retries_by_default():
+    modules = subprocess.run(
+        [sys.executable, "-c",
+         "import sys; "
+         "from vsbutil import SimulatedBackend, VerySeriousButton; "
+         "VerySeriousButton.backend = SimulatedBackend(); "
+         "sys.argv = ['vsbutil', '--no-daemon', 'getconfig']; "
+         "from vsbutil.cli import run; run(); "
+         "print('\\n'.join(sys.modules))"],
+        check=True, capture_output=True, text=True,
+        ).stdout.split()
+    assert "vsbutil._recovery" not in modules
+
+
+def test_setkeyseq_sends_one_setcfg(simulated, monkeypatch, capsys):
+    fw = simulated.get("SIM00001")
+    status, out = _run(monkeypatch, capsys, "setkeyseq", "A", "B")
+    assert status == 0
+    assert fw.command_counts[VerySeriousButton.VSB_CMD_SETCFG] == 1
+    assert fw.config[0] == VerySeriousButton.MODE_KEYSEQ
+    assert fw.config[-1] == 2
+
+
+def test_eepdump_eeprestore_round_trip(simulated, monkeypatch, capsys,
+                                       tmp_path):
+    image = str(tmp_path / "{serial}.bin")
+    status, out = _run(
+        monkeypatch, capsys, "--all", "eepdump", image, "--nbytes", "32")
+    assert status == 0
+    fw = simulated.get("SIM00002")
+    saved = (tmp_path / "SIM00002.bin").read_bytes()
+    assert saved == fw.eeprom[:32]
+    fw.eeprom[7] ^= 0xFF
+    status, out = _run(
+        monkeypatch, capsys, "--serial", "SIM00002", "eeprestore", image)
+    assert status == 0
+    assert "1 bytes written to EEPROM, 31 unchanged." in out
+    assert fw.eeprom[:32] == saved
@@ -0,0 +1,73 @@
+import pytest
+
+from vsbutil import VerySeriousButton
+from vsbutil._codec import (
+    DEVICE_INFO,
+    EEPROM_BYTE,
+    DeviceConfig,
+    DeviceInfo,
+    ReportCodec,
+    )
+
+
+REPORT_ID = VerySeriousButton.REPORTID_VSB
+SIZE = VerySeriousButton.VSB_FEATREP_SIZE
+SETCFG = VerySeriousButton.VSB_CMD_SETCFG
+
+
+@pytest.fixture
+def codec():
+    return ReportCodec(REPORT_ID, SIZE)
+
+
+@pytest.mark.parametrize("config", [
+    DeviceConfig(1, 0, [0] * 6, 0),
+    DeviceConfig(2, 0x05, [4, 5, 6, 0, 0, 0], 0),
+    DeviceConfig(3, 0xFF, [0xFF] * 6, 64),
+    ])
+def test_config_round_trip(codec, config):
+    report = codec.encode_config(SETCFG, config)
+    assert bytes(report[:2]) == bytes([REPORT_ID, SETCFG])
+    codec.decode(list(report))
+    assert DeviceConfig.decode(codec.payload, 6) == config
+
+
+def test_page_and_struct_round_trip(codec):
+    page = bytes([2, 4, 5, 6, 0, 0, 0])
+    codec.decode(list(codec.encode_page(
+        VerySeriousButton.VSB_CMD_WRITEPAGE, 9, page)))
+    assert codec.payload[0] == 9
+    assert bytes(codec.payload[1:1+len(page)]) == page
+    codec.decode(list(codec.encode_struct(
+        VerySeriousButton.VSB_CMD_EEPWRITE, EEPROM_BYTE, 0x3FF, 0xA5)))
+    assert EEPROM_BYTE.unpack_from(codec.payload) == (0x3FF, 0xA5)
+    codec.decode(list(codec.encode(
+        VerySeriousButton.VSB_CMD_GETDEVINFO, DEVICE_INFO.pack(6, 6, 7, 64))))
+    assert DeviceInfo.decode(codec.payload) == dict(
+        singlekey_nkeys=6, keyseq_nkeys=6, keyseq_pagesize=7,
+        keyseq_npages=64)
+
+
+def test_buffers_are_reused(codec):
+    first = codec.encode(VerySeriousButton.VSB_CMD_GETCFG)
+    second = codec.encode(VerySeriousButton.VSB_CMD_GETSERIAL)
+    assert first.obj is second.obj
+    assert codec.decode([REPORT_ID, 1, 1]).obj is codec.decode([0] * 8).obj
+
+
+def test_too_long_data_is_refused(codec):
+    with pytest.raises(ValueError):
+        codec.encode(SETCFG, bytes(SIZE))
+
+
+def test_records_act_like_dicts():
+    config = DeviceConfig(2, 0, [4, 0, 0, 0, 0, 0], 0)
+    copy = config.copy()
+    copy["keycodes"][0] = 5
+    copy.update(mods=2)
+    assert config["keycodes"][0] == 4
+    assert config == dict(mode=2, mods=0, keycodes=[4, 0, 0, 0, 0, 0],
+                          keyseq_len=0)
+    assert copy.get("mods") == 2
+    with pytest.raises(KeyError):
+        config["colour"] = 1
@@ -0,0 +1,68 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from vsbutil import (
+    DaemonServer,
+    RemoteVerySeriousButton,
+    SimulatedBackend,
+    VerySeriousButton,
+    )
+from vsbutil.cli import run
+
+
+@pytest.fixture
+def daemon():
+    backend = SimulatedBackend(count=1)
+    server = DaemonServer(backend=backend)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    for i in range(100):
+        if server._server is not None:
+            break
+        time.sleep(0.01)
+    yield backend
+    server.shutdown()
+    thread.join()
+
+
+def _change_elsewhere(backend, **changes):
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        vsb.update_config(**changes)
+    finally:
+        vsb.close()
+
+
+def test_execute_rereads_config_changed_elsewhere(daemon, monkeypatch):
+    fw = daemon.get("SIM00001")
+    monkeypatch.setattr(sys, "argv", ["vsbutil", "setjoy"])
+    assert run() == 0
+    _change_elsewhere(
+        daemon, mode=VerySeriousButton.MODE_SINGLEKEY, keycodes=[4])
+    assert fw.config[0] == VerySeriousButton.MODE_SINGLEKEY
+    assert run() == 0
+    assert fw.config[0] == VerySeriousButton.MODE_GAMEPAD
+    # setjoy keeps the keycodes written elsewhere, not a stale copy
+    assert fw.config[2:8] == bytes([4, 0, 0, 0, 0, 0])
+
+
+def test_call_rereads_config_changed_elsewhere(daemon):
+    remote = RemoteVerySeriousButton("SIM00001")
+    try:
+        assert remote.get_cached_config()["mods"] == 0
+        _change_elsewhere(daemon, mods=2)
+        assert remote.get_cached_config()["mods"] == 2
+    finally:
+        remote.close()
+
+
+def test_apply_through_daemon(daemon, tmp_path, monkeypatch):
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text('{"devices": {"*": {"mode": "singlekey"}}}')
+    monkeypatch.setattr(sys, "argv", ["vsbutil", "apply", str(manifest)])
+    assert run() == 0
+    fw = daemon.get("SIM00001")
+    assert fw.config[0] == VerySeriousButton.MODE_SINGLEKEY
@@ -0,0 +1,59 @@
+import json
+import sys
+
+import pytest
+
+from vsbutil import (
+    DeviceInfoCache,
+    SimulatedBackend,
+    SimulatedFirmware,
+    VerySeriousButton,
+    )
+from vsbutil.cli import run
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    # An entry for release 0x0100 as recorded from a unit with 64 pages
+    path = str(tmp_path / "devinfo.json")
+    fw = SimulatedFirmware(keyseq_npages=64)
+    vsb = VerySeriousButton(fw.serial_number, backend=SimulatedBackend([fw]))
+    try:
+        DeviceInfoCache(path).put(fw.release_number, vsb.get_device_info())
+    finally:
+        vsb.close()
+    return path
+
+
+@pytest.fixture
+def asked(monkeypatch):
+    asked = []
+    get_device_info = VerySeriousButton.get_device_info
+
+    def counting(self):
+        asked.append(self.serial_number)
+        return get_device_info(self)
+    monkeypatch.setattr(VerySeriousButton, "get_device_info", counting)
+    return asked
+
+
+def _getdevinfo(monkeypatch, capsys):
+    monkeypatch.setattr(
+        sys, "argv", ["vsbutil", "--no-daemon", "getdevinfo", "--json"])
+    assert run() == 0
+    return json.loads(capsys.readouterr().out)["results"]["getdevinfo"]
+
+
+def test_cache_is_off_by_default(cache_path, asked, monkeypatch, capsys):
+    # Same release as the cached entry, different geometry
+    VerySeriousButton.backend = SimulatedBackend(keyseq_npages=32)
+    assert _getdevinfo(monkeypatch, capsys)["keyseq_npages"] == 32
+    assert len(asked) == 2
+
+
+def test_cache_is_used_when_asked_for(cache_path, asked, monkeypatch, capsys):
+    VerySeriousButton.backend = SimulatedBackend(keyseq_npages=64)
+    monkeypatch.setenv("VSBUTIL_DEVINFO_CACHE", cache_path)
+    _getdevinfo(monkeypatch, capsys)
+    # Only the getdevinfo command itself asked the device
+    assert len(asked) == 1
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from vsbutil import Inventory, SimulatedBackend, VerySeriousButton
+
+
+VSB = VerySeriousButton
+
+
+@pytest.fixture
+def backend():
+    return SimulatedBackend(count=2)
+
+
+def _inventory(tmp_path, **kwargs):
+    inventory = VerySeriousButton.inventory = Inventory(
+        str(tmp_path / "inventory.sqlite"), **kwargs)
+    return inventory
+
+
+def _use(backend, serial, func):
+    vsb = VerySeriousButton(serial, backend=backend)
+    try:
+        return func(vsb)
+    finally:
+        vsb.close()
+
+
+def test_records_devices_with_fingerprints(tmp_path, backend):
+    inventory = _inventory(tmp_path)
+    for serial in ("SIM00001", "SIM00002"):
+        _use(backend, serial, lambda vsb: vsb.update_config(
+            mode=VSB.MODE_SINGLEKEY, keycodes=[4]))
+    entries = inventory.query(mode=VSB.MODE_SINGLEKEY)
+    assert [entry.serial for entry in entries] == ["SIM00001", "SIM00002"]
+    assert entries[0].fingerprint is not None
+    assert entries[0].fingerprint == entries[1].fingerprint
+    assert inventory.query(mode=VSB.MODE_KEYSEQ) == []
+    inventory.close()
+
+
+def test_known_device_opens_without_getdevinfo(tmp_path, backend):
+    inventory = _inventory(tmp_path)
+    _use(backend, "SIM00001", lambda vsb: None)
+    fw = backend.get("SIM00001")
+    n = fw.command_counts[VSB.VSB_CMD_GETDEVINFO]
+    assert _use(backend, "SIM00001", lambda vsb: vsb.num_keyseq_pages) == 64
+    assert fw.command_counts[VSB.VSB_CMD_GETDEVINFO] == n
+    inventory.close()
+
+
+def test_config_is_not_seeded_by_default(tmp_path, backend):
+    inventory = _inventory(tmp_path)
+    _use(backend, "SIM00001", lambda vsb: vsb.update_config(
+        mode=VSB.MODE_SINGLEKEY, keycodes=[4]))
+    # E.g. power-cycled, or reprogrammed from another host
+    fw = backend.get("SIM00001")
+    fw.config = fw.default_config()
+    _use(backend, "SIM00001", lambda vsb: vsb.update_config(
+        mode=VSB.MODE_SINGLEKEY, keycodes=[4]))
+    assert fw.config[0] == VSB.MODE_SINGLEKEY
+    assert fw.config[2] == 4
+    inventory.close()
+
+
+def test_seeding_is_opt_in(tmp_path, backend):
+    inventory = _inventory(tmp_path, max_age=3600.)
+    _use(backend, "SIM00001", lambda vsb: vsb.get_config())
+    fw = backend.get("SIM00001")
+    n = fw.command_counts[VSB.VSB_CMD_GETCFG]
+    _use(backend, "SIM00001", lambda vsb: vsb.update_config(
+        mode=VSB.MODE_GAMEPAD))
+    assert fw.command_counts[VSB.VSB_CMD_GETCFG] == n
+    assert VSB.VSB_CMD_SETCFG not in fw.command_counts
+    inventory.close()
+
+
+def test_real_commands_refresh_checked(tmp_path, backend):
+    inventory = _inventory(tmp_path, max_age=3600.)
+    _use(backend, "SIM00001", lambda vsb: vsb.get_config())
+    old = time.time() - 1000.
+
+    def age():
+        with inventory._db:
+            inventory._db.execute("UPDATE devices SET checked = ?", (old,))
+    age()
+    # Seeded, so this alone confirms nothing
+    _use(backend, "SIM00001", lambda vsb: None)
+    assert inventory.get("SIM00001").checked == old
+    _use(backend, "SIM00001", lambda vsb: vsb.get_config())
+    assert inventory.get("SIM00001").checked > old + 900.
+    age()
+    _use(backend, "SIM00001", lambda vsb: vsb.update_config(mods=2))
+    assert inventory.get("SIM00001").checked > old + 900.
+    inventory.close()
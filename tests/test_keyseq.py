@@ -0,0 +1,46 @@
+import pytest
+
+from vsbutil import KEYCODES, MODKEYS, compile_keyseq, pack_keyseq, parse_macro
+
+
+CTRL = MODKEYS["CTRL"]
+SHIFT = MODKEYS["SHIFT"]
+C, V = KEYCODES["C"], KEYCODES["V"]
+
+
+def test_explicit_chords_stay_apart():
+    assert compile_keyseq("{ctrl+c}{ctrl+v}", 6) == (
+        (CTRL, (C,)), (CTRL, (V,)))
+
+
+def test_text_is_packed():
+    pages = compile_keyseq("abc", 6)
+    assert pages == ((0, (KEYCODES["A"], KEYCODES["B"], KEYCODES["C"])),)
+
+
+def test_text_and_chords_mix():
+    pages = compile_keyseq("ab{b}cd", 6)
+    assert pages == (
+        (0, (KEYCODES["A"], KEYCODES["B"])),
+        (0, (KEYCODES["B"],)),
+        (0, (KEYCODES["C"], KEYCODES["D"])),
+        )
+
+
+def test_repeated_and_shifted_keys_split_pages():
+    pages = compile_keyseq("aaB", 6)
+    assert pages == (
+        (0, (KEYCODES["A"],)),
+        (0, (KEYCODES["A"],)),
+        (SHIFT, (KEYCODES["B"],)),
+        )
+
+
+def test_pack_keyseq_without_chords_merges():
+    groups = parse_macro("{ctrl+c}{ctrl+v}")
+    assert pack_keyseq(groups, 6) == ((CTRL, (C, V)),)
+
+
+def test_too_long():
+    with pytest.raises(ValueError):
+        compile_keyseq("{a}{b}{c}", 6, max_pages=2)
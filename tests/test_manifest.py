@@ -0,0 +1,95 @@
+import json
+import sys
+
+import pytest
+
+from vsbutil import Manifest, SimulatedBackend, VerySeriousButton, plan_device
+from vsbutil.cli import run
+
+
+def _plan(devices, serial="SIM00001", backend=None):
+    vsb = VerySeriousButton(serial, backend=backend or SimulatedBackend())
+    try:
+        return plan_device(
+            vsb, Manifest.from_dict({"devices": devices}).spec_for(serial))
+    finally:
+        vsb.close()
+
+
+def test_save_skipped_when_stored_config_matches():
+    backend = SimulatedBackend()
+    backend.get("SIM00001").store_config()
+    assert _plan({"*": {"mode": "joystick", "save": True}}, backend=backend) \
+        .steps == []
+
+
+def test_save_without_other_changes():
+    # The running config is already the target, the stored one isn't
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    fw.store_config()
+    fw.config[0] = VerySeriousButton.MODE_SINGLEKEY
+    running = bytes(fw.config)
+    plan = _plan({"*": {"mode": "singlekey", "save": True}}, backend=backend)
+    assert plan.steps == [("SAVECFG", None)]
+    # Reading the stored config back doesn't change the running one
+    assert bytes(fw.config) == running
+
+
+def test_stored_target_still_needs_setcfg():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    fw.config[0] = VerySeriousButton.MODE_SINGLEKEY
+    fw.store_config()
+    fw.config[0] = VerySeriousButton.MODE_GAMEPAD
+    plan = _plan({"*": {"mode": "singlekey", "save": True}}, backend=backend)
+    assert [cmd for cmd, arg in plan.steps] == ["SETCFG"]
+    assert fw.config[0] == VerySeriousButton.MODE_GAMEPAD
+
+
+def test_save_comes_after_changes():
+    backend = SimulatedBackend()
+    backend.get("SIM00001").wipe_stored_config()
+    plan = _plan({"SIM00001": {"key": "ctrl+c", "save": True}},
+                 backend=backend)
+    assert [cmd for cmd, arg in plan.steps] == ["SETCFG", "SAVECFG"]
+
+
+def test_save_must_be_a_bool():
+    with pytest.raises(ValueError):
+        Manifest.from_dict({"devices": {"*": {"save": "always"}}})
+
+
+def test_no_save_no_changes_no_commands():
+    assert _plan({"*": {"mode": "joystick"}}).steps == []
+
+
+def test_missing_device_fails_alone(tmp_path, monkeypatch, capsys):
+    backend = SimulatedBackend(count=1)
+    VerySeriousButton.backend = backend
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"devices": {
+        "SIM00001": {"mode": "singlekey", "key": "ctrl+c"},
+        "NOPE": {"mode": "joystick"},
+        }}))
+    monkeypatch.setattr(
+        sys, "argv", ["vsbutil", "--no-daemon", "apply", str(manifest)])
+    assert run() == 1
+    fw = backend.get("SIM00001")
+    assert fw.config[0] == VerySeriousButton.MODE_SINGLEKEY
+    out = capsys.readouterr()
+    assert "NOPE: error" in out.out + out.err
+
+
+def test_manifest_parsed_once(tmp_path, monkeypatch):
+    VerySeriousButton.backend = SimulatedBackend(count=2)
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"devices": {"*": {"mode": "keyseq"}}}))
+    calls = []
+    load = Manifest.load.__func__
+    monkeypatch.setattr(Manifest, "load", classmethod(
+        lambda cls, path: calls.append(path) or load(cls, path)))
+    monkeypatch.setattr(
+        sys, "argv", ["vsbutil", "--no-daemon", "apply", str(manifest)])
+    assert run() == 0
+    assert calls == [str(manifest)]
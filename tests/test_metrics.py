@@ -0,0 +1,95 @@
+import re
+
+import pytest
+
+from vsbutil import (
+    Metrics,
+    QueryEvent,
+    SimulatedBackend,
+    VerySeriousButton,
+    VerySeriousButtonCommandError,
+    )
+
+
+VSB = VerySeriousButton
+
+
+@pytest.fixture
+def vsb():
+    vsb = VerySeriousButton("SIM00001", backend=SimulatedBackend())
+    yield vsb
+    vsb.close()
+
+
+def test_counts_commands_and_errors(vsb):
+    metrics = Metrics()
+    vsb.listeners.append(metrics)
+    vsb.get_config()
+    vsb.backend.get("SIM00001").inject_fault(
+        VSB.VSB_RESP_BADIDX, VSB.VSB_CMD_READPAGE)
+    with pytest.raises(VerySeriousButtonCommandError):
+        vsb.read_raw_keyseq_page(0)
+    stats = metrics.to_dict()
+    assert stats["GETCFG"]["count"] == 1
+    assert stats["GETCFG"]["errors"] == {}
+    assert stats["GETCFG"]["bytes_sent"] > 0
+    assert stats["READPAGE"]["errors"] == {"BADIDX": 1}
+    assert stats["READPAGE"]["histogram"][-1][1] == 1
+
+
+_SAMPLE = re.compile(
+    r'^vsbutil_[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? '
+    r'[0-9.e+-]+$')
+
+
+def test_prometheus_text_is_well_formed(vsb):
+    metrics = Metrics()
+    vsb.listeners.append(metrics)
+    vsb.get_config()
+    vsb.get_config()
+    text = metrics.to_prometheus()
+    assert text.endswith("\n")
+    declared = set()
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            name, kind = line.split()[2:]
+            assert kind in ("counter", "histogram")
+            declared.add(name)
+        elif not line.startswith("# HELP "):
+            assert _SAMPLE.match(line), line
+            name = line.split("{")[0]
+            assert name in declared or re.sub(
+                "_(bucket|sum|count)$", "", name) in declared
+    buckets = re.findall(
+        r'vsbutil_command_duration_seconds_bucket\{command="GETCFG",'
+        r'le="([^"]+)"\} (\d+)', text)
+    counts = [int(n) for le, n in buckets]
+    assert counts == sorted(counts)
+    assert buckets[-1] == ("+Inf", "2")
+    assert 'vsbutil_commands_total{command="GETCFG"} 2' in text
+
+
+def _event(elapsed):
+    return QueryEvent(
+        "SIM00001", VSB.VSB_CMD_GETCFG, elapsed, 0, 34, 34, VSB.VSB_RESP_OK,
+        None)
+
+
+def test_kept_samples_are_bounded():
+    metrics = Metrics(keep_samples=True, reservoir_size=10)
+    for i in range(1000):
+        metrics(_event(i / 1000.))
+    assert len(metrics.commands[VSB.VSB_CMD_GETCFG].samples) == 10
+    stats = metrics.to_dict()["GETCFG"]
+    assert stats["count"] == 1000
+    assert 0. <= stats["p50"] < 1.
+
+
+def test_failing_listener_keeps_the_command_error(vsb):
+    def broken(event):
+        raise RuntimeError("listener bug")
+    vsb.listeners.append(broken)
+    vsb.backend.get("SIM00001").inject_fault(
+        VSB.VSB_RESP_BADIDX, VSB.VSB_CMD_READPAGE)
+    with pytest.raises(VerySeriousButtonCommandError):
+        vsb.read_raw_keyseq_page(0)
@@ -0,0 +1,38 @@
+import time
+
+from vsbutil import Histogram, InputMonitor, SimulatedBackend
+
+
+def test_histogram_memory_is_bounded():
+    histogram = Histogram(reservoir_size=100)
+    for i in range(10000):
+        histogram.add(i * 1e-6)
+    assert histogram.count == 10000
+    assert len(histogram.samples) == 100
+    assert sum(histogram.bucket_counts) == 10000
+    assert histogram.min == 0. and histogram.max == 9999e-6
+    assert abs(histogram.mean - 4999.5e-6) < 1e-12
+    assert 3000e-6 < histogram.percentile(50) < 7000e-6
+
+
+def test_histogram_exact_while_small():
+    histogram = Histogram()
+    for value in (0.003, 0.001, 0.002):
+        histogram.add(value)
+    assert histogram.percentile(50) == 0.002
+    d = histogram.to_dict()
+    assert (d["count"], d["min"], d["max"]) == (3, 0.001, 0.003)
+
+
+def test_monitor_counts_reports():
+    backend = SimulatedBackend(poll_interval=0.001)
+    fw = backend.get("SIM00001")
+    with InputMonitor(backend=backend) as monitor:
+        fw.generate_input(50)
+        deadline = time.monotonic() + 2
+        while monitor.stats[0].reports < 50 and time.monotonic() < deadline:
+            time.sleep(0.01)
+            monitor.poll()
+    assert monitor.stats[0].reports == 50
+    assert monitor.overruns == 0
+    assert monitor.stats[0].intervals.count == 49
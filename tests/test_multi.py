@@ -0,0 +1,41 @@
+from vsbutil import (
+    SimulatedBackend,
+    VerySeriousButton,
+    VerySeriousButtonNotFound,
+    run_on_devices,
+    )
+
+
+def test_missing_serial_fails_alone():
+    backend = SimulatedBackend(count=2)
+    seen = []
+    results = run_on_devices(
+        lambda vsb: vsb.get_serialnum(),
+        serials=["SIM00002", "NOPE", "SIM00001"],
+        backend=backend,
+        callback=seen.append,
+        )
+    assert list(results) == ["SIM00002", "NOPE", "SIM00001"]
+    assert results["SIM00001"].ok and results["SIM00002"].ok
+    assert isinstance(results["NOPE"].error, VerySeriousButtonNotFound)
+    assert sorted(res.serial for res in seen) == [
+        "NOPE", "SIM00001", "SIM00002"]
+
+
+class _FailingClose(VerySeriousButton):
+
+    def close(self):
+        super().close()
+        if self.serial_number == "SIM00001":
+            raise OSError("inventory not writable")
+
+
+def test_close_error_fails_its_device_only():
+    results = run_on_devices(
+        lambda vsb: vsb.get_serialnum(),
+        backend=SimulatedBackend(count=2),
+        device_class=_FailingClose,
+        )
+    assert isinstance(results["SIM00001"].error, OSError)
+    assert results["SIM00002"].ok
+    assert results["SIM00002"].result == "SIM00002"
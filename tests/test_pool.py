@@ -0,0 +1,45 @@
+from vsbutil import DevicePool, SimulatedBackend, VerySeriousButton
+
+
+def _change_elsewhere(backend, **changes):
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        vsb.update_config(**changes)
+    finally:
+        vsb.close()
+
+
+def test_new_lease_rereads_config():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    pool = DevicePool(backend=backend)
+    try:
+        with pool.lease("SIM00001") as vsb:
+            vsb.read_raw_keyseq_page(0)
+            vsb.get_config()
+        _change_elsewhere(
+            backend, mode=VerySeriousButton.MODE_SINGLEKEY, keycodes=[4])
+        with pool.lease("SIM00001") as vsb:
+            vsb.update_config(mode=VerySeriousButton.MODE_GAMEPAD)
+            with vsb.exclusive() as dev:
+                assert dev._pages == {}
+        assert fw.config[0] == VerySeriousButton.MODE_GAMEPAD
+        # Fields not being changed are kept as the device had them
+        assert fw.config[2] == 4
+    finally:
+        pool.close()
+
+
+def test_keep_caches_reuses_shadow_config():
+    backend = SimulatedBackend()
+    pool = DevicePool(backend=backend)
+    try:
+        with pool.lease("SIM00001") as vsb:
+            vsb.get_config()
+        _change_elsewhere(backend, mods=2)
+        with pool.lease("SIM00001", keep_caches=True) as vsb:
+            assert vsb.get_cached_config()["mods"] == 0
+        with pool.lease("SIM00001") as vsb:
+            assert vsb.get_cached_config()["mods"] == 2
+    finally:
+        pool.close()
@@ -0,0 +1,92 @@
+import pytest
+
+from vsbutil import (
+    RetryPolicy,
+    SimulatedBackend,
+    VerySeriousButton,
+    VerySeriousButtonCommandError,
+    VerySeriousButtonNotFound,
+    VerySeriousButtonProtocolError,
+    VerySeriousButtonTimeout,
+    )
+from vsbutil._simulator import FAULT_WRONG_COMMAND
+
+
+VSB = VerySeriousButton
+
+
+@pytest.fixture
+def vsb():
+    backend = SimulatedBackend()
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    vsb.retry_policy = RetryPolicy(retries=2, backoff=0.)
+    yield vsb
+    vsb.close()
+
+
+@pytest.mark.parametrize("error, recovery", [
+    (VerySeriousButtonTimeout("no response"), "retry"),
+    (VerySeriousButtonCommandError(
+        "null", VSB.VSB_CMD_GETCFG, VSB.VSB_RESP_NULL), "retry"),
+    (VerySeriousButtonProtocolError("wrong command"), "resync"),
+    (OSError("transfer failed"), "reopen"),
+    (VerySeriousButtonCommandError(
+        "bad index", VSB.VSB_CMD_READPAGE, VSB.VSB_RESP_BADIDX), None),
+    (VerySeriousButtonNotFound("gone"), None),
+    ])
+def test_recovery_for(error, recovery):
+    assert RetryPolicy().recovery_for(error) == recovery
+
+
+def test_without_reopen_transfer_errors_are_resent():
+    policy = RetryPolicy(reopen=False)
+    assert policy.recovery_for(OSError("transfer failed")) == "retry"
+
+
+@pytest.mark.parametrize("fault, recovery", [
+    (VSB.VSB_RESP_NULL, "retry"),
+    (FAULT_WRONG_COMMAND, "resync"),
+    ])
+def test_recovers_from_fault(vsb, fault, recovery):
+    fw = vsb.backend.get("SIM00001")
+    fw.inject_fault(fault, VSB.VSB_CMD_GETCFG)
+    assert vsb.get_config()["mode"] == VSB.MODE_GAMEPAD
+    assert vsb.retry_policy.counts == {recovery: 1}
+
+
+def test_gives_up_after_retries(vsb):
+    fw = vsb.backend.get("SIM00001")
+    fw.inject_fault(VSB.VSB_RESP_NULL, VSB.VSB_CMD_GETCFG, count=3)
+    with pytest.raises(VerySeriousButtonCommandError):
+        vsb.get_config()
+    assert vsb.retry_policy.counts == {"retry": 2}
+
+
+def test_error_responses_are_final(vsb):
+    fw = vsb.backend.get("SIM00001")
+    fw.inject_fault(VSB.VSB_RESP_BADIDX, VSB.VSB_CMD_READPAGE)
+    with pytest.raises(VerySeriousButtonCommandError):
+        vsb.read_raw_keyseq_page(0)
+    assert fw.command_counts[VSB.VSB_CMD_READPAGE] == 1
+    assert vsb.retry_policy.counts == {}
+
+
+def test_only_idempotent_commands_are_repeated(vsb):
+    fw = vsb.backend.get("SIM00001")
+    fw.inject_fault(VSB.VSB_RESP_NULL, VSB.VSB_CMD_WIPECFG)
+    with pytest.raises(VerySeriousButtonCommandError):
+        vsb.init_stored_config()
+    assert fw.command_counts[VSB.VSB_CMD_WIPECFG] == 1
+
+
+@pytest.mark.parametrize("cmd_id", [VSB.VSB_CMD_SAVECFG, VSB.VSB_CMD_EEPWRITE])
+def test_eeprom_writes_are_not_repeated(vsb, cmd_id):
+    fw = vsb.backend.get("SIM00001")
+    fw.inject_fault(VSB.VSB_RESP_NULL, cmd_id)
+    with pytest.raises(VerySeriousButtonCommandError):
+        if cmd_id == VSB.VSB_CMD_SAVECFG:
+            vsb.store_current_config()
+        else:
+            vsb.write_eeprom_byte(0x100, 0x42)
+    assert fw.command_counts[cmd_id] == 1
+    assert vsb.retry_policy.counts == {}
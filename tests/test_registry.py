@@ -0,0 +1,71 @@
+import threading
+
+from vsbutil import DeviceRegistry, SimulatedBackend, SimulatedFirmware
+
+
+class _CountingBackend(SimulatedBackend):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.enumerations = 0
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        self.enumerations += 1
+        return super().enumerate(vendor_id, product_id)
+
+
+def test_enumeration_is_cached():
+    backend = _CountingBackend(count=2)
+    registry = DeviceRegistry(backend=backend, max_age=60.)
+    assert [dev[0] for dev in registry.list_connected()] == [
+        "SIM00001", "SIM00002"]
+    registry.list_connected()
+    registry.open("SIM00002").close()
+    assert backend.enumerations == 1
+
+
+def test_watcher_reports_arrivals_and_removals():
+    backend = SimulatedBackend()
+    registry = DeviceRegistry(backend=backend, settle_time=0.)
+    events = []
+    seen = threading.Semaphore(0)
+
+    def record(kind):
+        def callback(serial, release, path):
+            events.append((kind, serial))
+            seen.release()
+        return callback
+    registry.subscribe(on_arrival=record("+"), on_removal=record("-"))
+    with registry:
+        fw = SimulatedFirmware(serial="SIM00002")
+        backend.add(fw)
+        assert seen.acquire(timeout=5.)
+        assert registry.wait_for("SIM00002", timeout=5.)[0] == "SIM00002"
+        backend.remove(fw)
+        assert seen.acquire(timeout=5.)
+    assert events == [("+", "SIM00002"), ("-", "SIM00002")]
+    assert [dev[0] for dev in registry.list_connected()] == ["SIM00001"]
+
+
+def test_wait_for_times_out():
+    registry = DeviceRegistry(backend=SimulatedBackend(), poll_interval=0.01)
+    assert registry.wait_for("SIM00009", timeout=0.05) is None
+
+
+def test_callbacks_run_without_the_lock():
+    backend = SimulatedBackend()
+    registry = DeviceRegistry(backend=backend, max_age=0., poll_interval=0.01)
+    registry.list_connected()
+    answered = []
+
+    def on_arrival(serial, release, path):
+        # E.g. handing the device over to another thread that asks the
+        # registry about it
+        thread = threading.Thread(
+            target=lambda: answered.append(registry.list_connected()))
+        thread.start()
+        thread.join(1.)
+    registry.subscribe(on_arrival=on_arrival)
+    backend.add(SimulatedFirmware(serial="SIM00002"))
+    assert registry.wait_for("SIM00002", timeout=5.)[0] == "SIM00002"
+    assert len(answered) == 1
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from vsbutil import (
+    SimulatedBackend,
+    TransferScheduler,
+    VerySeriousButton,
+    run_on_devices,
+    topology_group,
+    )
+from vsbutil.cli import handle_cmdline_args
+
+
+@pytest.mark.parametrize("path, group", [
+    (b"1-2.3:1.0", "1-2"),
+    (b"1-2.3.1:1.0", "1-2.3"),
+    (b"1-4:1.0", "usb1"),
+    ("3-1:1.0", "usb3"),
+    (b"0002:0005:00", "usb2"),
+    (b"sim:SIM00001", None),
+    ])
+def test_topology_group(path, group):
+    assert topology_group(path) == group
+
+
+def test_order_interleaves_hubs():
+    devices = [
+        ("a", 0, b"1-1.1:1.0"), ("b", 0, b"1-1.2:1.0"),
+        ("c", 0, b"1-2.1:1.0"), ("d", 0, b"1-2.2:1.0"),
+        ]
+    assert TransferScheduler().order(devices) == ["a", "c", "b", "d"]
+
+
+def test_getdevinfo_on_open_is_scheduled():
+    scheduler = TransferScheduler()
+    vsb = VerySeriousButton(
+        "SIM00001", backend=SimulatedBackend(), scheduler=scheduler)
+    try:
+        # GETDEVINFO: a report sent and at least one response read
+        group, = scheduler.throughput().values()
+        assert group["devices"] == ["SIM00001"]
+        assert group["transfers"] >= 2
+    finally:
+        vsb.close()
+
+
+class _SlowDevice(object):
+    # Records how many transfers are in progress at once
+
+    active = 0
+    most = 0
+    lock = threading.Lock()
+
+    def send_feature_report(self, report):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.most = max(cls.most, cls.active)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.active -= 1
+        return len(report)
+
+
+class _Button(object):
+
+    def __init__(self, serial):
+        self.serial_number = serial
+        self.path = f"1-1.{serial}:1.0".encode()
+        self.hid_dev = _SlowDevice()
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 0])
+def test_transfers_per_hub(max_in_flight):
+    _SlowDevice.active = _SlowDevice.most = 0
+    scheduler = TransferScheduler(max_in_flight)
+    buttons = [_Button(i) for i in range(1, 5)]
+    assert {scheduler.attach(vsb) for vsb in buttons} == {"1-1"}
+    threads = [
+        threading.Thread(target=vsb.hid_dev.send_feature_report, args=(b"x",))
+        for vsb in buttons
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if max_in_flight:
+        assert _SlowDevice.most == max_in_flight
+    else:
+        assert _SlowDevice.most > 1
+    assert scheduler.throughput()["1-1"]["transfers"] == 4
+
+
+def test_devices_use_the_scheduler_from_the_start():
+    scheduler = TransferScheduler()
+    results = run_on_devices(
+        lambda vsb: None, backend=SimulatedBackend(count=2),
+        scheduler=scheduler)
+    assert all(res.ok for res in results.values())
+    # Nothing but the GETDEVINFO of opening each device
+    for group in scheduler.throughput().values():
+        assert group["transfers"] >= 2
+
+
+def test_no_hub_limit_by_default():
+    assert handle_cmdline_args(["vsbutil", "--all", "getserial"]).hub_jobs == 0
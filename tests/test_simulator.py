@@ -0,0 +1,87 @@
+import pytest
+
+from vsbutil import (
+    SimulatedBackend,
+    SimulatedFirmware,
+    VerySeriousButton,
+    VerySeriousButtonCommandError,
+    VerySeriousButtonProtocolError,
+    )
+from vsbutil._simulator import FAULT_WRONG_COMMAND
+
+
+def test_list_connected_selects_backend():
+    backend = SimulatedBackend(count=2)
+    found = VerySeriousButton.list_connected(backend=backend)
+    assert [serial for serial, release, path in found] == [
+        "SIM00001", "SIM00002"]
+    VerySeriousButton.backend = backend
+    assert VerySeriousButton.list_connected() == found
+
+
+def test_commands_change_emulated_state():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        assert vsb.get_serialnum() == "SIM00001"
+        vsb.update_config(mode=VerySeriousButton.MODE_SINGLEKEY)
+        assert fw.config[0] == VerySeriousButton.MODE_SINGLEKEY
+        vsb.write_eeprom_byte(0x300, 0x42)
+        assert fw.eeprom[0x300] == 0x42
+        assert vsb.read_eeprom_bytes(0x300, 1) == bytes([0x42])
+    finally:
+        vsb.close()
+
+
+def test_stored_config_survives_load():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        vsb.update_config(mode=VerySeriousButton.MODE_KEYSEQ)
+        vsb.store_current_config()
+        vsb.update_config(mode=VerySeriousButton.MODE_GAMEPAD)
+        vsb.load_stored_config()
+        assert vsb.get_config()["mode"] == VerySeriousButton.MODE_KEYSEQ
+        # A corrupt stored config is reported, not loaded
+        fw.eeprom[fw.CONFIG_ADDR] ^= 0xFF
+        with pytest.raises(VerySeriousButtonCommandError) as info:
+            vsb.load_stored_config()
+        assert info.value.response == VerySeriousButton.VSB_RESP_BADCS
+    finally:
+        vsb.close()
+
+
+def test_busy_polls_and_faults():
+    backend = SimulatedBackend(
+        busy_polls={VerySeriousButton.VSB_CMD_GETCFG: 3})
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        vsb.get_config()
+        fw.inject_fault(
+            VerySeriousButton.VSB_RESP_ERR,
+            cmd_id=VerySeriousButton.VSB_CMD_GETCFG)
+        with pytest.raises(VerySeriousButtonCommandError):
+            vsb.get_config()
+        fw.inject_fault(FAULT_WRONG_COMMAND)
+        with pytest.raises(VerySeriousButtonProtocolError):
+            vsb.get_config()
+        # Faults are used up
+        vsb.get_config()
+    finally:
+        vsb.close()
+    assert fw.command_counts[VerySeriousButton.VSB_CMD_GETCFG] >= 4
+
+
+def test_hotplug():
+    backend = SimulatedBackend()
+    changes = []
+    backend.hotplug_listeners.append(lambda: changes.append(None))
+    fw = backend.add(SimulatedFirmware(serial="SIM00002"))
+    assert len(VerySeriousButton.list_connected(backend=backend)) == 2
+    backend.remove(fw)
+    assert len(VerySeriousButton.list_connected(backend=backend)) == 1
+    assert not fw.connected
+    assert len(changes) == 2
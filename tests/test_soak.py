@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from vsbutil import (
+    SimulatedBackend,
+    SoakTest,
+    VerySeriousButton,
+    VerySeriousButtonNotFound,
+    )
+
+
+def test_counts_only_its_own_devices():
+    backend = SimulatedBackend(count=2)
+    other = VerySeriousButton("SIM00002", backend=backend)
+    done = threading.Event()
+
+    def elsewhere():
+        # Someone else's commands while the soak runs
+        while not done.is_set():
+            other.get_config()
+    thread = threading.Thread(target=elsewhere)
+    test = SoakTest({"getcfg": 1}, duration=0.2, backend=backend)
+    thread.start()
+    try:
+        test.run(["SIM00001"])
+    finally:
+        done.set()
+        thread.join()
+        other.close()
+    totals = test.totals()
+    assert totals["ops"] == test.issued
+    assert list(totals["devices"]) == ["SIM00001"]
+
+
+def test_writepage_snapshot_reads_are_not_counted():
+    backend = SimulatedBackend()
+    test = SoakTest({"writepage": 1, "readpage": 1}, count=20, backend=backend)
+    test.run(["SIM00001"])
+    commands = test.totals()["commands"]
+    assert commands["writepage"]["count"] == 10
+    assert commands["readpage"]["count"] == 10
+
+
+def test_missing_device_on_resume_fails_alone(tmp_path):
+    path = str(tmp_path / "soak.json")
+    backend = SimulatedBackend(count=2)
+    test = SoakTest({"getcfg": 1}, count=10, checkpoint=path, backend=backend)
+    test.run(["SIM00001", "SIM00002"])
+    assert test.totals()["ops"] == 10
+    # Continue a longer run after one of the devices went away
+    test.count = 30
+    test.finished = False
+    test.save()
+    backend.remove(backend.get("SIM00002"))
+    resumed = SoakTest.resume(path, backend=backend)
+    resumed.run()
+    totals = resumed.totals()
+    assert totals["ops"] == 30
+    assert totals["devices"]["SIM00002"]["failed"] == 1
+    assert totals["devices"]["SIM00001"]["failed"] == 0
+
+
+def test_no_device_can_be_opened():
+    test = SoakTest({"getcfg": 1}, count=10, backend=SimulatedBackend())
+    with pytest.raises(VerySeriousButtonNotFound):
+        test.run(["SIM00009"])
@@ -0,0 +1,107 @@
+import json
+import sys
+
+import pytest
+
+from vsbutil import (
+    RecordingBackend,
+    ReplayBackend,
+    SimulatedBackend,
+    TranscriptMismatch,
+    VerySeriousButton,
+    )
+from vsbutil._transcript import REC_OPEN, iter_exchanges, read_transcript
+from vsbutil.cli import run
+
+
+def _record(path, backend=None):
+    recorder = RecordingBackend(backend or SimulatedBackend(), path)
+    vsb = VerySeriousButton(backend=recorder)
+    try:
+        vsb.update_config(mode=VerySeriousButton.MODE_SINGLEKEY, mods=2)
+        return vsb.get_config()
+    finally:
+        vsb.close()
+        recorder.close()
+
+
+def test_replay_serves_recorded_responses(tmp_path):
+    path = tmp_path / "session.vsbt"
+    config = _record(path)
+    replay = ReplayBackend(path, speed=0)
+    vsb = VerySeriousButton(backend=replay)
+    try:
+        vsb.update_config(mode=VerySeriousButton.MODE_SINGLEKEY, mods=2)
+        assert vsb.get_config() == config
+    finally:
+        vsb.close()
+    assert set(replay.remaining().values()) == {0}
+
+
+def test_replay_raises_on_divergence(tmp_path):
+    path = tmp_path / "session.vsbt"
+    _record(path)
+    vsb = VerySeriousButton(backend=ReplayBackend(path, speed=0))
+    try:
+        with pytest.raises(TranscriptMismatch):
+            vsb.update_config(mode=VerySeriousButton.MODE_KEYSEQ)
+    finally:
+        vsb.close()
+
+
+def test_replay_raises_past_the_end(tmp_path):
+    path = tmp_path / "session.vsbt"
+    _record(path)
+    vsb = VerySeriousButton(backend=ReplayBackend(path, speed=0))
+    try:
+        vsb.update_config(mode=VerySeriousButton.MODE_SINGLEKEY, mods=2)
+        vsb.get_config()
+        with pytest.raises(TranscriptMismatch):
+            vsb.get_config()
+    finally:
+        vsb.close()
+
+
+def test_replay_keeps_recorded_timing(tmp_path):
+    path = tmp_path / "session.vsbt"
+    _record(path, SimulatedBackend(
+        latency={VerySeriousButton.VSB_CMD_SETCFG: 0.05}))
+    setcfg, = [
+        exchange for exchange in iter_exchanges(read_transcript(path))
+        if exchange.cmd_id == VerySeriousButton.VSB_CMD_SETCFG]
+    assert setcfg.ready_after >= 0.05
+    assert setcfg.busy
+    vsb = VerySeriousButton(backend=ReplayBackend(path, speed=2))
+    try:
+        vsb.update_config(mode=VerySeriousButton.MODE_SINGLEKEY, mods=2)
+        assert vsb._busy_polls > 0
+    finally:
+        vsb.close()
+
+
+def test_sessions_append_and_truncation_is_tolerated(tmp_path):
+    path = tmp_path / "session.vsbt"
+    _record(path)
+    _record(path)
+    records = list(read_transcript(path))
+    opened = [rec.device for rec in records if rec.kind == REC_OPEN]
+    assert len(set(opened)) == 2
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    assert len(list(read_transcript(path))) == len(records) - 1
+
+
+def test_cli_record_then_replay(tmp_path, monkeypatch, capsys):
+    VerySeriousButton.backend = SimulatedBackend()
+    path = str(tmp_path / "session.vsbt")
+    monkeypatch.setattr(sys, "argv", [
+        "vsbutil", "--no-daemon", "--record", path, "getconfig", "--json"])
+    assert run() == 0
+    recorded = json.loads(capsys.readouterr().out)
+    VerySeriousButton.backend = None
+    monkeypatch.setattr(sys, "argv", [
+        "vsbutil", "--no-daemon", "--replay", path, "--replay-speed", "0",
+        "getconfig", "--json"])
+    assert run() == 0
+    replayed = json.loads(capsys.readouterr().out)
+    assert replayed["results"] == recorded["results"]
@@ -0,0 +1,203 @@
+import io
+import time
+
+import pytest
+
+from vsbutil import (
+    SimulatedBackend,
+    VerySeriousButton,
+    VerySeriousButtonTimeout,
+    )
+from vsbutil._simulator import FAULT_NO_RESPONSE
+
+
+class _RecordingSleeps(VerySeriousButton):
+    def __init__(self, *args, **kwargs):
+        self.sleeps = []
+        super().__init__(*args, **kwargs)
+
+    def _sleep(self, delay):
+        self.sleeps.append(delay)
+        super()._sleep(delay)
+
+
+def _open(backend):
+    vsb = _RecordingSleeps("SIM00001", backend=backend)
+    del vsb.sleeps[:]
+    return vsb
+
+
+def test_busy_polls_back_off_from_short_interval():
+    backend = SimulatedBackend(
+        busy_polls={VerySeriousButton.VSB_CMD_GETCFG: 3})
+    vsb = _open(backend)
+    try:
+        vsb.get_config()
+    finally:
+        vsb.close()
+    step = VerySeriousButton.POLL_INTERVAL_MIN
+    backoff = VerySeriousButton.POLL_BACKOFF
+    assert vsb.sleeps == pytest.approx([step, step * backoff,
+                                        step * backoff ** 2])
+
+
+def test_learns_completion_time_per_command():
+    backend = SimulatedBackend(
+        latency={VerySeriousButton.VSB_CMD_SAVECFG: 0.02})
+    vsb = _open(backend)
+    try:
+        vsb.store_current_config()
+        first_polls = vsb._busy_polls
+        for i in range(3):
+            vsb.store_current_config()
+        estimates = vsb.response_time_estimates
+        assert estimates[VerySeriousButton.VSB_CMD_SAVECFG] >= 0.015
+        # With the estimate known, most of the wait is one sleep
+        assert vsb._busy_polls < first_polls
+        vsb.get_config()
+        assert estimates[VerySeriousButton.VSB_CMD_GETCFG] < 0.015
+    finally:
+        vsb.close()
+
+
+def test_deadline_not_poll_count():
+    backend = SimulatedBackend()
+    vsb = _open(backend)
+    vsb.READ_TIMEOUT = 0.05
+    backend.get("SIM00001").inject_fault(FAULT_NO_RESPONSE)
+    try:
+        start = time.monotonic()
+        with pytest.raises(VerySeriousButtonTimeout):
+            vsb.get_config()
+        elapsed = time.monotonic() - start
+    finally:
+        vsb.close()
+    assert 0.05 <= elapsed < 0.5
+    assert max(vsb.sleeps) <= VerySeriousButton.READ_INTERVAL
+
+
+def _sent(fw, cmd_id):
+    return fw.command_counts.get(cmd_id, 0)
+
+
+def test_config_transaction_sends_one_setcfg():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        with vsb.config_transaction() as cfg:
+            cfg["mode"] = VerySeriousButton.MODE_SINGLEKEY
+            vsb.update_config(mods=2)
+            vsb.update_config(keycodes=[4, 5])
+    finally:
+        vsb.close()
+    assert _sent(fw, VerySeriousButton.VSB_CMD_SETCFG) == 1
+    assert fw.config[:4] == bytes([VerySeriousButton.MODE_SINGLEKEY, 2, 4, 5])
+
+
+def test_config_transaction_skips_unchanged_config():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        vsb.get_config()
+        reads = _sent(fw, VerySeriousButton.VSB_CMD_GETCFG)
+        with vsb.config_transaction() as cfg:
+            cfg["mods"] = 2
+            cfg["mods"] = 0
+        vsb.update_config(mode=VerySeriousButton.MODE_GAMEPAD)
+        # Both worked from the shadow copy
+        assert _sent(fw, VerySeriousButton.VSB_CMD_GETCFG) == reads
+    finally:
+        vsb.close()
+    assert _sent(fw, VerySeriousButton.VSB_CMD_SETCFG) == 0
+
+
+def test_config_transaction_discards_changes_on_error():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        with pytest.raises(RuntimeError):
+            with vsb.config_transaction() as cfg:
+                cfg["mods"] = 2
+                raise RuntimeError
+        assert vsb.get_cached_config()["mods"] == 0
+    finally:
+        vsb.close()
+    assert _sent(fw, VerySeriousButton.VSB_CMD_SETCFG) == 0
+
+
+def test_diff_write_skips_unchanged_pages():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        keyseq = [(0, [4]), (0, [5]), (2, [6])]
+        assert vsb.write_keyseq(keyseq)["written"] == [0, 1, 2]
+        writes = _sent(fw, VerySeriousButton.VSB_CMD_WRITEPAGE)
+        summary = vsb.write_keyseq(keyseq[:2] + [(0, [7])], diff=True)
+        assert summary == dict(written=[2], skipped=[0, 1])
+        assert _sent(fw, VerySeriousButton.VSB_CMD_WRITEPAGE) == writes + 1
+        # The pages just written serve as the current contents
+        assert _sent(fw, VerySeriousButton.VSB_CMD_READPAGE) == 0
+    finally:
+        vsb.close()
+    assert fw.read_page(2)[:2] == bytes([0, 7])
+
+
+def test_diff_write_reads_back_unknown_pages():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    try:
+        vsb.write_keyseq([(0, [4]), (0, [5])])
+        vsb.invalidate_keyseq_cache()
+        summary = vsb.write_keyseq([(0, [4]), (0, [5]), (0, [6])], diff=True)
+        assert summary == dict(written=[2], skipped=[0, 1])
+        assert _sent(fw, VerySeriousButton.VSB_CMD_READPAGE) == 3
+    finally:
+        vsb.close()
+    # keyseq_len follows the new length
+    assert fw.config[-1] == 3
+
+
+def test_dump_streams_in_chunks():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    f = io.BytesIO()
+    progress = []
+    try:
+        n = vsb.dump_eeprom(f, 0x100, 100, chunk_size=32,
+                            progress=lambda done, total: progress.append(done))
+    finally:
+        vsb.close()
+    assert n == 100
+    assert f.getvalue() == fw.eeprom[0x100:0x164]
+    assert progress == [32, 64, 96, 100]
+
+
+def test_dump_restore_writes_only_changed_bytes():
+    backend = SimulatedBackend()
+    fw = backend.get("SIM00001")
+    vsb = VerySeriousButton("SIM00001", backend=backend)
+    f = io.BytesIO()
+    try:
+        vsb.dump_eeprom(f, 0, 64)
+        fw.eeprom[3] ^= 0xFF
+        fw.eeprom[40] ^= 0xFF
+        summary = vsb.restore_eeprom(f.getvalue())
+        assert summary["written"] == [3, 40]
+        assert len(summary["skipped"]) == 62
+        assert _sent(fw, VerySeriousButton.VSB_CMD_EEPWRITE) == 2
+        # A known current image saves reading it back
+        reads = _sent(fw, VerySeriousButton.VSB_CMD_EEPREAD)
+        image = bytearray(f.getvalue())
+        image[5] ^= 0xFF
+        summary = vsb.restore_eeprom(image, current=f.getvalue())
+        assert summary["written"] == [5]
+        assert _sent(fw, VerySeriousButton.VSB_CMD_EEPREAD) == reads
+    finally:
+        vsb.close()
+    assert fw.eeprom[:64] == image
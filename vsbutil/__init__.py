@@ -3,8 +3,107 @@ try:
 except ModuleNotFoundError:
     __version__ = "v0.lol.idk🤷‍♀️"
 
+import importlib
+
 from . import _vsbutil
 from ._vsbutil import *
-from . import cli
 
-__all__ = ['cli'] + _vsbutil.__all__
+
+# Names from these submodules are imported on first access, so that
+# starting the CLI doesn't pay for asyncio, thread pools, sockets, etc.
+_LAZY_MODULES = {
+    '_simulator': [
+        'FAULT_BAD_REPORT_ID',
+        'FAULT_WRONG_COMMAND',
+        'FAULT_NO_RESPONSE',
+        'SimulatedFirmware',
+        'SimulatedBackend',
+        'SimulatedHidraw',
+        ],
+    '_multi': [
+        'DeviceResult',
+        'run_on_devices',
+        ],
+    '_async': [
+        'AsyncVerySeriousButton',
+        ],
+    '_registry': [
+        'DeviceRegistry',
+        ],
+    '_daemon': [
+        'default_socket_path',
+        'DaemonServer',
+        'DaemonClient',
+        'RemoteVerySeriousButton',
+        ],
+    '_manifest': [
+        'Manifest',
+        'DevicePlan',
+        'plan_device',
+        'apply_plan',
+        ],
+    '_metrics': [
+        'Metrics',
+        ],
+    '_inventory': [
+        'Inventory',
+        'InventoryEntry',
+        'config_fingerprint',
+        ],
+    '_infocache': [
+        'DeviceInfoCache',
+        'default_info_cache_path',
+        ],
+    '_transcript': [
+        'RecordingBackend',
+        'ReplayBackend',
+        'TranscriptMismatch',
+        'read_transcript',
+        'iter_exchanges',
+        ],
+    '_scheduler': [
+        'topology_group',
+        'TransferScheduler',
+        ],
+    '_recovery': [
+        'RetryPolicy',
+        ],
+    '_pool': [
+        'DevicePool',
+        'PooledSession',
+        ],
+    '_soak': [
+        'SOAK_COMMANDS',
+        'parse_mix',
+        'SoakTest',
+        ],
+    '_monitor': [
+        'Histogram',
+        'InputMonitor',
+        'input_interfaces',
+        ],
+    '_hidraw': [
+        'HidrawDevice',
+        'HidrawBackend',
+        ],
+    '_keyseq': [
+        'parse_macro',
+        'pack_keyseq',
+        'compile_keyseq',
+        ],
+    }
+_LAZY_NAMES = {
+    name: module for module, names in _LAZY_MODULES.items() for name in names
+    }
+
+
+def __getattr__(name):
+    if name in ('cli', 'bench'):
+        return importlib.import_module(f".{name}", __name__)
+    if name in _LAZY_NAMES:
+        module = importlib.import_module(f".{_LAZY_NAMES[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['cli'] + _vsbutil.__all__ + list(_LAZY_NAMES)
@@ -0,0 +1,146 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+
+from ._vsbutil import VerySeriousButton, _PUBLIC_METHODS
+
+
+__all__ = [
+    'AsyncVerySeriousButton',
+    ]
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _CancellableButton(VerySeriousButton):
+    # Checks the current call's cancellation event between HID exchanges
+    # and while waiting for a busy device
+    cancel_event = None
+
+    def _sleep(self, delay):
+        event = self.cancel_event
+        if event is None:
+            return super()._sleep(delay)
+        if event.wait(delay):
+            raise _Cancelled()
+
+    def _do_query(self, cmd_id, data=b"", timeout=None, report=None):
+        event = self.cancel_event
+        if event is not None and event.is_set():
+            raise _Cancelled()
+        return super()._do_query(cmd_id, data, timeout, report)
+
+
+def _close_opened(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class AsyncVerySeriousButton(object):
+    """asyncio front end for VerySeriousButton.
+
+    Open with ``await AsyncVerySeriousButton.open(serial)``. Each device
+    gets a worker thread that performs the blocking HID exchanges, so the
+    event loop is never blocked and many devices can be driven at once.
+    Every method accepts a `call_timeout` keyword (seconds); on timeout or
+    task cancellation the operation stops at its next HID exchange. Any
+    `timeout` keyword is passed on to the device method, as for
+    do_query().
+    """
+
+    def __init__(self, vsb, executor):
+        self._vsb = vsb
+        self._executor = executor
+
+    @classmethod
+    async def list_connected(cls, backend=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, VerySeriousButton.list_connected, backend)
+
+    @classmethod
+    async def open(cls, serial=None, backend=None, connected=None,
+                   call_timeout=None):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"vsb-{serial or 'any'}")
+        opening = executor.submit(
+            _CancellableButton,
+            serial,
+            backend=backend,
+            connected=connected,
+            )
+        try:
+            vsb = await asyncio.wait_for(
+                asyncio.wrap_future(opening, loop=loop), call_timeout)
+        except BaseException:
+            # Timed out or cancelled; the device may still get opened, and
+            # nobody else will close it
+            opening.add_done_callback(_close_opened)
+            executor.shutdown(wait=False)
+            raise
+        return cls(vsb, executor)
+
+    def __getattr__(self, name):
+        # Expose device attributes and constants, but not blocking methods
+        value = getattr(self._vsb, name)
+        if callable(value) and not isinstance(value, type):
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}")
+        return value
+
+    def _run(self, cancel, name, args, kwargs):
+        self._vsb.cancel_event = cancel
+        try:
+            return getattr(self._vsb, name)(*args, **kwargs)
+        finally:
+            self._vsb.cancel_event = None
+
+    async def _call(self, name, *args, call_timeout=None, **kwargs):
+        if self._vsb.hid_dev is None:
+            raise ValueError("Device is closed")
+        loop = asyncio.get_running_loop()
+        cancel = threading.Event()
+        future = loop.run_in_executor(
+            self._executor,
+            functools.partial(self._run, cancel, name, args, kwargs),
+            )
+        try:
+            return await asyncio.wait_for(future, call_timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            cancel.set()
+            raise
+
+    async def close(self):
+        if self._executor is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._vsb.close)
+        finally:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _mirror(name):
+    async def method(self, *args, call_timeout=None, **kwargs):
+        return await self._call(
+            name, *args, call_timeout=call_timeout, **kwargs)
+    method.__name__ = name
+    method.__qualname__ = f"AsyncVerySeriousButton.{name}"
+    method.__doc__ = f"Coroutine version of VerySeriousButton.{name}()."
+    return method
+
+
+for _name in _PUBLIC_METHODS:
+    setattr(AsyncVerySeriousButton, _name, _mirror(_name))
+del _name
@@ -0,0 +1,218 @@
+import struct
+
+
+__all__ = [
+    'DeviceConfig',
+    'DeviceInfo',
+    'ReportCodec',
+    ]
+
+
+# Report ID, command ID, response code
+REPORT_HEADER = struct.Struct("BBB")
+HEADER_SIZE = REPORT_HEADER.size
+DEVICE_INFO = struct.Struct("BBBB")
+CONFIG_HEADER = struct.Struct("BB")
+CONFIG_KEYSEQ_LEN_OFFSET = 8
+EEPROM_ADDR = struct.Struct(">H")
+EEPROM_BYTE = struct.Struct(">HB")
+
+
+_config_structs = {}
+
+
+def _config_struct(nkeys):
+    # Mode, modifiers and `nkeys` keycodes
+    fmt = _config_structs.get(nkeys)
+    if fmt is None:
+        fmt = _config_structs[nkeys] = struct.Struct(f"BB{nkeys}B")
+    return fmt
+
+
+class _Record(object):
+    # Fixed set of fields with dict-style access, so code written for the
+    # dicts these records replace keeps working
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, key) for key in self.__slots__]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def update(self, other=(), **kwargs):
+        if hasattr(other, "keys"):
+            other = [(key, other[key]) for key in other.keys()]
+        for key, value in other:
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self.values() == other.values()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            f"{key}={value!r}" for key, value in self.items()))
+
+
+class DeviceConfig(_Record):
+    __slots__ = ('mode', 'mods', 'keycodes', 'keyseq_len')
+
+    def __init__(self, mode, mods, keycodes, keyseq_len):
+        self.mode = mode
+        self.mods = mods
+        self.keycodes = keycodes
+        self.keyseq_len = keyseq_len
+
+    def copy(self):
+        return DeviceConfig(
+            self.mode, self.mods, list(self.keycodes), self.keyseq_len)
+
+    @classmethod
+    def decode(cls, data, nkeys):
+        fields = _config_struct(nkeys).unpack_from(data)
+        return cls(
+            fields[0],
+            fields[1],
+            list(fields[2:]),
+            data[CONFIG_KEYSEQ_LEN_OFFSET],
+            )
+
+
+class DeviceInfo(_Record):
+    __slots__ = (
+        'singlekey_nkeys', 'keyseq_nkeys', 'keyseq_pagesize', 'keyseq_npages')
+
+    def __init__(self, singlekey_nkeys, keyseq_nkeys, keyseq_pagesize,
+                 keyseq_npages):
+        self.singlekey_nkeys = singlekey_nkeys
+        self.keyseq_nkeys = keyseq_nkeys
+        self.keyseq_pagesize = keyseq_pagesize
+        self.keyseq_npages = keyseq_npages
+
+    @classmethod
+    def decode(cls, data):
+        return cls(*DEVICE_INFO.unpack_from(data))
+
+
+class ReportCodec(object):
+    """Builds command reports in, and parses responses out of, a pair of
+    preallocated buffers reused for every exchange with one device.
+
+    Views of every possible report length are made up front, so encoding
+    and decoding allocate nothing. Views returned by encode*() and
+    decode(), and `payload`, are only valid until the next call.
+    """
+
+    __slots__ = (
+        'report_id', 'size', 'payload', '_tx', '_tx_views', '_rx',
+        '_rx_views', '_payload_views',
+        )
+
+    def __init__(self, report_id, size):
+        self.report_id = report_id
+        self.size = size
+        self._tx = bytearray(size)
+        tx_view = memoryview(self._tx)
+        self._tx_views = [tx_view[:n] for n in range(size + 1)]
+        self._rx = bytearray(size + 1)
+        rx_view = memoryview(self._rx)
+        self._rx_views = [rx_view[:n] for n in range(size + 2)]
+        self._payload_views = [
+            rx_view[HEADER_SIZE:max(n, HEADER_SIZE)] for n in range(size + 2)]
+        # Response data (after the header) of the last decoded report
+        self.payload = self._payload_views[0]
+
+    def _too_long(self, payload_len):
+        raise ValueError(
+            f"Command data too long ({payload_len} bytes, maximum "
+            f"{self.size - HEADER_SIZE})"
+            )
+
+    def encode(self, cmd_id, data=b""):
+        n = HEADER_SIZE + len(data)
+        if n > self.size:
+            self._too_long(len(data))
+        REPORT_HEADER.pack_into(self._tx, 0, self.report_id, cmd_id, 0)
+        self._tx[HEADER_SIZE:n] = data
+        return self._tx_views[n]
+
+    def encode_struct(self, cmd_id, fmt, *values):
+        n = HEADER_SIZE + fmt.size
+        if n > self.size:
+            self._too_long(fmt.size)
+        REPORT_HEADER.pack_into(self._tx, 0, self.report_id, cmd_id, 0)
+        fmt.pack_into(self._tx, HEADER_SIZE, *values)
+        return self._tx_views[n]
+
+    def encode_config(self, cmd_id, config):
+        nkeys = len(config.keycodes)
+        n = HEADER_SIZE + CONFIG_HEADER.size + nkeys + 1
+        if n > self.size:
+            self._too_long(n - HEADER_SIZE)
+        tx = self._tx
+        REPORT_HEADER.pack_into(tx, 0, self.report_id, cmd_id, 0)
+        CONFIG_HEADER.pack_into(tx, HEADER_SIZE, config.mode, config.mods)
+        off = HEADER_SIZE + CONFIG_HEADER.size
+        tx[off:off+nkeys] = config.keycodes
+        tx[off+nkeys] = config.keyseq_len
+        return self._tx_views[n]
+
+    def encode_page(self, cmd_id, index, page):
+        n = HEADER_SIZE + 1 + len(page)
+        if n > self.size:
+            self._too_long(n - HEADER_SIZE)
+        tx = self._tx
+        REPORT_HEADER.pack_into(tx, 0, self.report_id, cmd_id, 0)
+        tx[HEADER_SIZE] = index
+        tx[HEADER_SIZE+1:n] = page
+        return self._tx_views[n]
+
+    def decode(self, report):
+        # Copies the report into the receive buffer (hidapi hands us a
+        # list) and returns a view of it
+        n = len(report)
+        if n > self.size + 1:
+            view = memoryview(bytes(report))
+            self.payload = view[HEADER_SIZE:]
+            return view
+        self._rx[:n] = report
+        self.payload = self._payload_views[n]
+        return self._rx_views[n]
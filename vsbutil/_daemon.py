@@ -0,0 +1,370 @@
+import json
+import os
+import socket
+import threading
+import types
+
+from . import _vsbutil
+from ._vsbutil import (
+    DeviceConfig,
+    DeviceInfo,
+    VerySeriousButton,
+    VerySeriousButtonIoError,
+    VerySeriousButtonCommandError,
+    _PUBLIC_METHODS,
+    )
+
+
+__all__ = [
+    'default_socket_path',
+    'DaemonServer',
+    'DaemonClient',
+    'RemoteVerySeriousButton',
+    ]
+
+
+# Methods that take or return objects that can't cross the socket
+_LOCAL_ONLY_METHODS = {'dump_eeprom'}
+_REMOTE_METHODS = [m for m in _PUBLIC_METHODS if m not in _LOCAL_ONLY_METHODS]
+
+_DEVICE_ATTRIBUTES = [
+    'serial_number',
+    'release_number',
+    'keyseq_page_size',
+    'keyseq_nkeys',
+    'num_keyseq_pages',
+    'singlekey_nkeys',
+    ]
+
+
+def default_socket_path():
+    path = os.environ.get("VSBUTIL_SOCKET")
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "vsbutil.sock")
+    return f"/tmp/vsbutil-{os.getuid()}.sock"
+
+
+def _encode(obj):
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {"__bytes__": bytes(obj).hex()}
+    if isinstance(obj, (DeviceConfig, DeviceInfo)):
+        obj = obj.to_dict()
+    if isinstance(obj, dict):
+        return {k: _encode(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(v) for v in obj]
+    return obj
+
+
+def _decode(obj):
+    if isinstance(obj, dict):
+        if set(obj) == {"__bytes__"}:
+            return bytearray.fromhex(obj["__bytes__"])
+        return {k: _decode(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    return obj
+
+
+def _error_reply(e):
+    reply = {"ok": False, "error": type(e).__name__, "message": str(e)}
+    if isinstance(e, VerySeriousButtonCommandError):
+        reply.update(cmd_id=e.cmd_id, response=e.response)
+    return reply
+
+
+_BUILTIN_ERRORS = {
+    "ValueError": ValueError,
+    "KeyError": KeyError,
+    "TypeError": TypeError,
+    }
+
+
+def _raise_error(reply):
+    name = reply.get("error")
+    cls = _BUILTIN_ERRORS.get(name)
+    if cls is None:
+        cls = getattr(_vsbutil, name, None)
+        if not (isinstance(cls, type)
+                and issubclass(cls, VerySeriousButtonIoError)):
+            cls = VerySeriousButtonIoError
+    message = reply.get("message", "Unknown daemon error")
+    if issubclass(cls, VerySeriousButtonCommandError):
+        raise cls(message, reply.get("cmd_id"), reply.get("response"))
+    raise cls(message)
+
+
+class DaemonServer(object):
+    """Keeps VSB handles open and serves commands on a Unix socket.
+
+    Requests and replies are single JSON objects per line. Commands on one
+    device run one at a time; commands on different devices run
+    concurrently.
+    """
+
+    def __init__(self, socket_path=None, backend=None, max_workers=8,
+                 scheduler=None):
+        from ._registry import DeviceRegistry
+        from ._pool import DevicePool
+        self.socket_path = socket_path or default_socket_path()
+        self.registry = DeviceRegistry(backend=backend)
+        self.max_workers = max_workers
+        # Optional TransferScheduler for the transfers of all devices
+        self.scheduler = scheduler
+        # Handles stay open for as long as the devices are connected
+        self.pool = DevicePool(
+            registry=self.registry, idle_timeout=None, scheduler=scheduler)
+        self._server = None
+
+    def _on_arrival(self, serial, release, path):
+        try:
+            self.pool.open(serial)
+        except IOError:
+            pass
+
+    def with_device(self, serial, func):
+        return self.pool.run(serial, func, keep_caches=True)
+
+    def with_fresh_device(self, serial, func):
+        # The device may have been changed by other programs since the
+        # last request; don't trust the shadow config and keyseq pages
+        return self.pool.run(serial, func)
+
+    def _execute(self, serial, opts):
+        from .cli import execute
+        lines = []
+        self.with_fresh_device(
+            serial, lambda vsb: execute(vsb, opts, out=lines.append))
+        return lines
+
+    def dispatch(self, request, reply):
+        op = request.get("op")
+        if op == "ping":
+            from . import __version__
+            reply({"ok": True, "result": __version__})
+        elif op == "list":
+            reply({"ok": True, "result": _encode(
+                self.registry.list_connected())})
+        elif op == "info":
+            result = self.with_device(
+                request.get("serial"),
+                lambda vsb: {k: getattr(vsb, k) for k in _DEVICE_ATTRIBUTES},
+                )
+            reply({"ok": True, "result": result})
+        elif op == "call":
+            method = request["method"]
+            if method not in _REMOTE_METHODS:
+                raise ValueError(f"Method {method!r} is not available")
+            args = _decode(request.get("args", []))
+            kwargs = _decode(request.get("kwargs", {}))
+            result = self.with_fresh_device(
+                request.get("serial"),
+                lambda vsb: getattr(vsb, method)(*args, **kwargs),
+                )
+            reply({"ok": True, "result": _encode(result)})
+        elif op == "execute":
+            # One reply per device as it finishes, then a final "done"
+            import argparse
+            from concurrent.futures import ThreadPoolExecutor, as_completed
+            from .cli import load_manifest
+            opts = argparse.Namespace(**request["opts"])
+            if opts.cmd == "apply":
+                load_manifest(opts)
+            serials = request.get("serials")
+            if serials == "all":
+                serials = [dev[0] for dev in self.registry.list_connected()]
+            elif serials is None:
+                serials = [None]
+            failed = 0
+            workers = max(1, min(self.max_workers, len(serials)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(self._execute, ser, opts): ser
+                    for ser in serials
+                    }
+                for future in as_completed(futures):
+                    try:
+                        result = {"ok": True, "lines": future.result()}
+                    except Exception as e:
+                        result = _error_reply(e)
+                        failed += 1
+                    result["serial"] = futures[future]
+                    reply(result)
+            reply({"ok": True, "done": True, "failed": failed})
+        else:
+            raise ValueError(f"Unknown request {op!r}")
+
+    def serve_forever(self):
+        import socketserver
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                lock = threading.Lock()
+
+                def reply(obj):
+                    with lock:
+                        self.wfile.write(json.dumps(obj).encode() + b"\n")
+                        self.wfile.flush()
+
+                try:
+                    for line in self.rfile:
+                        try:
+                            server.dispatch(json.loads(line), reply)
+                        except ConnectionError:
+                            raise
+                        except Exception as e:
+                            reply(_error_reply(e))
+                except ConnectionError:
+                    # Client went away
+                    pass
+
+        if os.path.exists(self.socket_path):
+            if DaemonClient.connect(self.socket_path) is not None:
+                raise OSError(
+                    f"A vsbutil daemon is already serving {self.socket_path}")
+            os.unlink(self.socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(
+                self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon_threads = True
+        self.registry.subscribe(on_arrival=self._on_arrival)
+        self.pool.start()
+        self.registry.start()
+        for dev in self.registry.list_connected():
+            self._on_arrival(*dev)
+        try:
+            self._server.serve_forever()
+        finally:
+            self.registry.stop()
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.registry.unsubscribe(on_arrival=self._on_arrival)
+            self.pool.close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class DaemonClient(object):
+    """Connection to a running vsbutil daemon."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, socket_path=None, timeout=None):
+        # Returns None if no daemon is listening
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path or default_socket_path())
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _send(self, request):
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+
+    def _receive(self):
+        line = self.rfile.readline()
+        if not line:
+            raise VerySeriousButtonIoError("vsbutil daemon closed connection")
+        return json.loads(line)
+
+    def request(self, request):
+        with self.lock:
+            self._send(request)
+            reply = self._receive()
+        if not reply.get("ok"):
+            _raise_error(reply)
+        return _decode(reply.get("result"))
+
+    def ping(self):
+        return self.request({"op": "ping"})
+
+    def list_connected(self):
+        return [tuple(dev) for dev in self.request({"op": "list"})]
+
+    def call(self, serial, method, *args, **kwargs):
+        return self.request({
+            "op": "call",
+            "serial": serial,
+            "method": method,
+            "args": _encode(args),
+            "kwargs": _encode(kwargs),
+            })
+
+    def execute(self, opts, serials=None):
+        """Run a CLI command (parsed options) on the daemon side.
+
+        `serials` is None for the first device, a list, or "all". Yields
+        one reply dict per device as it finishes.
+        """
+        with self.lock:
+            self._send({"op": "execute", "opts": opts, "serials": serials})
+            while True:
+                reply = self._receive()
+                if reply.get("done"):
+                    break
+                yield reply
+
+
+class RemoteVerySeriousButton(object):
+    """VerySeriousButton look-alike whose methods run in the daemon."""
+
+    def __init__(self, serial=None, client=None, socket_path=None):
+        if client is None:
+            client = DaemonClient.connect(socket_path)
+            if client is None:
+                raise VerySeriousButtonIoError("vsbutil daemon is not running")
+        self.client = client
+        info = client.request({"op": "info", "serial": serial})
+        for key in _DEVICE_ATTRIBUTES:
+            setattr(self, key, info[key])
+
+    def __getattr__(self, name):
+        # Constants and class helpers such as mode_string_for_value
+        value = getattr(VerySeriousButton, name)
+        if isinstance(value, types.FunctionType):
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}")
+        return value
+
+    def close(self):
+        self.client.close()
+
+
+def _mirror(name):
+    def method(self, *args, **kwargs):
+        return self.client.call(self.serial_number, name, *args, **kwargs)
+    method.__name__ = name
+    method.__qualname__ = f"RemoteVerySeriousButton.{name}"
+    method.__doc__ = f"Remote version of VerySeriousButton.{name}()."
+    return method
+
+
+for _name in _REMOTE_METHODS:
+    setattr(RemoteVerySeriousButton, _name, _mirror(_name))
+del _name
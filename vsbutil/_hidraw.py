@@ -0,0 +1,253 @@
+import os
+import select
+
+try:
+    import fcntl
+except ModuleNotFoundError:
+    # Not on Linux; the backend can still be driven with a fake ioctl
+    fcntl = None
+
+from ._vsbutil import VerySeriousButton
+
+
+__all__ = [
+    'HIDIOCSFEATURE',
+    'HIDIOCGFEATURE',
+    'parse_report_descriptor',
+    'HidrawDevice',
+    'HidrawBackend',
+    ]
+
+
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _IOC(direction, type_, nr, size):
+    return (direction << 30) | (size << 16) | (ord(type_) << 8) | nr
+
+
+def HIDIOCSFEATURE(length):
+    return _IOC(_IOC_WRITE | _IOC_READ, "H", 0x06, length)
+
+
+def HIDIOCGFEATURE(length):
+    return _IOC(_IOC_WRITE | _IOC_READ, "H", 0x07, length)
+
+
+# Report ID plus the largest VSB feature report
+REPORT_BUFFER_SIZE = VerySeriousButton.VSB_FEATREP_SIZE + 1
+
+_SET_FEATURE = [HIDIOCSFEATURE(n) for n in range(REPORT_BUFFER_SIZE + 1)]
+_GET_FEATURE = [HIDIOCGFEATURE(n) for n in range(REPORT_BUFFER_SIZE + 1)]
+
+_ITEM_SIZES = (0, 1, 2, 4)
+
+
+def parse_report_descriptor(descriptor):
+    """(usage page, usage) of the first top-level collection in a HID
+    report descriptor, as hidapi reports them."""
+    usage_page = usage = 0
+    i = 0
+    while i < len(descriptor):
+        prefix = descriptor[i]
+        if prefix == 0xFE:
+            # Long item: size, tag, data
+            if i + 1 >= len(descriptor):
+                break
+            i += 3 + descriptor[i+1]
+            continue
+        size = _ITEM_SIZES[prefix & 0x03]
+        value = int.from_bytes(descriptor[i+1:i+1+size], "little")
+        item = prefix & 0xFC
+        if item == 0x04:
+            usage_page = value
+        elif item == 0x08:
+            if size == 4:
+                # Extended usage: page in the high half
+                usage_page, value = value >> 16, value & 0xFFFF
+            usage = value
+        elif item == 0xA0:
+            break
+        i += 1 + size
+    return usage_page, usage
+
+
+class HidrawDevice(object):
+    """hid.device look-alike that exchanges feature reports with a
+    /dev/hidrawN node through HIDIOCSFEATURE/HIDIOCGFEATURE ioctls.
+
+    Reports go through two buffers allocated with the device, and
+    get_feature_report() returns a view of the receive buffer (valid
+    until the next call) instead of a new list. `ioctl`, `os_open` and
+    `os_close` stand in for fcntl.ioctl, os.open and os.close, e.g. to
+    run against a fake file descriptor.
+    """
+
+    def __init__(self, ioctl=None, os_open=None, os_close=None):
+        if ioctl is None:
+            if fcntl is None:
+                raise OSError("hidraw ioctls are only available on Linux")
+            ioctl = fcntl.ioctl
+        self._ioctl = ioctl
+        self._open = os_open or os.open
+        self._close = os_close or os.close
+        self.fd = None
+        self.nonblocking = False
+        self._tx = bytearray(REPORT_BUFFER_SIZE)
+        self._rx = bytearray(REPORT_BUFFER_SIZE)
+        rx_view = memoryview(self._rx)
+        self._rx_views = [rx_view[:n] for n in range(REPORT_BUFFER_SIZE + 1)]
+
+    def open_path(self, path):
+        if self.fd is not None:
+            self.close()
+        self.fd = self._open(path, os.O_RDWR | os.O_CLOEXEC)
+
+    def set_nonblocking(self, v):
+        # Feature report ioctls block either way
+        self.nonblocking = bool(v)
+        return 0
+
+    def send_feature_report(self, report):
+        fd = self.fd
+        if fd is None:
+            raise ValueError("not open")
+        n = len(report)
+        if n > REPORT_BUFFER_SIZE:
+            raise ValueError(
+                f"Feature report too long ({n} bytes, maximum "
+                f"{REPORT_BUFFER_SIZE})"
+                )
+        tx = self._tx
+        tx[:n] = report
+        return self._ioctl(fd, _SET_FEATURE[n], tx, True)
+
+    def get_feature_report(self, report_id, max_length):
+        fd = self.fd
+        if fd is None:
+            raise ValueError("not open")
+        if max_length > REPORT_BUFFER_SIZE:
+            max_length = REPORT_BUFFER_SIZE
+        rx = self._rx
+        rx[0] = report_id
+        return self._rx_views[
+            self._ioctl(fd, _GET_FEATURE[max_length], rx, True)]
+
+    def read(self, max_length, timeout_ms=0):
+        # Input report; [] on timeout. Needs a real file descriptor
+        fd = self.fd
+        if fd is None:
+            raise ValueError("not open")
+        if timeout_ms > 0:
+            timeout = timeout_ms / 1e3
+        elif self.nonblocking:
+            timeout = 0.
+        else:
+            timeout = None
+        if not select.select([fd], [], [], timeout)[0]:
+            return []
+        return os.read(fd, max_length)
+
+    def close(self):
+        if self.fd is not None:
+            fd, self.fd = self.fd, None
+            self._close(fd)
+
+
+def _read_attr(directory, name, default=None):
+    try:
+        with open(os.path.join(directory, name), "rb") as f:
+            return f.read().decode("utf-8", "replace").strip()
+    except OSError:
+        return default
+
+
+def _read_uevent(directory):
+    env = {}
+    text = _read_attr(directory, "uevent", "")
+    for line in text.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            env[key] = value
+    return env
+
+
+class HidrawBackend(object):
+    """HID backend for Linux that enumerates hidraw nodes through sysfs
+    and opens them as HidrawDevices.
+
+    Usable as `backend=` anywhere, or as the default backend by setting
+    VSBUTIL_HID_BACKEND=ioctl. `sysfs_root` and `dev_root` can point at
+    a fake tree; the other arguments are passed to HidrawDevice.
+    """
+
+    def __init__(self, sysfs_root="/sys/class/hidraw", dev_root="/dev",
+                 ioctl=None, os_open=None, os_close=None):
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+        self.ioctl = ioctl
+        self.os_open = os_open
+        self.os_close = os_close
+
+    def _describe(self, name):
+        hid_dir = os.path.realpath(
+            os.path.join(self.sysfs_root, name, "device"))
+        env = _read_uevent(hid_dir)
+        try:
+            bus, vendor_id, product_id = (
+                int(x, 16) for x in env["HID_ID"].split(":"))
+        except (KeyError, ValueError):
+            return None
+        # HID device -> USB interface -> USB device
+        intf_dir = os.path.dirname(hid_dir)
+        usb_dir = os.path.dirname(intf_dir)
+        try:
+            with open(os.path.join(hid_dir, "report_descriptor"), "rb") as f:
+                usage_page, usage = parse_report_descriptor(f.read())
+        except OSError:
+            usage_page = usage = 0
+        path = os.path.join(self.dev_root, name)
+        return dict(
+            path=path.encode("utf-8", "surrogateescape"),
+            vendor_id=vendor_id,
+            product_id=product_id,
+            serial_number=(
+                env.get("HID_UNIQ") or _read_attr(usb_dir, "serial", "")),
+            release_number=int(_read_attr(usb_dir, "bcdDevice", "0"), 16),
+            manufacturer_string=_read_attr(usb_dir, "manufacturer", ""),
+            product_string=(
+                _read_attr(usb_dir, "product") or env.get("HID_NAME", "")),
+            usage_page=usage_page,
+            usage=usage,
+            interface_number=int(
+                _read_attr(intf_dir, "bInterfaceNumber", "-1"), 16),
+            )
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        try:
+            names = sorted(os.listdir(self.sysfs_root))
+        except FileNotFoundError:
+            return []
+        devices = []
+        for name in names:
+            info = self._describe(name)
+            if info is None:
+                continue
+            if vendor_id and info["vendor_id"] != vendor_id:
+                continue
+            if product_id and info["product_id"] != product_id:
+                continue
+            devices.append(info)
+        return devices
+
+    def device(self):
+        return HidrawDevice(self.ioctl, self.os_open, self.os_close)
+
+
+_default_backend = HidrawBackend()
+
+# Module-level API of the hid/hidraw modules, so this module can stand in
+# for them
+enumerate = _default_backend.enumerate
+device = _default_backend.device
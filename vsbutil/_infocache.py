@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+from ._codec import DeviceInfo
+
+
+__all__ = [
+    'DeviceInfoCache',
+    'default_info_cache_path',
+    ]
+
+
+def default_info_cache_path():
+    path = os.environ.get("VSBUTIL_DEVINFO_CACHE")
+    if path:
+        return path
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "vsbutil", "devinfo.json")
+
+
+class DeviceInfoCache(object):
+    """Device info (key and keyseq geometry) by firmware release number,
+    kept in a small JSON file.
+
+    Set as VerySeriousButton.info_cache, opening a device whose release
+    is in the cache sends no command at all. The cached info is checked
+    lazily: if the first command sent to the device fails, GETDEVINFO is
+    run and the cache corrected. Entries older than `max_age` seconds are
+    refreshed with GETDEVINFO when a device is opened. Commands that the
+    device accepts don't recheck it, so only use the cache for devices
+    whose geometry is known to match their firmware release.
+    """
+
+    MAX_AGE = 7 * 24 * 3600.
+
+    def __init__(self, path=None, max_age=None):
+        self.path = path or default_info_cache_path()
+        self.max_age = self.MAX_AGE if max_age is None else max_age
+        self._lock = threading.Lock()
+        self._entries = None
+
+    @staticmethod
+    def _key(release_number):
+        return "0x%04X" % (release_number,)
+
+    def _load(self):
+        # With self._lock held
+        if self._entries is not None:
+            return self._entries
+        import json
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)["releases"]
+            if not isinstance(entries, dict):
+                raise ValueError("Bad releases table")
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError, KeyError, TypeError):
+            # Corrupt or from an incompatible version; start over
+            entries = {}
+        self._entries = entries
+        return entries
+
+    def _save(self):
+        # With self._lock held; a rename, so that concurrent vsbutil
+        # processes never see a partial file
+        import json
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(dict(version=1, releases=self._entries), f,
+                          indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError:
+            # A cache that can't be written only costs speed
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def get(self, release_number):
+        """Cached DeviceInfo for the release, or None if it isn't cached
+        or is due for a refresh."""
+        with self._lock:
+            entry = self._load().get(self._key(release_number))
+        if entry is None:
+            return None
+        try:
+            if time.time() - entry["verified"] > self.max_age:
+                return None
+            return DeviceInfo(*(entry[key] for key in DeviceInfo.__slots__))
+        except (KeyError, TypeError):
+            return None
+
+    def put(self, release_number, info):
+        entry = dict(info.to_dict(), verified=time.time())
+        with self._lock:
+            entries = self._load()
+            old = entries.get(self._key(release_number))
+            if old is not None and old.get("verified", 0) > time.time() - 60:
+                if all(old.get(key) == entry[key] for key in info):
+                    # Confirmed just now (e.g. by another device of the
+                    # same release); spare the write
+                    return
+            entries[self._key(release_number)] = entry
+            self._save()
+
+    def forget(self, release_number):
+        with self._lock:
+            if self._load().pop(self._key(release_number), None) is not None:
+                self._save()
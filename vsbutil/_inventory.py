@@ -0,0 +1,242 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from ._codec import DeviceConfig, DeviceInfo
+
+
+__all__ = [
+    'Inventory',
+    'InventoryEntry',
+    'config_fingerprint',
+    ]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    serial TEXT PRIMARY KEY,
+    release_number INTEGER,
+    singlekey_nkeys INTEGER,
+    keyseq_nkeys INTEGER,
+    keyseq_pagesize INTEGER,
+    keyseq_npages INTEGER,
+    mode INTEGER,
+    mods INTEGER,
+    keycodes BLOB,
+    keyseq_len INTEGER,
+    keyseq BLOB,
+    fingerprint TEXT,
+    checked REAL,
+    seen REAL
+);
+CREATE INDEX IF NOT EXISTS devices_mode ON devices (mode);
+CREATE INDEX IF NOT EXISTS devices_fingerprint ON devices (fingerprint);
+"""
+
+_COLUMNS = (
+    "serial, release_number, singlekey_nkeys, keyseq_nkeys, "
+    "keyseq_pagesize, keyseq_npages, mode, mods, keycodes, keyseq_len, "
+    "keyseq, fingerprint, checked, seen"
+    )
+
+
+def config_fingerprint(config, keyseq):
+    """Content hash of a config plus the images of its keyseq_len keyseq
+    pages, concatenated."""
+    h = hashlib.sha256()
+    h.update(bytes([config["mode"], config["mods"], config["keyseq_len"]]))
+    h.update(bytes(config["keycodes"]))
+    h.update(bytes(keyseq))
+    return h.hexdigest()[:16]
+
+
+class InventoryEntry(object):
+    """What the inventory knows about one device.
+
+    `config` and `keyseq` (the keyseq_len active keyseq pages, back to
+    back) are None if unknown. `checked` is when they were last read from
+    or written to the device, None if they may be out of date; `seen` is
+    when the device was last opened.
+    """
+
+    def __init__(self, serial, release_number, device_info, config=None,
+                 keyseq=None, fingerprint=None, checked=None, seen=None):
+        self.serial = serial
+        self.release_number = release_number
+        self.device_info = device_info
+        self.config = config
+        self.keyseq = keyseq
+        self.fingerprint = fingerprint
+        self.checked = checked
+        self.seen = seen
+
+    @classmethod
+    def _from_row(cls, row):
+        (serial, release, sk_nkeys, ks_nkeys, ks_pagesize, ks_npages, mode,
+         mods, keycodes, keyseq_len, keyseq, fingerprint, checked,
+         seen) = row
+        config = None
+        if mode is not None:
+            config = DeviceConfig(mode, mods, list(keycodes), keyseq_len)
+        return cls(
+            serial,
+            release,
+            DeviceInfo(sk_nkeys, ks_nkeys, ks_pagesize, ks_npages),
+            config,
+            keyseq,
+            fingerprint,
+            checked,
+            seen,
+            )
+
+    def is_fresh(self, max_age):
+        return (self.config is not None and self.checked is not None
+                and time.time() - self.checked <= max_age)
+
+    def pages(self):
+        # Keyseq page images keyed by page number
+        if self.keyseq is None:
+            return {}
+        size = self.device_info["keyseq_pagesize"]
+        return {
+            i: bytearray(self.keyseq[i*size:(i+1)*size])
+            for i in range(len(self.keyseq) // size)
+            }
+
+    def __repr__(self):
+        return f"<InventoryEntry {self.serial} {self.fingerprint}>"
+
+
+class Inventory(object):
+    """SQLite database of the devices this host has talked to.
+
+    Set as VerySeriousButton.inventory, devices are recorded when closed
+    and opening a known device skips GETDEVINFO (device info is fixed for
+    a firmware release). With a `max_age` (seconds), a device whose config
+    was read or written less than that long ago gets its shadow config
+    and keyseq page cache seeded from the inventory as well, so commands
+    that find the device already in the wanted state send nothing. The
+    seed isn't checked against the device, so only set `max_age` if
+    nothing else reprograms or power-cycles the devices in between.
+    """
+
+    # Seeding the config is opt-in
+    MAX_AGE = 0.
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = self.MAX_AGE if max_age is None else max_age
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10., check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, serial):
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {_COLUMNS} FROM devices WHERE serial = ?",
+                (serial,),
+                ).fetchone()
+        if row is None:
+            return None
+        return InventoryEntry._from_row(row)
+
+    def query(self, mode=None, release_number=None, fingerprint=None):
+        """Entries matching all of the given criteria, by serial number."""
+        where = []
+        args = []
+        for column, value in (
+                ("mode", mode),
+                ("release_number", release_number),
+                ("fingerprint", fingerprint),
+                ):
+            if value is not None:
+                where.append(f"{column} = ?")
+                args.append(value)
+        sql = f"SELECT {_COLUMNS} FROM devices"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY serial", args).fetchall()
+        return [InventoryEntry._from_row(row) for row in rows]
+
+    def forget(self, serial):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM devices WHERE serial = ?", (serial,))
+
+    def restore(self, vsb):
+        """Seed a freshly opened `vsb` from its entry, if any. Returns the
+        device info to use instead of asking the device, or None."""
+        entry = self.get(vsb.serial_number)
+        if entry is None or entry.release_number != vsb.release_number:
+            return None
+        if self.max_age and entry.is_fresh(self.max_age):
+            vsb._config = entry.config
+            vsb._pages = entry.pages()
+            vsb._config_checked = entry.checked
+        return entry.device_info
+
+    def record(self, vsb):
+        """Store what `vsb` knows about its device (without talking to
+        it)."""
+        now = time.time()
+        config = vsb._config
+        info = DeviceInfo(
+            vsb.singlekey_nkeys,
+            vsb.keyseq_nkeys,
+            vsb.keyseq_page_size,
+            vsb.num_keyseq_pages,
+            )
+        values = dict(
+            serial=vsb.serial_number,
+            release_number=vsb.release_number,
+            seen=now,
+            checked=None,
+            **info.to_dict(),
+            )
+        if config is not None:
+            keyseq = None
+            pages = [vsb._pages.get(i) for i in range(config["keyseq_len"])]
+            if None not in pages:
+                keyseq = b"".join(bytes(page) for page in pages)
+            values.update(
+                mode=config["mode"],
+                mods=config["mods"],
+                keycodes=bytes(config["keycodes"]),
+                keyseq_len=config["keyseq_len"],
+                keyseq=keyseq,
+                fingerprint=None,
+                # When a command last read or wrote the config; state
+                # seeded from the inventory doesn't become any more
+                # certain by being written back
+                checked=vsb._config_checked,
+                )
+            if keyseq is not None:
+                values["fingerprint"] = config_fingerprint(config, keyseq)
+        # Without a config, keep the last known one for queries, but as
+        # unconfirmed
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" * len(values))
+        updates = ", ".join(
+            f"{column} = excluded.{column}" for column in values)
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT INTO devices ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT (serial) DO UPDATE SET {updates}",
+                list(values.values()),
+                )
@@ -0,0 +1,145 @@
+import functools
+
+from ._vsbutil import KEYCODES, MODKEYS, parse_keygroup
+
+
+__all__ = [
+    'parse_macro',
+    'pack_keyseq',
+    'compile_keyseq',
+    ]
+
+
+_SHIFT = MODKEYS["SHIFT"]
+
+# Characters typed by each key on a US layout, unshifted then shifted
+_KEY_CHARS = {
+    "SPACE": " ",
+    "ENTER": "\n",
+    "TAB": "\t",
+    "MINUS": "-_",
+    "EQUALS": "=+",
+    "LBRACE": "[{",
+    "RBRACE": "]}",
+    "BSLASH": "\\|",
+    "SCOLON": ";:",
+    "QUOTE": "'\"",
+    "TILDE": "`~",
+    "COMMA": ",<",
+    "PERIOD": ".>",
+    "SLASH": "/?",
+    "1": "1!",
+    "2": "2@",
+    "3": "3#",
+    "4": "4$",
+    "5": "5%",
+    "6": "6^",
+    "7": "7&",
+    "8": "8*",
+    "9": "9(",
+    "0": "0)",
+    }
+
+CHARMAP = {}
+for _key, _chars in _KEY_CHARS.items():
+    for _mod, _char in zip((0, _SHIFT), _chars):
+        CHARMAP[_char] = (_mod, KEYCODES[_key])
+for _char in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+    CHARMAP[_char.lower()] = (0, KEYCODES[_char])
+    CHARMAP[_char] = (_SHIFT, KEYCODES[_char])
+del _key, _chars, _mod, _char
+
+
+def parse_macro(source):
+    """Turn macro text into a tuple of (modifier bits, keycodes) groups.
+
+    Characters are typed as-is (with shift where needed); {KEYS} is a
+    plus-separated key group as for setkey, e.g. "{ctrl+c}" or "{enter}",
+    and "{{" and "}}" type literal braces.
+    """
+    return _parse_macro(source)[0]
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_macro(source):
+    # (groups, indices of the groups given as {KEYS})
+    groups = []
+    chords = []
+    i = 0
+    while i < len(source):
+        char = source[i]
+        if source.startswith("{{", i) or source.startswith("}}", i):
+            i += 1
+        elif char == "{":
+            end = source.find("}", i)
+            if end < 0:
+                raise ValueError(f"Unterminated key group at offset {i}")
+            try:
+                mod, keys = parse_keygroup(source[i+1:end])
+            except KeyError as e:
+                raise ValueError(
+                    f"Unknown key {e.args[0]!r} in key group at offset {i}"
+                    ) from None
+            chords.append(len(groups))
+            groups.append((mod, tuple(keys)))
+            i = end + 1
+            continue
+        elif char == "}":
+            raise ValueError(f"Unmatched '}}' at offset {i}")
+        if char not in CHARMAP:
+            raise ValueError(f"Can't type {char!r} (offset {i})")
+        mod, key = CHARMAP[char]
+        groups.append((mod, (key,)))
+        i += 1
+    return tuple(groups), frozenset(chords)
+
+
+def pack_keyseq(groups, nkeys, chords=()):
+    """Merge consecutive key groups into as few keyseq pages as possible.
+
+    Groups share a page if they have the same modifiers, fit in `nkeys`
+    keys together and don't repeat a key (which needs a release in
+    between). The groups whose indices are in `chords` (the {KEYS} groups
+    of a macro) are pressed as given, each on a page of its own, since
+    merging e.g. ctrl+c and ctrl+v would make another chord. Order is
+    preserved.
+    """
+    pages = []
+    mod = None
+    keys = []
+    alone = False
+    for i, (group_mod, group_keys) in enumerate(groups):
+        if len(group_keys) > nkeys:
+            raise ValueError(
+                f"Too many keys in key group {i} "
+                f"(got {len(group_keys)}, max {nkeys})"
+                )
+        chord = i in chords
+        if (chord or alone
+                or group_mod != mod
+                or len(keys) + len(group_keys) > nkeys
+                or any(key in keys for key in group_keys)):
+            if mod is not None:
+                pages.append((mod, tuple(keys)))
+            mod = group_mod
+            keys = []
+        alone = chord
+        keys.extend(group_keys)
+    if mod is not None:
+        pages.append((mod, tuple(keys)))
+    return tuple(pages)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_keyseq(source, nkeys, max_pages=None):
+    """Compile macro text (see parse_macro) into packed keyseq pages for
+    VerySeriousButton.write_keyseq(), checking the result fits in
+    `max_pages` pages before anything is sent to a device."""
+    groups, chords = _parse_macro(source)
+    pages = pack_keyseq(groups, nkeys, chords)
+    if max_pages is not None and len(pages) > max_pages:
+        raise ValueError(
+            f"Key sequence too long ({len(pages)} pages, "
+            f"maximum {max_pages})"
+            )
+    return pages
@@ -0,0 +1,261 @@
+import os
+
+from ._vsbutil import (
+    VerySeriousButton,
+    VerySeriousButtonCommandError,
+    parse_keygroup,
+    )
+
+
+__all__ = [
+    'Manifest',
+    'DevicePlan',
+    'plan_device',
+    'apply_plan',
+    ]
+
+
+ALL_DEVICES = "*"
+
+_SPEC_KEYS = {"mode", "key", "mods", "keycodes", "keyseq", "save", "eeprom"}
+
+
+def _parse_int(value):
+    if isinstance(value, str):
+        return int(value, 0)
+    return int(value)
+
+
+def _parse_eeprom_region(region, base_dir):
+    addr = _parse_int(region["addr"])
+    if "file" in region:
+        with open(os.path.join(base_dir, region["file"]), "rb") as f:
+            data = bytearray(f.read())
+    elif isinstance(region.get("data"), str):
+        data = bytearray.fromhex(region["data"])
+    else:
+        data = bytearray(_parse_int(v) for v in region["data"])
+    return addr, data
+
+
+def _parse_spec(name, spec, base_dir):
+    unknown = set(spec) - _SPEC_KEYS
+    if unknown:
+        raise ValueError(
+            f"Unknown setting(s) for {name!r} in manifest: "
+            + ", ".join(sorted(unknown))
+            )
+    parsed = {}
+    if "mode" in spec:
+        parsed["mode"] = VerySeriousButton.mode_value_for_string(
+            spec["mode"])
+    if "key" in spec:
+        parsed["mods"], parsed["keycodes"] = parse_keygroup(spec["key"])
+    if "mods" in spec:
+        parsed["mods"] = _parse_int(spec["mods"])
+    if "keycodes" in spec:
+        parsed["keycodes"] = [_parse_int(v) for v in spec["keycodes"]]
+    if "keyseq" in spec:
+        parsed["keyseq"] = [parse_keygroup(g) for g in spec["keyseq"]]
+    if "save" in spec:
+        if not isinstance(spec["save"], bool):
+            raise ValueError(
+                f"Invalid save setting for {name!r}: {spec['save']!r}")
+        parsed["save"] = spec["save"]
+    if "eeprom" in spec:
+        parsed["eeprom"] = [
+            _parse_eeprom_region(region, base_dir)
+            for region in spec["eeprom"]
+            ]
+    return parsed
+
+
+class Manifest(object):
+    """Desired end state of one or more VSBs.
+
+    `devices` maps serial numbers, or "*" for every connected device, to
+    settings: mode ("joystick", "singlekey", "keyseq" or a number), key
+    (e.g. "ctrl+c") or mods/keycodes, keyseq (list of key groups), save
+    (true to store the config) and eeprom (list of {"addr", "data" or
+    "file"} regions). Settings for a serial number override those for
+    "*".
+    """
+
+    def __init__(self, devices):
+        self.devices = devices
+
+    @classmethod
+    def from_dict(cls, data, base_dir="."):
+        devices = data.get("devices")
+        if not isinstance(devices, dict):
+            raise ValueError("Manifest has no 'devices' table")
+        return cls({
+            str(name): _parse_spec(name, spec, base_dir)
+            for name, spec in devices.items()
+            })
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        if path.endswith(".toml"):
+            try:
+                import tomllib
+            except ModuleNotFoundError:
+                try:
+                    import tomli as tomllib
+                except ModuleNotFoundError:
+                    raise ValueError(
+                        "Reading TOML manifests requires Python 3.11 or "
+                        "the tomli package"
+                        ) from None
+            data = tomllib.loads(raw.decode("utf-8"))
+        else:
+            import json
+            data = json.loads(raw)
+        return cls.from_dict(data, os.path.dirname(os.path.abspath(path)))
+
+    @property
+    def all_devices(self):
+        return ALL_DEVICES in self.devices
+
+    @property
+    def serials(self):
+        return [name for name in self.devices if name != ALL_DEVICES]
+
+    def spec_for(self, serial):
+        if serial not in self.devices and not self.all_devices:
+            return None
+        spec = dict(self.devices.get(ALL_DEVICES, {}))
+        spec.update(self.devices.get(serial, {}))
+        return spec
+
+
+class DevicePlan(object):
+    """Commands that bring one device to its manifest state, in order.
+
+    Each step is a (command name, argument) tuple.
+    """
+
+    def __init__(self, serial, steps=None):
+        self.serial = serial
+        self.steps = steps or []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def counts(self):
+        counts = {}
+        for cmd, arg in self.steps:
+            counts[cmd] = counts.get(cmd, 0) + 1
+        return counts
+
+    def describe(self):
+        for cmd, arg in self.steps:
+            if cmd == "EEPWRITE":
+                yield "EEPWRITE 0x%03X = 0x%02X" % arg
+            elif cmd == "WRITEPAGE":
+                yield "WRITEPAGE %d: %s" % (
+                    arg[0], " ".join("%02X" % b for b in arg[1]))
+            elif cmd == "SETCFG":
+                yield (
+                    "SETCFG mode=%d mods=0x%02X keycodes=%s keyseq_len=%d"
+                    ) % (
+                    arg["mode"],
+                    arg["mods"],
+                    ",".join("0x%02X" % k for k in arg["keycodes"] if k),
+                    arg["keyseq_len"],
+                    )
+            else:
+                yield cmd
+
+
+def plan_device(vsb, spec):
+    """Work out the fewest commands that bring `vsb` to state `spec`.
+
+    Current state is read once (config, the target keyseq pages and the
+    target EEPROM regions), or taken from the device's shadow copies if it
+    has them. EEPROM regions are written first, then
+    changed keyseq pages, then the config, so keyseq_len never covers a
+    page that hasn't been written yet. If the spec asks for saving,
+    SAVECFG comes last, unless the stored config already is the target
+    one. Reading the stored config means loading it (LOADCFG), so the
+    running config is put back afterwards if it differed.
+    """
+    plan = DevicePlan(vsb.serial_number)
+    current = vsb._normalize_config(vsb.get_cached_config())
+    target = dict(current)
+    for key in ("mode", "mods", "keycodes"):
+        if key in spec:
+            target[key] = spec[key]
+
+    for addr, data in spec.get("eeprom", []):
+        if addr < 0 or addr + len(data) > vsb.EEPROM_SIZE:
+            raise ValueError(
+                f"EEPROM region of {len(data)} bytes at 0x{addr:03X} "
+                f"doesn't fit in {vsb.EEPROM_SIZE} bytes of EEPROM"
+                )
+        existing = vsb.read_eeprom_bytes(addr, len(data))
+        plan.steps.extend(
+            ("EEPWRITE", (addr + i, v))
+            for i, (v, cur) in enumerate(zip(data, existing))
+            if v != cur
+            )
+
+    if "keyseq" in spec:
+        keyseq = spec["keyseq"]
+        if len(keyseq) > vsb.num_keyseq_pages:
+            raise ValueError(
+                f"Key sequence too long (length {len(keyseq)}, "
+                f"maximum {vsb.num_keyseq_pages})"
+                )
+        for i, (mod, keycodes) in enumerate(keyseq):
+            if len(keycodes) > vsb.keyseq_nkeys:
+                raise ValueError(
+                    f"Too many keys in key group {i} "
+                    f"(got {len(keycodes)}, max {vsb.keyseq_nkeys})"
+                    )
+            page = bytearray([mod] + list(keycodes))
+            page += bytes(vsb.keyseq_page_size - len(page))
+            existing = vsb._pages.get(i)
+            if existing is None:
+                existing = vsb.read_raw_keyseq_page(i)
+            if bytes(existing) != bytes(page):
+                plan.steps.append(("WRITEPAGE", (i, page)))
+        target["keyseq_len"] = len(keyseq)
+
+    target = vsb._normalize_config(target)
+    if target != current:
+        plan.steps.append(("SETCFG", target))
+    if spec.get("save", False) and _stored_config(vsb, current) != target:
+        plan.steps.append(("SAVECFG", None))
+    return plan
+
+
+def _stored_config(vsb, running):
+    # Config stored in EEPROM, None if there is no valid one. The only way
+    # to read it is to load it, so put the running config back if need be
+    try:
+        vsb.load_stored_config()
+    except VerySeriousButtonCommandError as e:
+        if e.response != vsb.VSB_RESP_BADCS:
+            raise
+        return None
+    stored = vsb._normalize_config(vsb.get_config())
+    if stored != running:
+        vsb.set_config(running)
+    return stored
+
+
+def apply_plan(vsb, plan):
+    for cmd, arg in plan.steps:
+        if cmd == "EEPWRITE":
+            vsb.write_eeprom_byte(*arg)
+        elif cmd == "WRITEPAGE":
+            vsb.write_raw_keyseq_page(*arg)
+        elif cmd == "SETCFG":
+            vsb.set_config(arg)
+        elif cmd == "SAVECFG":
+            vsb.store_current_config()
+        else:
+            raise ValueError(f"Unknown plan step {cmd!r}")
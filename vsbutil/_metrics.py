@@ -0,0 +1,204 @@
+from array import array
+import os
+import random
+import threading
+
+from ._vsbutil import (
+    VerySeriousButton,
+    VerySeriousButtonTimeout,
+    VerySeriousButtonProtocolError,
+    )
+
+
+__all__ = [
+    'Metrics',
+    ]
+
+
+class _CommandStats(object):
+
+    def __init__(self, nbuckets):
+        self.count = 0
+        self.errors = {}
+        self.busy_polls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_time = 0.
+        self.bucket_counts = [0] * nbuckets
+        self.samples = array('d')
+
+
+def _error_name(event):
+    if event.response is not None:
+        return VerySeriousButton.response_name_for_value(event.response)
+    if isinstance(event.error, VerySeriousButtonTimeout):
+        return "TIMEOUT"
+    if isinstance(event.error, VerySeriousButtonProtocolError):
+        return "MISMATCH"
+    return type(event.error).__name__
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100.
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class Metrics(object):
+    """Instrumentation listener aggregating QueryEvents per command.
+
+    Attach with ``vsb.listeners.append(metrics)`` for one device or
+    ``VerySeriousButton.global_listeners.append(metrics)`` for all.
+    Latencies go into a cumulative histogram with upper bounds `buckets`
+    (seconds); with `keep_samples`, a uniform random sample of at most
+    `reservoir_size` latencies per command is kept as well, for
+    percentiles (exact until that many have been seen).
+    """
+
+    BUCKETS = (
+        0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.)
+    RESERVOIR_SIZE = 10000
+
+    def __init__(self, buckets=None, keep_samples=False, reservoir_size=None):
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self.keep_samples = keep_samples
+        self.reservoir_size = reservoir_size or self.RESERVOIR_SIZE
+        self.commands = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self.commands.get(event.cmd_id)
+            if stats is None:
+                stats = self.commands[event.cmd_id] = _CommandStats(
+                    len(self.buckets))
+            stats.count += 1
+            stats.busy_polls += event.busy_polls
+            stats.bytes_sent += event.bytes_sent
+            stats.bytes_received += event.bytes_received
+            stats.total_time += event.elapsed
+            for i, bound in enumerate(self.buckets):
+                if event.elapsed <= bound:
+                    stats.bucket_counts[i] += 1
+                    break
+            if self.keep_samples:
+                if len(stats.samples) < self.reservoir_size:
+                    stats.samples.append(event.elapsed)
+                else:
+                    # Reservoir sampling, as in the monitor's Histogram
+                    i = self._random.randrange(stats.count)
+                    if i < self.reservoir_size:
+                        stats.samples[i] = event.elapsed
+            if event.error is not None:
+                name = _error_name(event)
+                stats.errors[name] = stats.errors.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.commands = {}
+
+    def _sorted_commands(self):
+        with self._lock:
+            items = list(self.commands.items())
+        return sorted(
+            (VerySeriousButton.command_name_for_value(cmd_id), stats)
+            for cmd_id, stats in items
+            )
+
+    def to_dict(self):
+        result = {}
+        for name, stats in self._sorted_commands():
+            cumulative = 0
+            histogram = []
+            for bound, n in zip(self.buckets, stats.bucket_counts):
+                cumulative += n
+                histogram.append([bound, cumulative])
+            result[name] = dict(
+                count=stats.count,
+                errors=dict(stats.errors),
+                busy_polls=stats.busy_polls,
+                bytes_sent=stats.bytes_sent,
+                bytes_received=stats.bytes_received,
+                total_time=stats.total_time,
+                histogram=histogram,
+                )
+            if stats.samples:
+                result[name].update(
+                    p50=_percentile(stats.samples, 50),
+                    p99=_percentile(stats.samples, 99),
+                    )
+        return result
+
+    def to_prometheus(self, prefix="vsbutil"):
+        metrics = [
+            ("commands_total", "counter", "HID commands sent"),
+            ("command_errors_total", "counter",
+             "HID commands that failed, by error"),
+            ("busy_polls_total", "counter",
+             "BUSY replies read while waiting for commands to complete"),
+            ("bytes_sent_total", "counter", "Feature report bytes sent"),
+            ("bytes_received_total", "counter",
+             "Feature report bytes received"),
+            ("command_duration_seconds", "histogram",
+             "do_query round-trip time"),
+            ]
+        samples = {name: [] for name, kind, help_ in metrics}
+        for cmd, stats in self._sorted_commands():
+            label = f'command="{cmd}"'
+            samples["commands_total"].append(f"{{{label}}} {stats.count}")
+            for error, n in sorted(stats.errors.items()):
+                samples["command_errors_total"].append(
+                    f'{{{label},error="{error}"}} {n}')
+            samples["busy_polls_total"].append(
+                f"{{{label}}} {stats.busy_polls}")
+            samples["bytes_sent_total"].append(
+                f"{{{label}}} {stats.bytes_sent}")
+            samples["bytes_received_total"].append(
+                f"{{{label}}} {stats.bytes_received}")
+            hist = samples["command_duration_seconds"]
+            cumulative = 0
+            for bound, n in zip(self.buckets, stats.bucket_counts):
+                cumulative += n
+                hist.append(f'_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            hist.append(f'_bucket{{{label},le="+Inf"}} {stats.count}')
+            hist.append(f"_sum{{{label}}} {stats.total_time:.6f}")
+            hist.append(f"_count{{{label}}} {stats.count}")
+        lines = []
+        for name, kind, help_ in metrics:
+            lines.append(f"# HELP {prefix}_{name} {help_}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            lines.extend(
+                f"{prefix}_{name}{sample}" for sample in samples[name])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Export to `path`: Prometheus text format for *.prom files (as
+        read by node_exporter's textfile collector), JSON otherwise."""
+        if path.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            import json
+            text = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        # Write and rename, so collectors never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        for name, stats in self._sorted_commands():
+            line = (
+                f"{name:12s} {stats.count:6d} cmds "
+                f"{stats.total_time / stats.count * 1e3:8.2f} ms avg "
+                f"{stats.busy_polls:6d} busy "
+                f"{stats.bytes_sent + stats.bytes_received:8d} bytes"
+                )
+            if stats.errors:
+                line += "  errors: " + ", ".join(
+                    f"{error}={n}"
+                    for error, n in sorted(stats.errors.items())
+                    )
+            yield line
@@ -0,0 +1,372 @@
+from array import array
+import bisect
+import math
+import random
+import threading
+import time
+
+from ._vsbutil import VerySeriousButton, VerySeriousButtonNotFound
+
+
+__all__ = [
+    'Histogram',
+    'InputMonitor',
+    'input_interfaces',
+    ]
+
+
+def input_interfaces(serial=None, backend=None):
+    """enumerate() entries of the gamepad/keyboard interfaces of the VSB
+    with serial number `serial` (default: the first one found)."""
+    backend = VerySeriousButton.get_backend(backend)
+    devices = backend.enumerate(
+        VerySeriousButton.USB_VID, VerySeriousButton.USB_PID)
+    if serial is None:
+        for dev in devices:
+            if dev["usage_page"] >= VerySeriousButton.HID_USAGE_PAGE_VSB:
+                serial = dev["serial_number"]
+                break
+        else:
+            raise VerySeriousButtonNotFound("No VSB found")
+    found = [
+        dev for dev in devices
+        if dev["serial_number"] == serial
+        and dev["usage_page"] < VerySeriousButton.HID_USAGE_PAGE_VSB
+        ]
+    if not found:
+        raise VerySeriousButtonNotFound(
+            f"No input interfaces found for VSB {serial}")
+    return found
+
+
+class Histogram(object):
+    """Distribution of durations (seconds): counts per bucket with upper
+    bounds `buckets`, exact count, mean, standard deviation and extremes,
+    and percentiles from a uniform random sample of at most
+    `reservoir_size` values (exact until that many have been added)."""
+
+    BUCKETS = (
+        0.00025, 0.0005, 0.00075, 0.001, 0.00125, 0.0015, 0.002, 0.003,
+        0.004, 0.006, 0.008, 0.012, 0.016, 0.032, 0.064, 0.128)
+    RESERVOIR_SIZE = 10000
+
+    def __init__(self, buckets=None, reservoir_size=None):
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.reservoir_size = reservoir_size or self.RESERVOIR_SIZE
+        self.samples = array('d')
+        self.count = 0
+        self.total = 0.
+        self.total_squares = 0.
+        self.min = math.inf
+        self.max = -math.inf
+        self._random = random.Random()
+
+    def add(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(value)
+        else:
+            # Reservoir sampling: every value so far is equally likely to
+            # be in the sample
+            i = self._random.randrange(self.count)
+            if i < self.reservoir_size:
+                self.samples[i] = value
+        self.total += value
+        self.total_squares += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    @property
+    def stddev(self):
+        n = self.count
+        if n < 2:
+            return 0.
+        variance = (self.total_squares - self.total * self.total / n) / (n - 1)
+        return math.sqrt(max(variance, 0.))
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.
+        values = sorted(self.samples)
+        k = (len(values) - 1) * q / 100.
+        lo = int(k)
+        hi = min(lo + 1, len(values) - 1)
+        return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+    def to_dict(self):
+        return dict(
+            count=self.count,
+            mean=self.mean,
+            stddev=self.stddev,
+            min=self.min if self.count else 0.,
+            max=self.max if self.count else 0.,
+            p50=self.percentile(50),
+            p99=self.percentile(99),
+            histogram=[
+                [bound, n] for bound, n in zip(
+                    self.buckets + (math.inf,), self.bucket_counts)
+                ],
+            )
+
+    def summary(self, indent="  "):
+        # Non-empty buckets, one line each
+        lower = 0.
+        for bound, n in zip(self.buckets + (math.inf,), self.bucket_counts):
+            if n:
+                upper = "inf" if bound == math.inf else f"{bound*1e3:.2f}"
+                bar = "#" * max(1, round(40 * n / self.count))
+                yield (f"{indent}{lower*1e3:6.2f} - {upper:>6s} ms "
+                       f"{n:8d} {bar}")
+            lower = bound
+
+
+class _ReportRing(object):
+    # Single-producer, single-consumer ring of timestamped reports in
+    # preallocated storage. The producer never waits; if the consumer
+    # falls `capacity` reports behind, the oldest are overwritten and
+    # counted as overruns
+
+    def __init__(self, capacity, report_size):
+        self.capacity = capacity
+        self.report_size = report_size
+        self.written = 0
+        self.read = 0
+        self.overruns = 0
+        self._data = bytearray(capacity * report_size)
+        self._view = memoryview(self._data)
+        self._lengths = array('H', bytes(2 * capacity))
+        self._times = array('d', bytes(8 * capacity))
+
+    def push(self, t, report):
+        i = self.written % self.capacity
+        n = min(len(report), self.report_size)
+        offset = i * self.report_size
+        self._data[offset:offset+n] = report[:n]
+        self._lengths[i] = n
+        self._times[i] = t
+        self.written += 1
+
+    def pop_all(self):
+        # (time, report bytes) of everything written since the last call
+        written = self.written
+        start = self.read
+        if written - start > self.capacity:
+            self.overruns += written - start - self.capacity
+            start = written - self.capacity
+        items = []
+        size = self.report_size
+        for j in range(start, written):
+            i = j % self.capacity
+            offset = i * size
+            items.append((
+                self._times[i],
+                bytes(self._view[offset:offset+self._lengths[i]]),
+                ))
+        if self.written - start > self.capacity:
+            # Overwritten while being copied
+            lost = self.written - start - self.capacity
+            self.overruns += lost
+            items = items[lost:]
+        self.read = written
+        return items
+
+
+class _InterfaceStats(object):
+
+    def __init__(self, info):
+        self.info = info
+        self.reports = 0
+        self.presses = []
+        self.first = None
+        self.last = None
+        self.pressed = False
+        self.intervals = Histogram()
+
+    def add(self, t, report):
+        self.reports += 1
+        if self.last is None:
+            self.first = t
+        else:
+            self.intervals.add(t - self.last)
+        self.last = t
+        pressed = any(report)
+        if pressed and not self.pressed:
+            self.presses.append(t)
+        self.pressed = pressed
+
+    @property
+    def rate(self):
+        if self.first is None or self.last == self.first:
+            return 0.
+        return (self.reports - 1) / (self.last - self.first)
+
+
+class InputMonitor(object):
+    """Streams the input reports of a VSB's gamepad/keyboard interfaces.
+
+    A reader thread per interface does nothing but read reports and put
+    them, timestamped with time.perf_counter(), into a ring buffer of
+    `ring_size` reports. poll() moves them into per-interface statistics
+    (report rate, the interval between reports, press times) and must be
+    called often enough for the ring not to fill up (`overruns` counts
+    reports lost that way). A report with any non-zero byte counts as the
+    button being pressed.
+
+    latency() pairs press times from an external source (e.g. the
+    simulator's SimulatedFirmware.press_times, or an actuator's log, on
+    the same clock) with the presses seen by the host.
+    """
+
+    RING_SIZE = 8192
+    REPORT_SIZE = 64
+    READ_TIMEOUT_MS = 100
+
+    def __init__(self, serial=None, backend=None, ring_size=None):
+        self.backend = VerySeriousButton.get_backend(backend)
+        self.interfaces = input_interfaces(serial, self.backend)
+        self.serial_number = self.interfaces[0]["serial_number"]
+        ring_size = ring_size or self.RING_SIZE
+        self.stats = [_InterfaceStats(info) for info in self.interfaces]
+        self._rings = [
+            _ReportRing(ring_size, self.REPORT_SIZE)
+            for info in self.interfaces
+            ]
+        self._devices = []
+        self._threads = []
+        self._errors = []
+        self._stop = threading.Event()
+        self._poll_lock = threading.Lock()
+
+    def start(self):
+        try:
+            for info in self.interfaces:
+                dev = self.backend.device()
+                dev.open_path(info["path"])
+                self._devices.append(dev)
+        except OSError:
+            self._close_devices()
+            raise
+        self._stop.clear()
+        for dev, ring in zip(self._devices, self._rings):
+            thread = threading.Thread(
+                target=self._reader, args=(dev, ring), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _reader(self, dev, ring):
+        read = dev.read
+        push = ring.push
+        clock = time.perf_counter
+        stop = self._stop.is_set
+        size = self.REPORT_SIZE
+        timeout = self.READ_TIMEOUT_MS
+        try:
+            while not stop():
+                report = read(size, timeout)
+                if report:
+                    push(clock(), report)
+        except (OSError, ValueError) as e:
+            if not stop():
+                self._errors.append(e)
+
+    def _close_devices(self):
+        for dev in self._devices:
+            dev.close()
+        self._devices = []
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._close_devices()
+        self.poll()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def poll(self):
+        """Process the reports received since the last call. Returns how
+        many there were; raises the error that stopped a reader, if
+        any."""
+        n = 0
+        with self._poll_lock:
+            for ring, stats in zip(self._rings, self.stats):
+                for t, report in ring.pop_all():
+                    stats.add(t, report)
+                    n += 1
+        if self._errors:
+            raise self._errors.pop(0)
+        return n
+
+    @property
+    def overruns(self):
+        return sum(ring.overruns for ring in self._rings)
+
+    def presses(self):
+        return sorted(t for stats in self.stats for t in stats.presses)
+
+    def latency(self, press_times):
+        """Histogram of the time from each of `press_times` to the first
+        press seen by the host after it. Presses not seen (yet) are left
+        out."""
+        histogram = Histogram()
+        seen = self.presses()
+        i = 0
+        for t in sorted(press_times):
+            i = bisect.bisect_left(seen, t, i)
+            if i >= len(seen):
+                break
+            histogram.add(seen[i] - t)
+            i += 1
+        return histogram
+
+    def to_dict(self):
+        return dict(
+            serial=self.serial_number,
+            overruns=self.overruns,
+            interfaces=[
+                dict(
+                    path=stats.info["path"].decode("utf-8", "replace")
+                    if isinstance(stats.info["path"], bytes)
+                    else stats.info["path"],
+                    usage_page=stats.info["usage_page"],
+                    usage=stats.info["usage"],
+                    reports=stats.reports,
+                    presses=len(stats.presses),
+                    rate=stats.rate,
+                    intervals=stats.intervals.to_dict(),
+                    )
+                for stats in self.stats
+                ],
+            )
+
+    def summary(self):
+        for stats in self.stats:
+            intervals = stats.intervals
+            yield (
+                f"usage 0x{stats.info['usage_page']:04X}:"
+                f"0x{stats.info['usage']:04X}: {stats.reports} reports, "
+                f"{len(stats.presses)} presses, {stats.rate:.1f}/s"
+                )
+            if intervals.count:
+                yield (
+                    f"  interval p50 {intervals.percentile(50)*1e3:.3f} ms, "
+                    f"p99 {intervals.percentile(99)*1e3:.3f} ms, "
+                    f"jitter {intervals.stddev*1e3:.3f} ms"
+                    )
+                yield from intervals.summary("    ")
+        if self.overruns:
+            yield f"{self.overruns} report(s) lost to ring buffer overruns"
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+
+from ._vsbutil import VerySeriousButton, VerySeriousButtonNotFound
+
+
+__all__ = [
+    'DeviceResult',
+    'run_on_devices',
+    ]
+
+
+class DeviceResult(object):
+    """Outcome of an operation on one device."""
+
+    def __init__(self, serial, result=None, error=None, elapsed=0.):
+        self.serial = serial
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"<DeviceResult {self.serial} {status} {self.elapsed:.3f}s>"
+
+
+def _run_one(operation, serial, connected, backend, device_class,
+             scheduler):
+    t0 = time.perf_counter()
+    vsb = result = error = None
+    try:
+        vsb = device_class(
+            serial, backend=backend, connected=connected,
+            scheduler=scheduler)
+        result = operation(vsb)
+    except Exception as e:
+        error = e
+    finally:
+        if vsb is not None:
+            try:
+                vsb.close()
+            except Exception as e:
+                # E.g. the inventory couldn't be written; this device
+                # failed, the others carry on
+                if error is None:
+                    error = e
+    return DeviceResult(serial, result, error, time.perf_counter() - t0)
+
+
+def run_on_devices(
+        operation,
+        devices=None,
+        serials=None,
+        max_workers=8,
+        backend=None,
+        callback=None,
+        device_class=VerySeriousButton,
+        scheduler=None,
+        ):
+    """Run `operation(vsb)` on several devices concurrently.
+
+    `devices` is a list_connected() result (enumerated if omitted) and
+    `serials` optionally restricts it; serials that aren't connected get
+    a failed DeviceResult. Each device is opened, passed to `operation`
+    and closed in a pool of at most `max_workers` threads;
+    `callback(DeviceResult)` is called as each device finishes. Returns a
+    dict of DeviceResult keyed by serial number, in enumeration order (or
+    that of `serials`).
+    With a TransferScheduler, devices are started interleaved across USB
+    hubs and their transfers go through it once opened.
+    """
+    if devices is None:
+        devices = device_class.list_connected(backend)
+    devices = list(devices)
+    results = {}
+    if serials is None:
+        serials = [ser for (ser, rls, path) in devices]
+    else:
+        known = set(ser for (ser, rls, path) in devices)
+        for ser in serials:
+            if ser not in known and ser not in results:
+                res = results[ser] = DeviceResult(
+                    ser, error=VerySeriousButtonNotFound(
+                        f"Couldn't find VerySeriousButton with serial "
+                        f"number {ser!r}"))
+                if callback is not None:
+                    callback(res)
+    found = [ser for ser in serials if ser not in results]
+    if not found:
+        return {ser: results[ser] for ser in serials}
+    start_order = found
+    if scheduler is not None:
+        start_order = scheduler.order(devices, found)
+    workers = max(1, min(max_workers, len(found)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                _run_one, operation, ser, devices, backend, device_class,
+                scheduler)
+            for ser in start_order
+            ]
+        for future in as_completed(futures):
+            res = future.result()
+            results[res.serial] = res
+            if callback is not None:
+                callback(res)
+    return {ser: results[ser] for ser in serials}
@@ -0,0 +1,351 @@
+import contextlib
+import threading
+import time
+
+from ._vsbutil import (
+    VerySeriousButton,
+    VerySeriousButtonCommandError,
+    VerySeriousButtonNotFound,
+    VerySeriousButtonProtocolError,
+    VerySeriousButtonTimeout,
+    _PUBLIC_METHODS,
+    )
+
+
+__all__ = [
+    'DevicePool',
+    'PooledSession',
+    ]
+
+
+# Errors after which the handle is still good: the device answered, or
+# at least the transfer went through
+_DEVICE_ERRORS = (
+    VerySeriousButtonCommandError,
+    VerySeriousButtonProtocolError,
+    VerySeriousButtonTimeout,
+    )
+
+
+class _PooledHandle(object):
+    # A (possibly not yet open) device plus the lock that serializes
+    # access to it
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.vsb = None
+        self.lock = threading.RLock()
+        self.leases = 0
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+        # Enumerate afresh before the next open, e.g. after a failure
+        self.stale = False
+        # Removed from the pool; a new handle takes its place
+        self.evicted = False
+
+
+class DevicePool(object):
+    """Long-lived VerySeriousButton handles shared by many threads.
+
+    lease(serial) returns a PooledSession for the device, opening it on
+    first use only; later leases skip enumerating, opening and
+    GETDEVINFO, but not reading the config again (see lease()). Each
+    method call made through a session holds the device's lock, so calls
+    from different threads never interleave their HID exchanges, and
+    session.exclusive() holds it across several calls.
+
+    A handle that fails with a HID transfer error is closed and reopened
+    (at the device's current path) on its next use, so sessions survive
+    the device being unplugged and plugged back in. maintain(), run every
+    `check_interval` seconds by start(), closes handles that have had no
+    leases for `idle_timeout` seconds (None: never) and runs GETDEVINFO on
+    ones unused for `check_interval` seconds, closing them if that fails.
+    """
+
+    def __init__(self, backend=None, device_class=VerySeriousButton,
+                 idle_timeout=300., check_interval=30., registry=None,
+                 scheduler=None):
+        if registry is None:
+            from ._registry import DeviceRegistry
+            registry = DeviceRegistry(
+                backend=backend, device_class=device_class)
+        self.registry = registry
+        self.backend = registry.backend
+        self.device_class = device_class
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        # Optional TransferScheduler that opened devices are attached to
+        self.scheduler = scheduler
+        self.counts = dict(opens=0, failures=0, evictions=0, failed_checks=0)
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _resolve(self, serial):
+        if serial is not None:
+            return serial
+        connected = self.registry.list_connected()
+        if not connected:
+            raise VerySeriousButtonNotFound("No VerySeriousButtons connected")
+        return connected[0][0]
+
+    def _lock_handle(self, serial):
+        # The device's handle, locked; release handle.lock when done
+        serial = self._resolve(serial)
+        while True:
+            with self._lock:
+                handle = self._handles.get(serial)
+                if handle is None:
+                    handle = self._handles[serial] = _PooledHandle(serial)
+            handle.lock.acquire()
+            if not handle.evicted:
+                return handle
+            handle.lock.release()
+
+    def _open(self, handle):
+        # With handle.lock held
+        if handle.vsb is not None:
+            return handle.vsb
+        connected = (
+            self.registry.refresh() if handle.stale
+            else self.registry.list_connected())
+        vsb = self.device_class(
+            handle.serial, backend=self.backend, connected=connected,
+            scheduler=self.scheduler)
+        handle.vsb = vsb
+        handle.stale = False
+        handle.last_checked = time.monotonic()
+        with self._lock:
+            self.counts["opens"] += 1
+        return vsb
+
+    def _close(self, handle):
+        # With handle.lock held
+        vsb, handle.vsb = handle.vsb, None
+        if vsb is not None:
+            vsb.close()
+
+    @contextlib.contextmanager
+    def _using(self, handle):
+        with handle.lock:
+            vsb = self._open(handle)
+            try:
+                yield vsb
+            except _DEVICE_ERRORS:
+                raise
+            except OSError:
+                # The device may have gone away or been replugged; start
+                # over with a fresh enumeration next time
+                with self._lock:
+                    self.counts["failures"] += 1
+                self._close(handle)
+                handle.stale = True
+                raise
+            finally:
+                handle.last_used = time.monotonic()
+                if handle.vsb is not None and handle.vsb.hid_dev is None:
+                    # Closed by the call itself, e.g. reset()
+                    handle.vsb = None
+                    handle.stale = True
+
+    def _call(self, handle, func):
+        with self._using(handle) as vsb:
+            return func(vsb)
+
+    def open(self, serial=None):
+        """Open the device now instead of on its first use."""
+        handle = self._lock_handle(serial)
+        try:
+            self._open(handle)
+        finally:
+            handle.lock.release()
+
+    def lease(self, serial=None, keep_caches=False):
+        """A PooledSession for the device. Unless `keep_caches` is set,
+        the shadow config and keyseq pages left by earlier leases are
+        dropped, since the device may have been changed by others since;
+        set it only if nothing but this pool changes the device."""
+        handle = self._lock_handle(serial)
+        try:
+            vsb = self._open(handle)
+            if not keep_caches:
+                vsb.invalidate_config_cache()
+                vsb.invalidate_keyseq_cache()
+            handle.leases += 1
+        finally:
+            handle.lock.release()
+        return PooledSession(self, handle)
+
+    def _release(self, handle):
+        with handle.lock:
+            handle.leases -= 1
+            handle.last_used = time.monotonic()
+
+    def run(self, serial, func, keep_caches=False):
+        """Call func(vsb) with the device's lock held, on a lease made
+        with `keep_caches`."""
+        session = self.lease(serial, keep_caches)
+        try:
+            return self._call(session._handle, func)
+        finally:
+            session.release()
+
+    def drop(self, serial):
+        """Close the device's handle; leases on it reopen it when next
+        used."""
+        with self._lock:
+            handle = self._handles.get(serial)
+        if handle is not None:
+            with handle.lock:
+                self._close(handle)
+                handle.stale = True
+
+    def serials(self):
+        # Devices with an open handle
+        with self._lock:
+            handles = list(self._handles.values())
+        return sorted(h.serial for h in handles if h.vsb is not None)
+
+    def maintain(self):
+        """Evict idle handles and health-check unused ones."""
+        now = time.monotonic()
+        with self._lock:
+            handles = list(self._handles.values())
+        for handle in handles:
+            if not handle.lock.acquire(blocking=False):
+                # In use, so neither idle nor in need of a check
+                continue
+            try:
+                idle = now - handle.last_used
+                if (handle.leases == 0 and self.idle_timeout is not None
+                        and idle > self.idle_timeout):
+                    with self._lock:
+                        if handle.vsb is not None:
+                            self.counts["evictions"] += 1
+                        handle.evicted = True
+                        self._handles.pop(handle.serial, None)
+                    self._close(handle)
+                elif (handle.vsb is not None
+                        and idle > self.check_interval
+                        and now - handle.last_checked > self.check_interval):
+                    handle.last_checked = now
+                    try:
+                        handle.vsb.get_device_info()
+                    except OSError:
+                        with self._lock:
+                            self.counts["failed_checks"] += 1
+                        self._close(handle)
+                        handle.stale = True
+            finally:
+                handle.lock.release()
+
+    def _on_removal(self, serial, release, path):
+        self.drop(serial)
+
+    def _maintain_forever(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.maintain()
+            except Exception:
+                # Keep maintaining; a failing device was already closed
+                pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.registry.subscribe(on_removal=self._on_removal)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._maintain_forever, name="vsb-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.registry.unsubscribe(on_removal=self._on_removal)
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles = {}
+        for handle in handles:
+            with handle.lock:
+                self._close(handle)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PooledSession(object):
+    """A lease on a device of a DevicePool, usable from any thread.
+
+    Has the methods of VerySeriousButton, each run with the device's lock
+    held, and its attributes. Release with release() or by using it as a
+    context manager.
+    """
+
+    def __init__(self, pool, handle):
+        self._pool = pool
+        self._handle = handle
+        self._released = False
+
+    @property
+    def serial_number(self):
+        return self._handle.serial
+
+    def __getattr__(self, name):
+        # Device attributes and constants, but not unlocked methods
+        if name.startswith("_"):
+            raise AttributeError(name)
+        value = self._pool._call(
+            self._handle, lambda vsb: getattr(vsb, name))
+        if callable(value):
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}")
+        return value
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Hold the device's lock across several calls; yields the
+        VerySeriousButton itself."""
+        with self._pool._using(self._handle) as vsb:
+            yield vsb
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._handle)
+
+    def close(self):
+        # Same as release(); the device stays open in the pool
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _locked(name):
+    def method(self, *args, **kwargs):
+        return self._pool._call(
+            self._handle, lambda vsb: getattr(vsb, name)(*args, **kwargs))
+    method.__name__ = name
+    method.__qualname__ = f"PooledSession.{name}"
+    method.__doc__ = f"VerySeriousButton.{name}(), with the device locked."
+    return method
+
+
+for _name in _PUBLIC_METHODS:
+    setattr(PooledSession, _name, _locked(_name))
+del _name
@@ -0,0 +1,134 @@
+import threading
+
+from ._vsbutil import (
+    VerySeriousButton,
+    VerySeriousButtonIoError,
+    VerySeriousButtonTimeout,
+    VerySeriousButtonCommandError,
+    VerySeriousButtonProtocolError,
+    )
+
+
+__all__ = [
+    'RetryPolicy',
+    ]
+
+
+VSB = VerySeriousButton
+
+RECOVER_RETRY = "retry"
+RECOVER_RESYNC = "resync"
+RECOVER_REOPEN = "reopen"
+
+
+class RetryPolicy(object):
+    """Retries failed commands that are safe to repeat.
+
+    Set as VerySeriousButton.retry_policy (or pass to one device as
+    ``vsb.retry_policy = ...``). A command is retried up to `retries`
+    times, after a backoff starting at `backoff` seconds and doubling up
+    to `max_backoff`, if it is idempotent (see IDEMPOTENT_COMMANDS) and
+    the failure is one that repeating might fix:
+
+    - no response (timeout) or a null response code: send it again;
+    - a response with the wrong report or command ID: resynchronize by
+      running a harmless command to completion first;
+    - a HID transfer error: reopen the device first (with `reopen`), as
+      it may have been reset or replugged.
+
+    Error responses such as a bad page number are final. Because each
+    command is retried where it failed, a multi-page keyseq write
+    carries on from the failed page. `counts` tallies the
+    recoveries made, by kind.
+    """
+
+    # Repeating these with the same report leaves the device as one
+    # successful execution would. RESET, DFU and WIPECFG are deliberately
+    # not here, and neither are SAVECFG and EEPWRITE: after a timeout
+    # they may well have succeeded, and repeating them only wears the
+    # EEPROM
+    IDEMPOTENT_COMMANDS = frozenset([
+        VSB.VSB_CMD_GETDEVINFO,
+        VSB.VSB_CMD_GETCFG,
+        VSB.VSB_CMD_SETCFG,
+        VSB.VSB_CMD_LOADCFG,
+        VSB.VSB_CMD_READPAGE,
+        VSB.VSB_CMD_WRITEPAGE,
+        VSB.VSB_CMD_GETSERIAL,
+        VSB.VSB_CMD_FUCKYOU,
+        VSB.VSB_CMD_EEPREAD,
+        ])
+
+    def __init__(self, retries=2, backoff=0.005, max_backoff=0.1,
+                 reopen=True, idempotent_commands=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reopen = reopen
+        if idempotent_commands is None:
+            idempotent_commands = self.IDEMPOTENT_COMMANDS
+        self.idempotent_commands = frozenset(idempotent_commands)
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def is_idempotent(self, cmd_id):
+        return cmd_id in self.idempotent_commands
+
+    def recovery_for(self, error):
+        """How to recover from `error` before retrying; None if retrying
+        won't help."""
+        if isinstance(error, VerySeriousButtonTimeout):
+            return RECOVER_RETRY
+        if isinstance(error, VerySeriousButtonProtocolError):
+            return RECOVER_RESYNC
+        if isinstance(error, VerySeriousButtonCommandError):
+            if error.response == VSB.VSB_RESP_NULL:
+                return RECOVER_RETRY
+            return None
+        if isinstance(error, VerySeriousButtonIoError):
+            return None
+        if isinstance(error, OSError):
+            return RECOVER_REOPEN if self.reopen else RECOVER_RETRY
+        return None
+
+    def delay(self, attempt):
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+    def query(self, vsb, cmd_id, data, timeout, report):
+        attempt = 0
+        while True:
+            try:
+                return vsb._observed_query(cmd_id, data, timeout, report)
+            except OSError as e:
+                recovery = self.recovery_for(e)
+                if (recovery is None or attempt >= self.retries
+                        or not self.is_idempotent(cmd_id)):
+                    raise
+                error = e
+            if report is not None and attempt == 0:
+                # The encoded report lives in the codec's buffer, which
+                # recovering may reuse
+                report = bytes(report)
+            attempt += 1
+            with self._lock:
+                self.counts[recovery] = self.counts.get(recovery, 0) + 1
+            vsb._sleep(self.delay(attempt))
+            if recovery == RECOVER_RESYNC:
+                try:
+                    vsb._resync(timeout)
+                except OSError:
+                    # The retry will most likely fail the same way and
+                    # resync again, as long as attempts are left
+                    pass
+            elif recovery == RECOVER_REOPEN:
+                try:
+                    vsb._reopen()
+                except OSError as e:
+                    raise error from e
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self.counts)
+        if counts:
+            yield "recovered: " + ", ".join(
+                f"{n} {kind}" for kind, n in sorted(counts.items()))
@@ -0,0 +1,220 @@
+import select
+import socket
+import sys
+import threading
+import time
+
+from ._vsbutil import VerySeriousButton
+
+
+__all__ = [
+    'DeviceRegistry',
+    ]
+
+
+def _open_uevent_socket():
+    # Kernel uevent broadcasts (what "udevadm monitor --kernel" shows)
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        sock = socket.socket(
+            socket.AF_NETLINK,
+            socket.SOCK_DGRAM,
+            socket.NETLINK_KOBJECT_UEVENT,
+            )
+        sock.bind((0, 1))
+    except (AttributeError, OSError):
+        return None
+    return sock
+
+
+def _parse_uevent(msg):
+    fields = msg.split(b"\0")
+    env = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            env[key.decode("ascii", "replace")] = value.decode(
+                "ascii", "replace")
+    return env
+
+
+class DeviceRegistry(object):
+    """Cached list_connected() results, kept current by hotplug events.
+
+    Without a running watcher the cached enumeration is reused for
+    `max_age` seconds. start() launches a watcher thread that re-enumerates
+    only when a hidraw device is added or removed (via kernel netlink
+    uevents on Linux, notifications from backends that provide them, or
+    polling every `poll_interval` seconds otherwise) and calls the
+    subscribed arrival/removal callbacks with (serial, release, path).
+    """
+
+    def __init__(self, backend=None, device_class=VerySeriousButton,
+                 max_age=1., poll_interval=1., settle_time=0.1):
+        self.backend = device_class.get_backend(backend)
+        self.device_class = device_class
+        self.max_age = max_age
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self._devices = None
+        self._updated_at = 0.
+        # Bumped by every refresh(), so that waiters don't miss one
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._on_arrival = []
+        self._on_removal = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._kick = threading.Event()
+        self._sock = None
+
+    @property
+    def watching(self):
+        return self._thread is not None
+
+    def list_connected(self):
+        # Never refreshes with self._lock held, as refresh() runs the
+        # subscribers' callbacks
+        with self._lock:
+            stale = time.monotonic() - self._updated_at > self.max_age
+            if self._devices is not None and not (
+                    stale and not self.watching):
+                return list(self._devices)
+        return list(self.refresh())
+
+    def refresh(self):
+        found = self.device_class.list_connected(self.backend)
+        with self._lock:
+            old = {dev[0]: dev for dev in (self._devices or [])}
+            new = {dev[0]: dev for dev in found}
+            first = self._devices is None
+            self._devices = found
+            self._updated_at = time.monotonic()
+            self._generation += 1
+            self._changed.notify_all()
+            arrivals = [dev for ser, dev in new.items() if old.get(ser) != dev]
+            removals = [dev for ser, dev in old.items() if ser not in new]
+            on_arrival = list(self._on_arrival)
+            on_removal = list(self._on_removal)
+        if first:
+            return found
+        for dev in removals:
+            for callback in on_removal:
+                callback(*dev)
+        for dev in arrivals:
+            for callback in on_arrival:
+                callback(*dev)
+        return found
+
+    def subscribe(self, on_arrival=None, on_removal=None):
+        with self._lock:
+            if on_arrival is not None:
+                self._on_arrival.append(on_arrival)
+            if on_removal is not None:
+                self._on_removal.append(on_removal)
+
+    def unsubscribe(self, on_arrival=None, on_removal=None):
+        with self._lock:
+            if on_arrival in self._on_arrival:
+                self._on_arrival.remove(on_arrival)
+            if on_removal in self._on_removal:
+                self._on_removal.remove(on_removal)
+
+    def open(self, serial=None):
+        return self.device_class(
+            serial, backend=self.backend, connected=self.list_connected())
+
+    def wait_for(self, serial=None, timeout=None):
+        """Block until a device (with the given serial) is connected.
+
+        Returns its (serial, release, path) tuple, or None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                generation = self._generation
+            for dev in self.list_connected():
+                if serial is None or dev[0] == serial:
+                    return dev
+            wait = None if self.watching else self.poll_interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                wait = remaining if wait is None else min(wait, remaining)
+            with self._lock:
+                if self._generation == generation:
+                    self._changed.wait(wait)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.list_connected()
+        self._stop.clear()
+        listeners = getattr(self.backend, "hotplug_listeners", None)
+        if listeners is not None:
+            listeners.append(self._kick.set)
+        elif self.backend is self.device_class.get_backend():
+            self._sock = _open_uevent_socket()
+        self._thread = threading.Thread(
+            target=self._watch, name="vsb-hotplug", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._kick.set()
+        self._thread.join()
+        self._thread = None
+        listeners = getattr(self.backend, "hotplug_listeners", None)
+        if listeners is not None and self._kick.set in listeners:
+            listeners.remove(self._kick.set)
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _wait_for_event(self, timeout):
+        if self._sock is None:
+            return self._kick.wait(timeout)
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        relevant = False
+        while ready:
+            msg = self._sock.recv(16384)
+            if _parse_uevent(msg).get("SUBSYSTEM") == "hidraw":
+                relevant = True
+            ready, _, _ = select.select([self._sock], [], [], 0)
+        return relevant or self._kick.is_set()
+
+    def _watch(self):
+        # Event sources re-enumerate after the burst of events settles;
+        # without one, re-enumerate every poll_interval seconds
+        evented = self._sock is not None or hasattr(
+            self.backend, "hotplug_listeners")
+        while not self._stop.is_set():
+            timeout = 0.5 if evented else self.poll_interval
+            if evented and not self._wait_for_event(timeout):
+                continue
+            if not evented:
+                self._stop.wait(timeout)
+            if self._stop.is_set():
+                break
+            if evented and self.settle_time:
+                time.sleep(self.settle_time)
+                if self._sock is not None:
+                    self._wait_for_event(0)
+            self._kick.clear()
+            try:
+                self.refresh()
+            except Exception:
+                # Keep watching; the next event will try again
+                pass
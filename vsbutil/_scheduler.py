@@ -0,0 +1,204 @@
+import os
+import re
+import threading
+import time
+
+
+__all__ = [
+    'topology_group',
+    'TransferScheduler',
+    ]
+
+
+# USB device port path as in sysfs and hidapi's libusb backend, e.g.
+# "1-2.3:1.0" is interface 0 of the device on port 3 of the hub on port 2
+# of bus 1
+_PORT_PATH = re.compile(rb"(?<![\d.])(\d+)-(\d+(?:\.\d+)*):\d+\.\d+")
+# Older libusb backend paths: "bus:address:interface" in hex
+_LIBUSB_PATH = re.compile(rb"^([0-9a-fA-F]{4}):[0-9a-fA-F]{4}:[0-9a-fA-F]{2}$")
+_HIDRAW_PATH = re.compile(rb"^/dev/(hidraw\d+)$")
+
+
+def _sysfs_device_path(path):
+    # /dev/hidrawN -> the sysfs path of its USB interface (Linux only)
+    m = _HIDRAW_PATH.match(path)
+    if m is None:
+        return None
+    link = os.path.join(
+        b"/sys/class/hidraw", m.group(1), b"device")
+    try:
+        return os.path.realpath(link)
+    except OSError:
+        return None
+
+
+def topology_group(path):
+    """Name of the USB hub (or bus, for devices on root ports) that the
+    HID device at `path` hangs off, e.g. "1-2" or "usb1"; None if its
+    place in the USB topology can't be worked out."""
+    if isinstance(path, str):
+        path = path.encode("utf-8", "surrogateescape")
+    sysfs_path = _sysfs_device_path(path)
+    if sysfs_path is not None:
+        path = sysfs_path
+    matches = _PORT_PATH.findall(path)
+    if matches:
+        bus, ports = matches[-1]
+        ports = ports.decode("ascii")
+        if "." in ports:
+            return "%s-%s" % (bus.decode("ascii"), ports.rsplit(".", 1)[0])
+        return "usb%s" % (bus.decode("ascii"),)
+    m = _LIBUSB_PATH.match(path)
+    if m is not None:
+        return "usb%d" % (int(m.group(1), 16),)
+    return None
+
+
+class _Group(object):
+
+    def __init__(self, name, max_in_flight):
+        self.name = name
+        self.semaphore = None
+        if max_in_flight:
+            self.semaphore = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.devices = set()
+        self.transfers = 0
+        self.bytes = 0
+        self.transfer_time = 0.
+        self.first = None
+        self.last = None
+
+    def account(self, nbytes, started, ended):
+        with self.lock:
+            self.transfers += 1
+            self.bytes += nbytes
+            self.transfer_time += ended - started
+            if self.first is None:
+                self.first = started
+            self.last = ended
+
+    def to_dict(self):
+        with self.lock:
+            elapsed = 0.
+            if self.first is not None:
+                elapsed = self.last - self.first
+            return dict(
+                devices=sorted(self.devices),
+                transfers=self.transfers,
+                bytes=self.bytes,
+                elapsed=elapsed,
+                transfers_per_s=self.transfers / elapsed if elapsed else 0.,
+                bytes_per_s=self.bytes / elapsed if elapsed else 0.,
+                transfer_time=self.transfer_time,
+                )
+
+
+class _ScheduledDevice(object):
+    # hid.device proxy that takes a slot of its group for each transfer
+
+    def __init__(self, device, group):
+        self._device = device
+        self._group = group
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def _transfer(self, func, *args):
+        semaphore = self._group.semaphore
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            started = time.monotonic()
+            result = func(*args)
+            ended = time.monotonic()
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+        return result, started, ended
+
+    def send_feature_report(self, report):
+        n, started, ended = self._transfer(
+            self._device.send_feature_report, report)
+        self._group.account(len(report), started, ended)
+        return n
+
+    def get_feature_report(self, report_id, max_length):
+        data, started, ended = self._transfer(
+            self._device.get_feature_report, report_id, max_length)
+        self._group.account(len(data), started, ended)
+        return data
+
+
+class TransferScheduler(object):
+    """Limits concurrent feature report transfers per USB hub.
+
+    Devices are grouped by the hub they are on (see topology_group();
+    devices whose topology is unknown get a group each). At most
+    `max_in_flight` transfers run at once per group, 0 for no limit. A
+    slot is only held for the transfer itself, so while one device is
+    BUSY and being polled, the others in its group get the bus.
+    throughput() reports what each group achieved.
+    """
+
+    def __init__(self, max_in_flight=1, group_func=topology_group):
+        self.max_in_flight = max_in_flight
+        self.group_func = group_func
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def group_for(self, path):
+        group = self.group_func(path)
+        if group is None:
+            if isinstance(path, bytes):
+                path = path.decode("utf-8", "replace")
+            group = str(path)
+        return group
+
+    def _group(self, name):
+        with self._lock:
+            group = self._groups.get(name)
+            if group is None:
+                group = self._groups[name] = _Group(name, self.max_in_flight)
+            return group
+
+    def attach(self, vsb):
+        """Route `vsb`'s transfers through its group. Returns the group
+        name. VerySeriousButton(..., scheduler=) does this before the
+        device is opened."""
+        name = self.group_for(vsb.path)
+        group = self._group(name)
+        with group.lock:
+            group.devices.add(vsb.serial_number)
+        vsb.hid_dev = _ScheduledDevice(vsb.hid_dev, group)
+        return name
+
+    def order(self, devices, serials=None):
+        """Serial numbers from a list_connected() result (or `serials`
+        of them), interleaved across groups, so that a worker pool
+        smaller than the device count spreads over the hubs."""
+        if serials is None:
+            serials = [ser for (ser, rls, path) in devices]
+        paths = {ser: path for (ser, rls, path) in devices}
+        queues = {}
+        for ser in serials:
+            queues.setdefault(self.group_for(paths.get(ser)), []).append(ser)
+        ordered = []
+        queues = list(queues.values())
+        for i in range(max((len(q) for q in queues), default=0)):
+            ordered.extend(q[i] for q in queues if i < len(q))
+        return ordered
+
+    def throughput(self):
+        with self._lock:
+            groups = list(self._groups.values())
+        return {group.name: group.to_dict() for group in groups}
+
+    def summary(self):
+        for name, stats in sorted(self.throughput().items()):
+            yield (
+                f"{name:12s} {len(stats['devices']):4d} dev "
+                f"{stats['transfers']:7d} xfers "
+                f"{stats['transfers_per_s']:8.1f} xfers/s "
+                f"{stats['bytes_per_s'] / 1e3:8.2f} kB/s"
+                )
@@ -0,0 +1,613 @@
+import collections
+import math
+import os
+import struct
+import threading
+import time
+
+from ._vsbutil import VerySeriousButton as VSB
+
+
+__all__ = [
+    'FAULT_BAD_REPORT_ID',
+    'FAULT_WRONG_COMMAND',
+    'FAULT_NO_RESPONSE',
+    'SimulatedFirmware',
+    'SimulatedBackend',
+    'SimulatedHidraw',
+    ]
+
+
+# Special values for SimulatedFirmware.inject_fault(); any other value is
+# sent back as the response code of the affected command
+FAULT_BAD_REPORT_ID = "bad_report_id"
+FAULT_WRONG_COMMAND = "wrong_command"
+FAULT_NO_RESPONSE = "no_response"
+
+
+class SimulatedFirmware(object):
+    """Emulated VSB: RAM config, EEPROM image and command timing."""
+
+    EEPROM_SIZE = VSB.EEPROM_SIZE
+    CONFIG_ADDR = 0x000
+    KEYSEQ_ADDR = 0x020
+    DEFAULT_FUCKYOU = "FUCK YOU"
+
+    def __init__(
+            self,
+            serial="SIM00001",
+            release_number=0x0100,
+            path=None,
+            singlekey_nkeys=6,
+            keyseq_nkeys=6,
+            keyseq_pagesize=7,
+            keyseq_npages=64,
+            latency=None,
+            busy_polls=None,
+            transfer_time=0.,
+            bus=None,
+            poll_interval=0.001,
+            ):
+        if (self.KEYSEQ_ADDR + keyseq_pagesize * keyseq_npages
+                > self.EEPROM_SIZE):
+            raise ValueError("Key sequence pages don't fit in EEPROM")
+        if keyseq_pagesize + 1 > VSB.VSB_CMDDATA_LEN:
+            raise ValueError("Key sequence page doesn't fit in a report")
+        self.serial_number = serial
+        self.release_number = release_number
+        self.path = path if path is not None else (
+            f"sim:{serial}".encode())
+        self.singlekey_nkeys = singlekey_nkeys
+        self.keyseq_nkeys = keyseq_nkeys
+        self.keyseq_pagesize = keyseq_pagesize
+        self.keyseq_npages = keyseq_npages
+        # Seconds from command receipt to completion, per command ID
+        self.latency = dict(latency or {})
+        # Number of polls answered with BUSY before completion, per cmd ID
+        self.busy_polls = dict(busy_polls or {})
+        # Seconds spent on each feature report transfer
+        self.transfer_time = transfer_time
+        # Lock shared by devices on the same simulated hub, held for each
+        # transfer, so they contend for the bus like real ones
+        self.bus = bus
+        # Interrupt endpoint polling interval of the input interface; at
+        # most one input report goes out per interval
+        self.poll_interval = poll_interval
+        self.connected = True
+        self.accessible = True
+        self.eeprom = bytearray(b"\xFF" * self.EEPROM_SIZE)
+        self.config = self.default_config()
+        self.reset_count = 0
+        self.dfu_count = 0
+        self.command_counts = {}
+        self.lock = threading.RLock()
+        self._faults = []
+        self._response = None
+        self._ready_at = 0.
+        self._busy_left = 0
+        # time.perf_counter() of every press() and the queued input
+        # reports as (delivery time, report)
+        self.press_times = []
+        self._input = collections.deque()
+        self._input_ready = threading.Condition(self.lock)
+        self._next_frame = 0.
+        self.wipe_stored_config()
+        self.load_config()
+
+    @property
+    def config_size(self):
+        return 3 + self.singlekey_nkeys
+
+    def default_config(self):
+        cfg = bytearray(self.config_size)
+        cfg[0] = VSB.VSB_MODE_JOYSTICK
+        return cfg
+
+    @staticmethod
+    def checksum(data):
+        return (0xA5 + sum(data)) & 0xFF
+
+    def wipe_stored_config(self):
+        cfg = self.default_config()
+        end = self.CONFIG_ADDR + len(cfg)
+        self.eeprom[self.CONFIG_ADDR:end] = cfg
+        self.eeprom[end] = self.checksum(cfg)
+
+    def store_config(self):
+        end = self.CONFIG_ADDR + len(self.config)
+        self.eeprom[self.CONFIG_ADDR:end] = self.config
+        self.eeprom[end] = self.checksum(self.config)
+
+    def load_config(self):
+        end = self.CONFIG_ADDR + self.config_size
+        cfg = self.eeprom[self.CONFIG_ADDR:end]
+        if self.eeprom[end] != self.checksum(cfg):
+            return False
+        self.config = bytearray(cfg)
+        return True
+
+    def page_addr(self, i):
+        return self.KEYSEQ_ADDR + i * self.keyseq_pagesize
+
+    def read_page(self, i):
+        addr = self.page_addr(i)
+        return bytes(self.eeprom[addr:addr+self.keyseq_pagesize])
+
+    @property
+    def input_path(self):
+        return self.path + b"/input"
+
+    @property
+    def input_usage(self):
+        # Generic desktop usage of the input interface in the current mode
+        if self.config[0] in (VSB.VSB_MODE_SINGLEKEY, VSB.VSB_MODE_KEYSEQ):
+            return 0x06
+        return 0x04
+
+    def input_report(self, pressed):
+        if self.input_usage == 0x06:
+            # Boot keyboard report: modifiers, reserved, key codes
+            report = bytearray(8)
+            if pressed:
+                keys = self.config[2:2+self.singlekey_nkeys][:6]
+                report[0] = self.config[1]
+                report[2:2+len(keys)] = keys
+            return bytes(report)
+        return bytes([1 if pressed else 0])
+
+    def _queue_input(self, report, at):
+        with self.lock:
+            due = at
+            if self.poll_interval:
+                due = math.ceil(at / self.poll_interval) * self.poll_interval
+                due = max(due, self._next_frame)
+                self._next_frame = due + self.poll_interval
+            self._input.append((due, report))
+            self._input_ready.notify_all()
+
+    def press(self, at=None):
+        """Press the button at time.perf_counter() time `at` (default:
+        now); the input report goes out at the next free polling
+        interval."""
+        if at is None:
+            at = time.perf_counter()
+        with self.lock:
+            self.press_times.append(at)
+            self._queue_input(self.input_report(True), at)
+
+    def release(self, at=None):
+        if at is None:
+            at = time.perf_counter()
+        self._queue_input(self.input_report(False), at)
+
+    def generate_input(self, count, interval=None, start=None):
+        # `count` presses and releases, alternating every `interval`
+        # seconds (default: every polling interval)
+        if interval is None:
+            interval = self.poll_interval
+        if start is None:
+            start = time.perf_counter()
+        for i in range(count):
+            at = start + i * interval
+            if i % 2 == 0:
+                self.press(at)
+            else:
+                self.release(at)
+
+    def read_input(self, max_length, timeout):
+        # Next input report due, waiting up to `timeout` seconds (None
+        # for no limit); None if there was none
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.lock:
+            while True:
+                if not self.connected:
+                    raise OSError("Simulated device disconnected")
+                now = time.perf_counter()
+                wait = None
+                if self._input:
+                    due, report = self._input[0]
+                    if due <= now:
+                        self._input.popleft()
+                        return report[:max_length]
+                    wait = due - now
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = min(wait or deadline - now, deadline - now)
+                self._input_ready.wait(wait)
+
+    def inject_fault(self, response, cmd_id=None, count=1):
+        """Make the next `count` matching commands fail with `response`.
+
+        `response` is a VSB_RESP_* code or one of the FAULT_* constants;
+        `cmd_id` of None matches any command.
+        """
+        with self.lock:
+            self._faults.append([cmd_id, response, count])
+
+    def clear_faults(self):
+        with self.lock:
+            self._faults = []
+
+    def _take_fault(self, cmd_id):
+        for fault in self._faults:
+            if fault[0] is None or fault[0] == cmd_id:
+                fault[2] -= 1
+                if fault[2] <= 0:
+                    self._faults.remove(fault)
+                return fault[1]
+        return None
+
+    def execute(self, cmd_id, data):
+        """Run one command against the emulated state.
+
+        Returns (response code, response data).
+        """
+        if cmd_id == VSB.VSB_CMD_GETDEVINFO:
+            return VSB.VSB_RESP_OK, bytes([
+                self.singlekey_nkeys,
+                self.keyseq_nkeys,
+                self.keyseq_pagesize,
+                self.keyseq_npages,
+                ])
+        elif cmd_id == VSB.VSB_CMD_GETCFG:
+            return VSB.VSB_RESP_OK, bytes(self.config)
+        elif cmd_id == VSB.VSB_CMD_SETCFG:
+            cfg = bytearray(data[:self.config_size])
+            if cfg[0] not in (
+                    VSB.VSB_MODE_JOYSTICK,
+                    VSB.VSB_MODE_SINGLEKEY,
+                    VSB.VSB_MODE_KEYSEQ):
+                return VSB.VSB_RESP_ERR, b""
+            if cfg[-1] > self.keyseq_npages:
+                return VSB.VSB_RESP_ERR, b""
+            self.config = cfg
+            return VSB.VSB_RESP_OK, b""
+        elif cmd_id == VSB.VSB_CMD_SAVECFG:
+            self.store_config()
+            return VSB.VSB_RESP_OK, b""
+        elif cmd_id == VSB.VSB_CMD_LOADCFG:
+            if not self.load_config():
+                return VSB.VSB_RESP_BADCS, b""
+            return VSB.VSB_RESP_OK, b""
+        elif cmd_id == VSB.VSB_CMD_WIPECFG:
+            self.wipe_stored_config()
+            return VSB.VSB_RESP_OK, b""
+        elif cmd_id == VSB.VSB_CMD_READPAGE:
+            i = data[0]
+            if i >= self.keyseq_npages:
+                return VSB.VSB_RESP_BADIDX, bytes([i])
+            return VSB.VSB_RESP_OK, bytes([i]) + self.read_page(i)
+        elif cmd_id == VSB.VSB_CMD_WRITEPAGE:
+            i = data[0]
+            if i >= self.keyseq_npages:
+                return VSB.VSB_RESP_BADIDX, bytes([i])
+            addr = self.page_addr(i)
+            self.eeprom[addr:addr+self.keyseq_pagesize] = (
+                data[1:1+self.keyseq_pagesize])
+            return VSB.VSB_RESP_OK, bytes([i])
+        elif cmd_id == VSB.VSB_CMD_GETSERIAL:
+            serial = self.serial_number.encode("ascii")
+            return VSB.VSB_RESP_OK, bytes([len(serial)]) + serial
+        elif cmd_id == VSB.VSB_CMD_FUCKYOU:
+            return VSB.VSB_RESP_OK, self.DEFAULT_FUCKYOU.encode("ascii")
+        elif cmd_id == VSB.VSB_CMD_EEPREAD:
+            addr = struct.unpack(">H", bytes(data[0:2]))[0]
+            if addr >= self.EEPROM_SIZE:
+                return VSB.VSB_RESP_BADMEM, bytes(data[0:2])
+            return VSB.VSB_RESP_OK, bytes(data[0:2]) + bytes(
+                [self.eeprom[addr]])
+        elif cmd_id == VSB.VSB_CMD_EEPWRITE:
+            addr = struct.unpack(">H", bytes(data[0:2]))[0]
+            if addr >= self.EEPROM_SIZE:
+                return VSB.VSB_RESP_BADMEM, bytes(data[0:2])
+            self.eeprom[addr] = data[2]
+            return VSB.VSB_RESP_OK, bytes(data[0:2])
+        elif cmd_id == VSB.VSB_CMD_RESET:
+            self.reset_count += 1
+            return VSB.VSB_RESP_OK, b""
+        elif cmd_id == VSB.VSB_CMD_DFU:
+            self.dfu_count += 1
+            return VSB.VSB_RESP_OK, b""
+        return VSB.VSB_RESP_BADCMD, b""
+
+    def _transfer(self):
+        if self.bus is None:
+            time.sleep(self.transfer_time)
+        else:
+            with self.bus:
+                time.sleep(self.transfer_time)
+
+    def send_feature_report(self, report):
+        report = bytes(bytearray(report))
+        if self.transfer_time:
+            self._transfer()
+        with self.lock:
+            if not self.connected:
+                raise OSError("Simulated device disconnected")
+            if report[0] != VSB.REPORTID_VSB:
+                raise OSError(f"Unexpected report ID {report[0]}")
+            cmd_id = report[1]
+            data = bytearray(report[3:])
+            data += bytes(VSB.VSB_CMDDATA_LEN - len(data))
+            self.command_counts[cmd_id] = (
+                self.command_counts.get(cmd_id, 0) + 1)
+            fault = self._take_fault(cmd_id)
+            if fault is None:
+                resp, rdata = self.execute(cmd_id, data)
+            elif fault == FAULT_WRONG_COMMAND:
+                resp, rdata = VSB.VSB_RESP_OK, b""
+                cmd_id = (cmd_id + 1) & 0xFF
+            elif fault in (FAULT_BAD_REPORT_ID, FAULT_NO_RESPONSE):
+                resp, rdata = fault, b""
+            else:
+                resp, rdata = fault, bytes(data[0:2])
+            self._response = (cmd_id, resp, rdata)
+            self._ready_at = time.monotonic() + self.latency.get(cmd_id, 0.)
+            self._busy_left = self.busy_polls.get(cmd_id, 0)
+        return len(report)
+
+    def get_feature_report(self, report_id, max_length):
+        if self.transfer_time:
+            self._transfer()
+        with self.lock:
+            if not self.connected:
+                raise OSError("Simulated device disconnected")
+            if self._response is None:
+                cmd_id, resp, rdata = VSB.VSB_CMD_NONE, VSB.VSB_RESP_NULL, b""
+            else:
+                cmd_id, resp, rdata = self._response
+            if resp == FAULT_BAD_REPORT_ID:
+                report_id, resp = report_id ^ 0xFF, VSB.VSB_RESP_OK
+            if (resp == FAULT_NO_RESPONSE
+                    or self._busy_left > 0
+                    or time.monotonic() < self._ready_at):
+                self._busy_left = max(self._busy_left - 1, 0)
+                resp, rdata = VSB.VSB_RESP_BUSY, b""
+            report = bytearray(VSB.VSB_FEATREP_SIZE + 1)
+            report[0:3] = bytes([report_id, cmd_id, resp])
+            report[3:3+len(rdata)] = rdata
+            return list(report[:max_length])
+
+
+class _SimulatedDevice(object):
+    # Stand-in for hid.device, bound to a firmware instance by open_path()
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.firmware = None
+        self.input = False
+        self.nonblocking = False
+
+    def open_path(self, path):
+        fw = self.backend.find(path)
+        if fw is None or not fw.connected:
+            raise OSError(f"No simulated device at {path!r}")
+        if not fw.accessible:
+            raise OSError(f"Permission denied for {path!r}")
+        self.firmware = fw
+        self.input = path == fw.input_path or path == fw.input_path.decode()
+
+    def set_nonblocking(self, v):
+        self.nonblocking = bool(v)
+        return 0
+
+    def _fw(self):
+        if self.firmware is None:
+            raise ValueError("not open")
+        return self.firmware
+
+    def send_feature_report(self, report):
+        return self._fw().send_feature_report(report)
+
+    def get_feature_report(self, report_id, max_length):
+        return self._fw().get_feature_report(report_id, max_length)
+
+    def read(self, max_length, timeout_ms=0):
+        fw = self._fw()
+        if timeout_ms > 0:
+            timeout = timeout_ms / 1e3
+        elif self.nonblocking:
+            timeout = 0.
+        else:
+            timeout = None
+        if not self.input:
+            # The vendor interface has no input reports
+            if timeout:
+                time.sleep(timeout)
+            return []
+        report = fw.read_input(max_length, timeout)
+        return [] if report is None else list(report)
+
+    def close(self):
+        self.firmware = None
+
+
+class SimulatedBackend(object):
+    """Drop-in replacement for the hid module backed by SimulatedFirmware.
+
+    Pass as `backend=` to VerySeriousButton or
+    VerySeriousButton.list_connected.
+    """
+
+    def __init__(self, devices=None, count=1, **kwargs):
+        if devices is None:
+            devices = [
+                SimulatedFirmware(serial=f"SIM{i+1:05d}", **kwargs)
+                for i in range(count)
+                ]
+        self.devices = list(devices)
+        # Called without arguments whenever a device is added or removed
+        self.hotplug_listeners = []
+
+    def _notify_hotplug(self):
+        for listener in list(self.hotplug_listeners):
+            listener()
+
+    def add(self, firmware):
+        firmware.connected = True
+        self.devices.append(firmware)
+        self._notify_hotplug()
+        return firmware
+
+    def remove(self, firmware):
+        self.devices.remove(firmware)
+        firmware.connected = False
+        self._notify_hotplug()
+
+    def find(self, path):
+        if isinstance(path, str):
+            path = path.encode()
+        for fw in self.devices:
+            if fw.path == path or fw.input_path == path:
+                return fw
+        return None
+
+    def get(self, serial):
+        for fw in self.devices:
+            if fw.serial_number == serial:
+                return fw
+        raise KeyError(serial)
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        if vendor_id not in (0, VSB.USB_VID):
+            return []
+        if product_id not in (0, VSB.USB_PID):
+            return []
+        devices = []
+        for fw in self.devices:
+            if not fw.connected:
+                continue
+            # The vendor interface, then the gamepad/keyboard one
+            for path, usage_page, usage, interface in (
+                    (fw.path, VSB.HID_USAGE_PAGE_VSB, VSB.HID_USAGE_ID_VSB, 0),
+                    (fw.input_path, 0x01, fw.input_usage, 1),
+                    ):
+                devices.append(dict(
+                    path=path,
+                    vendor_id=VSB.USB_VID,
+                    product_id=VSB.USB_PID,
+                    serial_number=fw.serial_number,
+                    release_number=fw.release_number,
+                    manufacturer_string="Simulated",
+                    product_string="Very Serious Button",
+                    usage_page=usage_page,
+                    usage=usage,
+                    interface_number=interface,
+                    ))
+        return devices
+
+    def device(self):
+        return _SimulatedDevice(self)
+
+
+# Enough of the VSB report descriptor to identify it: vendor usage page,
+# usage and the start of the application collection
+_REPORT_DESCRIPTOR = bytes([
+    0x06, VSB.HID_USAGE_PAGE_VSB & 0xFF, VSB.HID_USAGE_PAGE_VSB >> 8,
+    0x09, VSB.HID_USAGE_ID_VSB,
+    0xA1, 0x01,
+    ])
+
+
+class SimulatedHidraw(object):
+    """Kernel side of hidraw for SimulatedFirmware: fake os.open(),
+    fcntl.ioctl() and os.close() for a HidrawBackend, plus a fake sysfs
+    tree to enumerate from.
+
+    The devices of `backend` (a SimulatedBackend) appear as hidraw0,
+    hidraw1, ... in the order they were added.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.ioctl_count = 0
+        self._fds = {}
+        self._next_fd = 100
+        self._lock = threading.Lock()
+
+    def _firmware(self, name):
+        for i, fw in enumerate(self.backend.devices):
+            if f"hidraw{i}" == name:
+                return fw
+        return None
+
+    def open(self, path, flags):
+        if isinstance(path, bytes):
+            path = path.decode("utf-8", "surrogateescape")
+        fw = self._firmware(path.rsplit("/", 1)[-1])
+        if fw is None or not fw.connected:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        if not fw.accessible:
+            raise PermissionError(13, "Permission denied", path)
+        with self._lock:
+            fd = self._next_fd
+            self._next_fd += 1
+            self._fds[fd] = fw
+        return fd
+
+    def close(self, fd):
+        with self._lock:
+            if self._fds.pop(fd, None) is None:
+                raise OSError(9, "Bad file descriptor")
+
+    def ioctl(self, fd, request, buf, mutate_flag=True):
+        fw = self._fds.get(fd)
+        if fw is None:
+            raise OSError(9, "Bad file descriptor")
+        if (request >> 8) & 0xFF != ord("H"):
+            raise OSError(25, "Inappropriate ioctl for device")
+        self.ioctl_count += 1
+        nr = request & 0xFF
+        size = (request >> 16) & 0x3FFF
+        if nr == 0x06:
+            return fw.send_feature_report(buf[:size])
+        if nr == 0x07:
+            report = fw.get_feature_report(buf[0], size)
+            buf[:len(report)] = bytes(report)
+            return len(report)
+        raise OSError(22, "Invalid argument")
+
+    def write_sysfs(self, root):
+        """Lay out class/hidraw under directory `root` the way Linux does
+        for the devices, as they are now. Returns the class directory."""
+        class_dir = os.path.join(root, "class", "hidraw")
+        os.makedirs(class_dir, exist_ok=True)
+        for i, fw in enumerate(self.backend.devices):
+            usb_dir = os.path.join(root, "devices", "usb1", f"1-{i+1}")
+            intf_dir = os.path.join(usb_dir, f"1-{i+1}:1.0")
+            hid_dir = os.path.join(
+                intf_dir,
+                f"0003:{VSB.USB_VID:04X}:{VSB.USB_PID:04X}.{i+1:04X}")
+            os.makedirs(hid_dir, exist_ok=True)
+            files = [
+                (usb_dir, "bcdDevice", f"{fw.release_number:04x}"),
+                (usb_dir, "manufacturer", "Simulated"),
+                (usb_dir, "product", "Very Serious Button"),
+                (usb_dir, "serial", fw.serial_number),
+                (intf_dir, "bInterfaceNumber", "00"),
+                (hid_dir, "uevent", (
+                    f"HID_ID=0003:{VSB.USB_VID:08X}:{VSB.USB_PID:08X}\n"
+                    f"HID_NAME=Simulated Very Serious Button\n"
+                    f"HID_UNIQ={fw.serial_number}\n")),
+                ]
+            for directory, name, text in files:
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(text + "\n")
+            with open(os.path.join(hid_dir, "report_descriptor"), "wb") as f:
+                f.write(_REPORT_DESCRIPTOR)
+            node = os.path.join(class_dir, f"hidraw{i}")
+            os.makedirs(node, exist_ok=True)
+            link = os.path.join(node, "device")
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(hid_dir, link)
+        return class_dir
+
+    def hidraw_backend(self, sysfs_root=None, dev_root="/dev"):
+        # HidrawBackend driving these devices; sysfs_root is from
+        # write_sysfs()
+        from ._hidraw import HidrawBackend
+        return HidrawBackend(
+            sysfs_root or "/nonexistent", dev_root,
+            ioctl=self.ioctl, os_open=self.open, os_close=self.close)
@@ -0,0 +1,571 @@
+from array import array
+import functools
+import os
+import threading
+import time
+
+from ._vsbutil import VerySeriousButton, VerySeriousButtonNotFound
+from ._metrics import _error_name, _percentile
+from ._pool import DevicePool
+
+
+__all__ = [
+    'SOAK_COMMANDS',
+    'parse_mix',
+    'SoakTest',
+    ]
+
+
+class _DeviceState(object):
+    # Where each command is in its walk over the device
+
+    def __init__(self):
+        self.read_page = 0
+        self.write_page = 0
+        self.eeprom_addr = 0
+        # Page contents as found before the first write, written back
+        # unchanged
+        self.pages = {}
+        # Command of the operation in progress; other commands it sends
+        # (e.g. WRITEPAGE's first READPAGE) aren't measured
+        self.measuring = None
+
+
+def _getcfg(vsb, state):
+    vsb.get_config()
+
+
+def _readpage(vsb, state):
+    i = state.read_page % vsb.num_keyseq_pages
+    state.read_page = i + 1
+    vsb.read_raw_keyseq_page(i)
+
+
+def _writepage(vsb, state):
+    i = state.write_page % vsb.num_keyseq_pages
+    page = state.pages.get(i)
+    if page is None:
+        page = state.pages[i] = vsb.read_raw_keyseq_page(i)
+    vsb.write_raw_keyseq_page(i, page)
+    state.write_page = i + 1
+
+
+def _eepread(vsb, state):
+    addr = state.eeprom_addr % vsb.EEPROM_SIZE
+    state.eeprom_addr = addr + 1
+    vsb.read_eeprom_byte(addr)
+
+
+def _savecfg(vsb, state):
+    vsb.store_current_config()
+
+
+# name: (command whose latency is measured, operation)
+SOAK_COMMANDS = {
+    "getcfg": (VerySeriousButton.VSB_CMD_GETCFG, _getcfg),
+    "readpage": (VerySeriousButton.VSB_CMD_READPAGE, _readpage),
+    "writepage": (VerySeriousButton.VSB_CMD_WRITEPAGE, _writepage),
+    "eepread": (VerySeriousButton.VSB_CMD_EEPREAD, _eepread),
+    "savecfg": (VerySeriousButton.VSB_CMD_SAVECFG, _savecfg),
+    }
+
+
+def parse_mix(text):
+    """{command: weight} from e.g. "getcfg=4,readpage=2,writepage"."""
+    mix = {}
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, weight = item.partition("=")
+        name = name.strip().lower()
+        if name not in SOAK_COMMANDS:
+            raise ValueError(
+                f"Unknown soak command {name!r} (known: "
+                + ", ".join(SOAK_COMMANDS) + ")")
+        try:
+            mix[name] = int(weight) if sep else 1
+        except ValueError:
+            raise ValueError(f"Bad weight for {name}: {weight!r}") from None
+        if mix[name] < 0:
+            raise ValueError(f"Negative weight for {name}")
+    mix = {name: weight for name, weight in mix.items() if weight}
+    if not mix:
+        raise ValueError("Empty command mix")
+    return mix
+
+
+def _interleave(mix):
+    # Smooth weighted round robin: each command's share of every stretch
+    # of the sequence stays close to its weight
+    names = list(mix)
+    total = sum(mix.values())
+    current = dict.fromkeys(names, 0)
+    while True:
+        for name in names:
+            current[name] += mix[name]
+        best = max(names, key=current.__getitem__)
+        current[best] -= total
+        yield best
+
+
+class _Window(object):
+    # Events of one time window, until summarized
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.latencies = {}
+        self.errors = {}
+        self.busy_polls = {}
+        self.failed = {}
+        self.devices = {}
+
+    def add(self, name, event):
+        samples = self.latencies.get(name)
+        if samples is None:
+            samples = self.latencies[name] = array('d')
+            self.errors[name] = {}
+            self.busy_polls[name] = 0
+        samples.append(event.elapsed)
+        self.busy_polls[name] += event.busy_polls
+        if event.error is not None:
+            errors = self.errors[name]
+            error = _error_name(event)
+            errors[error] = errors.get(error, 0) + 1
+        self.devices[event.serial] = self.devices.get(event.serial, 0) + 1
+
+    def summary(self, end):
+        duration = end - self.start
+        commands = {}
+        ops = busy_polls = errors = 0
+        for name, samples in self.latencies.items():
+            n = len(samples)
+            n_errors = sum(self.errors[name].values())
+            commands[name] = dict(
+                count=n,
+                errors=self.errors[name],
+                busy_polls=self.busy_polls[name],
+                p50=_percentile(samples, 50),
+                p95=_percentile(samples, 95),
+                p99=_percentile(samples, 99),
+                max=max(samples),
+                )
+            ops += n
+            busy_polls += self.busy_polls[name]
+            errors += n_errors
+        return dict(
+            start=self.start,
+            duration=duration,
+            ops=ops,
+            ops_per_s=ops / duration if duration > 0 else 0.,
+            busy_ratio=busy_polls / (busy_polls + ops) if ops else 0.,
+            errors=errors,
+            error_rate=errors / ops if ops else 0.,
+            failed=sum(self.failed.values()),
+            failed_by_device=dict(self.failed),
+            ops_by_device=dict(self.devices),
+            commands=commands,
+            )
+
+
+def _format_elapsed(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class SoakTest(object):
+    """Runs a weighted mix of SOAK_COMMANDS against devices for a
+    duration or number of commands, in time windows.
+
+    Each device gets a thread of its own, issuing the commands in `mix`
+    ({name: weight}, see parse_mix()) interleaved in proportion to their
+    weights; `count` limits the total over all devices. READPAGE and
+    EEPREAD walk over all keyseq pages and EEPROM addresses, WRITEPAGE
+    writes every keyseq page back with the contents it had, and SAVECFG
+    stores the config the device is running with, so a soak changes
+    nothing on the devices (but does wear their EEPROM).
+
+    Every `window` seconds, the latency percentiles, throughput, BUSY
+    replies per response poll and error rates of the past window are
+    summarized into `windows`, passed to `on_window` and, with a
+    `checkpoint` path, saved along with the settings so that an
+    interrupted run can be continued with resume(). Commands that fail
+    are counted per window and the device reopened, if need be, on the
+    next one; a device that can't be opened when the run starts counts
+    as failed and sits the run out. Only the soak's own devices, and of
+    each operation only its measured command, are counted. drift()
+    compares the latencies and throughput of the first and last windows.
+    """
+
+    WINDOW = 60.
+    DRIFT_THRESHOLD = 0.5
+    # Commands per window needed to take part in drift detection
+    DRIFT_MIN_COUNT = 20
+    # Latency changes within a USB frame are jitter, not drift
+    DRIFT_MIN_CHANGE = 0.001
+    FAILURE_BACKOFF = 0.05
+
+    def __init__(self, mix, duration=None, count=None, window=None,
+                 checkpoint=None, drift_threshold=None, backend=None,
+                 device_class=VerySeriousButton, scheduler=None):
+        self.mix = dict(mix)
+        self.duration = duration
+        self.count = count
+        self.window = window or self.WINDOW
+        self.checkpoint = checkpoint
+        self.drift_threshold = (
+            self.DRIFT_THRESHOLD if drift_threshold is None
+            else drift_threshold)
+        self.backend = backend
+        self.device_class = device_class
+        self.scheduler = scheduler
+        self.serials = None
+        self.windows = []
+        self.elapsed = 0.
+        self.issued = 0
+        self.finished = False
+        self.started = None
+        self.on_window = None
+        self._cmd_names = {
+            SOAK_COMMANDS[name][0]: name for name in self.mix}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._current = None
+        self._closed = []
+        self._t0 = None
+
+    @classmethod
+    def resume(cls, path, **kwargs):
+        """Continue the run saved in checkpoint file `path`, with its
+        settings, devices and windows."""
+        import json
+        with open(path) as f:
+            state = json.load(f)
+        if state.get("version") != 1:
+            raise ValueError(f"{path}: not a soak checkpoint")
+        soak = cls(
+            state["mix"], state["duration"], state["count"],
+            state["window"], path, state["drift_threshold"], **kwargs)
+        soak.serials = state["serials"]
+        soak.windows = state["windows"]
+        soak.elapsed = state["elapsed"]
+        soak.issued = state["issued"]
+        soak.finished = state["finished"]
+        soak.started = state["started"]
+        return soak
+
+    def to_dict(self):
+        return dict(
+            version=1,
+            mix=self.mix,
+            duration=self.duration,
+            count=self.count,
+            window=self.window,
+            drift_threshold=self.drift_threshold,
+            serials=self.serials,
+            started=self.started,
+            elapsed=self.elapsed,
+            issued=self.issued,
+            finished=self.finished,
+            totals=self.totals(),
+            drift=self.drift(),
+            windows=self.windows,
+            )
+
+    def save(self, path=None):
+        # Write and rename, so an interruption never leaves a partial file
+        import json
+        path = path or self.checkpoint
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def _offset(self):
+        return self.elapsed + time.monotonic() - self._t0
+
+    def _new_window(self, start):
+        end = (int(start / self.window) + 1) * self.window
+        if end - start < 1e-6:
+            end += self.window
+        return _Window(start, end)
+
+    def _roll(self, now):
+        # With self._lock held; commands still in progress at the end of
+        # the run count in the last window
+        while now >= self._current.end and (
+                self.duration is None or self._current.end < self.duration):
+            self._closed.append(self._current)
+            self._current = _Window(
+                self._current.end, self._current.end + self.window)
+
+    def _record(self, state, event):
+        # QueryEvent listener on each of the soak's own devices
+        if event.cmd_id != state.measuring:
+            return
+        name = self._cmd_names[event.cmd_id]
+        with self._lock:
+            if self._current is None:
+                return
+            self._roll(self._offset())
+            self._current.add(name, event)
+
+    def _failed(self, serial):
+        with self._lock:
+            self._roll(self._offset())
+            failed = self._current.failed
+            failed[serial] = failed.get(serial, 0) + 1
+
+    def _take(self):
+        with self._lock:
+            if self.count is not None and self.issued >= self.count:
+                return False
+            if (self.duration is not None
+                    and self._offset() >= self.duration):
+                return False
+            self.issued += 1
+            return True
+
+    def _worker(self, pool, serial):
+        state = _DeviceState()
+        listener = functools.partial(self._record, state)
+        schedule = _interleave(self.mix)
+        failures = 0
+        while not self._stop.is_set() and self._take():
+            cmd_id, operation = SOAK_COMMANDS[next(schedule)]
+            try:
+                session = pool.lease(serial)
+                try:
+                    with session.exclusive() as vsb:
+                        if listener not in vsb.listeners:
+                            # First use of this handle (the pool reopens
+                            # devices after failures)
+                            vsb.listeners.append(listener)
+                        state.measuring = cmd_id
+                        try:
+                            operation(vsb, state)
+                        finally:
+                            state.measuring = None
+                finally:
+                    session.release()
+                failures = 0
+            except IOError:
+                self._failed(serial)
+                failures += 1
+                self._stop.wait(min(self.FAILURE_BACKOFF * failures, 1.))
+
+    def _flush(self, end=None):
+        # Summarize the windows closed since the last call
+        with self._lock:
+            closed, self._closed = self._closed, []
+            if end is not None:
+                current, self._current = self._current, None
+                if current.latencies or current.failed or end > current.start:
+                    closed.append(current)
+        for window in closed:
+            summary = window.summary(
+                window.end if end is None else min(end, window.end))
+            self.windows.append(summary)
+            if self.on_window is not None:
+                self.on_window(summary)
+        if closed and self.checkpoint:
+            self.save()
+
+    def run(self, serials=None, devices=None, poll_interval=0.2):
+        """Run (or continue) the soak on the devices with the given serial
+        numbers (default: the first device found) until the duration or
+        count is reached, or KeyboardInterrupt. Returns self."""
+        if self.finished:
+            return self
+        if self.serials is None:
+            if devices is None:
+                devices = self.device_class.list_connected(self.backend)
+            if serials is None:
+                serials = [ser for (ser, rls, path) in devices[:1]]
+            self.serials = list(serials)
+        if not self.serials:
+            raise VerySeriousButtonNotFound("No VerySeriousButtons connected")
+        if self.started is None:
+            self.started = time.time()
+        pool = DevicePool(
+            backend=self.backend, device_class=self.device_class,
+            idle_timeout=None, scheduler=self.scheduler)
+        self._stop.clear()
+        self._t0 = time.monotonic()
+        self._current = self._new_window(self.elapsed)
+        # Devices that can't be opened (e.g. unplugged since the run was
+        # checkpointed) count as failed; the others go ahead
+        opened = []
+        error = None
+        for serial in self.serials:
+            try:
+                pool.open(serial)
+            except IOError as e:
+                self._failed(serial)
+                error = e
+            else:
+                opened.append(serial)
+        if not opened:
+            self._current = None
+            pool.close()
+            raise error
+        threads = [
+            threading.Thread(
+                target=self._worker, args=(pool, serial),
+                name=f"vsb-soak-{serial}", daemon=True)
+            for serial in opened
+            ]
+        interrupted = False
+        try:
+            for thread in threads:
+                thread.start()
+            while any(thread.is_alive() for thread in threads):
+                wait = poll_interval
+                if self.duration is not None:
+                    wait = min(wait, self.duration - self._offset())
+                    if wait <= 0:
+                        break
+                threads[0].join(wait)
+                with self._lock:
+                    self._roll(self._offset())
+                self._flush()
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            end = self._offset()
+            self.elapsed = end
+            self.finished = not interrupted
+            self._flush(end)
+            pool.close()
+        if interrupted:
+            raise KeyboardInterrupt()
+        return self
+
+    def totals(self):
+        ops = sum(w["ops"] for w in self.windows)
+        errors = sum(w["errors"] for w in self.windows)
+        busy_polls = sum(
+            cmd["busy_polls"]
+            for w in self.windows for cmd in w["commands"].values())
+        commands = {}
+        for w in self.windows:
+            for name, stats in w["commands"].items():
+                total = commands.setdefault(name, dict(
+                    count=0, errors=0, p50=[], p99_max=0.))
+                total["count"] += stats["count"]
+                total["errors"] += sum(stats["errors"].values())
+                total["p50"].append(stats["p50"])
+                total["p99_max"] = max(total["p99_max"], stats["p99"])
+        for total in commands.values():
+            # Median of the windows' medians
+            total["p50"] = _percentile(total["p50"], 50)
+        devices = {}
+        for w in self.windows:
+            for serial, n in w["ops_by_device"].items():
+                devices.setdefault(serial, dict(ops=0, failed=0))["ops"] += n
+            for serial, n in w["failed_by_device"].items():
+                devices.setdefault(serial, dict(ops=0, failed=0))[
+                    "failed"] += n
+        return dict(
+            ops=ops,
+            ops_per_s=ops / self.elapsed if self.elapsed else 0.,
+            busy_ratio=busy_polls / (busy_polls + ops) if ops else 0.,
+            errors=errors,
+            error_rate=errors / ops if ops else 0.,
+            failed=sum(w["failed"] for w in self.windows),
+            commands=commands,
+            devices=devices,
+            )
+
+    def drift(self):
+        """Latency (p50, p99) and throughput changes from the first to the
+        last window with enough commands, as fractions of the first; those
+        beyond drift_threshold (slower by more than DRIFT_MIN_CHANGE, or
+        fewer ops/s) are flagged."""
+        results = []
+        full = [w for w in self.windows if w["duration"] >= self.window * .99]
+        if len(full) >= 2:
+            first, last = full[0], full[-1]
+            if first["ops_per_s"]:
+                change = last["ops_per_s"] / first["ops_per_s"] - 1.
+                results.append(dict(
+                    command=None, metric="ops_per_s",
+                    first=first["ops_per_s"], last=last["ops_per_s"],
+                    change=change, drifting=-change > self.drift_threshold,
+                    ))
+        for name in self.mix:
+            windows = [
+                w["commands"][name] for w in self.windows
+                if w["commands"].get(name, {}).get("count", 0)
+                >= self.DRIFT_MIN_COUNT
+                ]
+            if len(windows) < 2:
+                continue
+            first, last = windows[0], windows[-1]
+            for metric in ("p50", "p99"):
+                if not first[metric]:
+                    continue
+                change = last[metric] / first[metric] - 1.
+                results.append(dict(
+                    command=name, metric=metric,
+                    first=first[metric], last=last[metric],
+                    change=change,
+                    drifting=(
+                        change > self.drift_threshold
+                        and last[metric] - first[metric]
+                        > self.DRIFT_MIN_CHANGE),
+                    ))
+        return results
+
+    @property
+    def drifting(self):
+        return any(d["drifting"] for d in self.drift())
+
+    def format_window(self, w):
+        line = (
+            f"[{_format_elapsed(w['start'] + w['duration'])}] "
+            f"{w['ops_per_s']:8.1f} ops/s  busy {w['busy_ratio']*100:5.1f}%  "
+            f"errors {w['errors']}  failed {w['failed']}  p99"
+            )
+        for name in self.mix:
+            stats = w["commands"].get(name)
+            if stats is not None:
+                line += f" {name} {stats['p99']*1e3:.2f}"
+        return line + " ms"
+
+    def summary(self):
+        totals = self.totals()
+        yield (
+            f"{len(self.serials or ())} device(s), "
+            f"{_format_elapsed(self.elapsed)}: {totals['ops']} commands, "
+            f"{totals['ops_per_s']:.1f} ops/s, "
+            f"busy {totals['busy_ratio']*100:.1f}% of polls, "
+            f"error rate {totals['error_rate']*100:.3f}%, "
+            f"{totals['failed']} failed"
+            )
+        for name, stats in sorted(totals["commands"].items()):
+            yield (
+                f"  {name:10s} {stats['count']:8d} cmds  "
+                f"p50 {stats['p50']*1e3:7.3f} ms  "
+                f"worst p99 {stats['p99_max']*1e3:7.3f} ms  "
+                f"{stats['errors']} errors"
+                )
+        if len(totals["devices"]) > 1:
+            for serial, stats in sorted(totals["devices"].items()):
+                yield (f"  {serial}: {stats['ops']} commands, "
+                       f"{stats['failed']} failed")
+        for d in self.drift():
+            label = d["command"] or "all"
+            if d["metric"] == "ops_per_s":
+                values = f"{d['first']:.1f} -> {d['last']:.1f} ops/s"
+            else:
+                values = (f"{d['first']*1e3:.3f} -> {d['last']*1e3:.3f} "
+                          f"ms {d['metric']}")
+            yield (
+                f"  drift {label}: {values} ({d['change']*100:+.1f}%)"
+                + ("  DRIFTING" if d["drifting"] else "")
+                )
@@ -0,0 +1,328 @@
+import ast
+import struct
+import threading
+import time
+
+from ._vsbutil import VerySeriousButton, VerySeriousButtonIoError
+
+
+__all__ = [
+    'RecordingBackend',
+    'ReplayBackend',
+    'TranscriptMismatch',
+    'read_transcript',
+    'iter_exchanges',
+    ]
+
+
+MAGIC = b"VSBT\x01\n"
+
+# Kind, device number, seconds since the session started, payload length
+RECORD_HEADER = struct.Struct(">BHdI")
+
+REC_SESSION = 0     # payload: wall clock time (">d")
+REC_ENUMERATE = 1   # payload: repr() of the enumerate() result
+REC_OPEN = 2        # payload: HID path
+REC_SEND = 3        # payload: feature report sent; time is when sent
+REC_GET = 4         # payload: report received; time is when requested
+REC_CLOSE = 5
+
+_WALL_TIME = struct.Struct(">d")
+
+
+class TranscriptMismatch(VerySeriousButtonIoError):
+    pass
+
+
+class TranscriptRecord(object):
+    __slots__ = ('kind', 'device', 'time', 'data')
+
+    def __init__(self, kind, device, time, data):
+        self.kind = kind
+        self.device = device
+        self.time = time
+        self.data = data
+
+    def __repr__(self):
+        return "TranscriptRecord(%d, %d, %.6f, %r)" % (
+            self.kind, self.device, self.time, self.data)
+
+
+def _path_bytes(path):
+    if isinstance(path, str):
+        return path.encode("utf-8", "surrogateescape")
+    return bytes(path)
+
+
+def read_transcript(path):
+    """Yield the TranscriptRecords in transcript file `path`. Device
+    numbers are made unique across the sessions appended to it."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a vsbutil transcript")
+        base = 0
+        session_max = 0
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                break
+            if len(header) < RECORD_HEADER.size:
+                # Truncated by a crash while recording
+                break
+            kind, device, t, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            if kind == REC_SESSION:
+                base += session_max
+                session_max = 0
+            session_max = max(session_max, device + 1)
+            yield TranscriptRecord(kind, base + device, t, data)
+
+
+class Exchange(object):
+    """One command as recorded: the report sent and the reports polled
+    until it completed (`response` is None if it never did)."""
+
+    __slots__ = ('path', 'sent', 'sent_at', 'busy', 'response', 'ready_after')
+
+    def __init__(self, path, sent, sent_at):
+        self.path = path
+        self.sent = sent
+        self.sent_at = sent_at
+        self.busy = []
+        self.response = None
+        # Seconds from sending until the poll that got the response
+        self.ready_after = None
+
+    @property
+    def cmd_id(self):
+        return self.sent[1]
+
+    @property
+    def response_code(self):
+        if self.response is None:
+            return None
+        return self.response[2]
+
+
+def iter_exchanges(records):
+    """Group transcript records into Exchanges; each device's come in the
+    order its commands were sent."""
+    paths = {}
+    pending = {}
+    for rec in records:
+        if rec.kind == REC_OPEN:
+            paths[rec.device] = rec.data
+        elif rec.kind == REC_SEND:
+            exchange = pending.pop(rec.device, None)
+            if exchange is not None:
+                yield exchange
+            pending[rec.device] = Exchange(
+                paths.get(rec.device), rec.data, rec.time)
+        elif rec.kind == REC_GET:
+            exchange = pending.get(rec.device)
+            if exchange is None or exchange.response is not None:
+                continue
+            if len(rec.data) > 2 and rec.data[2] == (
+                    VerySeriousButton.VSB_RESP_BUSY):
+                exchange.busy.append(rec.data)
+            else:
+                exchange.response = rec.data
+                exchange.ready_after = max(rec.time - exchange.sent_at, 0.)
+        elif rec.kind == REC_CLOSE:
+            exchange = pending.pop(rec.device, None)
+            if exchange is not None:
+                yield exchange
+    for exchange in pending.values():
+        yield exchange
+
+
+class _RecordingDevice(object):
+
+    def __init__(self, recorder, device, number):
+        self._recorder = recorder
+        self._device = device
+        self._number = number
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def open_path(self, path):
+        self._device.open_path(path)
+        self._recorder._log(REC_OPEN, self._number, _path_bytes(path))
+
+    def send_feature_report(self, report):
+        report = bytes(report)
+        n = self._device.send_feature_report(report)
+        self._recorder._log(REC_SEND, self._number, report)
+        return n
+
+    def get_feature_report(self, report_id, max_length):
+        t = time.monotonic()
+        data = self._device.get_feature_report(report_id, max_length)
+        self._recorder._log(REC_GET, self._number, bytes(data), t)
+        return data
+
+    def close(self):
+        self._device.close()
+        self._recorder._log(REC_CLOSE, self._number, b"")
+
+
+class RecordingBackend(object):
+    """HID backend wrapper that appends every feature report sent to and
+    received from the devices of `backend` to transcript file `path`.
+
+    Records are written unbuffered, one write() each, so a transcript
+    survives the process dying and several sessions can be appended to
+    one file.
+    """
+
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.path = path
+        self._lock = threading.Lock()
+        self._devices = 0
+        self._start = time.monotonic()
+        self._file = open(path, "ab", buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._log(REC_SESSION, 0, _WALL_TIME.pack(time.time()))
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _log(self, kind, device, data, t=None):
+        if t is None:
+            t = time.monotonic()
+        record = RECORD_HEADER.pack(kind, device, t - self._start, len(data))
+        with self._lock:
+            self._file.write(record + data)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        devices = self.backend.enumerate(vendor_id, product_id)
+        self._log(REC_ENUMERATE, 0, repr(list(devices)).encode("utf-8"))
+        return devices
+
+    def device(self):
+        with self._lock:
+            self._devices += 1
+            number = self._devices
+        return _RecordingDevice(self, self.backend.device(), number)
+
+
+class _ReplayDevice(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._path = None
+        self._exchange = None
+        self._ready_at = 0.
+
+    def open_path(self, path):
+        path = _path_bytes(path)
+        if path not in self.backend._exchanges:
+            raise OSError(f"No device at {path!r} in transcript")
+        self._path = path
+
+    def set_nonblocking(self, v):
+        return 0
+
+    def send_feature_report(self, report):
+        if self._path is None:
+            raise ValueError("not open")
+        report = bytes(report)
+        exchange = self.backend._next_exchange(self._path)
+        if exchange is None:
+            raise TranscriptMismatch(
+                f"Transcript has no more commands for {self._path!r}")
+        if report != exchange.sent:
+            raise TranscriptMismatch(
+                f"Sent {report.hex()}, transcript has {exchange.sent.hex()}")
+        self._exchange = exchange
+        self._ready_at = time.monotonic() + self.backend._scale(
+            exchange.ready_after or 0.)
+        return len(report)
+
+    def get_feature_report(self, report_id, max_length):
+        exchange = self._exchange
+        if exchange is None:
+            raise TranscriptMismatch("Polled before sending a command")
+        if exchange.response is None or time.monotonic() < self._ready_at:
+            if exchange.busy:
+                report = exchange.busy[-1]
+            else:
+                report = bytes([
+                    report_id, exchange.cmd_id,
+                    VerySeriousButton.VSB_RESP_BUSY,
+                    ])
+        else:
+            report = exchange.response
+        return list(report[:max_length])
+
+    def close(self):
+        self._path = None
+        self._exchange = None
+
+
+class ReplayBackend(object):
+    """HID backend that plays back a transcript made by RecordingBackend.
+
+    Each device replies to the commands in the order they were recorded
+    (sending anything else raises TranscriptMismatch), answering BUSY
+    until as long after the command as it took originally, divided by
+    `speed`; speed 0 means replies are ready immediately.
+    """
+
+    def __init__(self, path, speed=1.):
+        self.speed = speed
+        self._lock = threading.Lock()
+        records = list(read_transcript(path))
+        self._enumerations = [
+            ast.literal_eval(rec.data.decode("utf-8"))
+            for rec in records if rec.kind == REC_ENUMERATE
+            ]
+        self._enumerated = 0
+        self._exchanges = {}
+        for exchange in iter_exchanges(records):
+            self._exchanges.setdefault(exchange.path, []).append(exchange)
+        self._exchanges.pop(None, None)
+        self._cursors = {path: 0 for path in self._exchanges}
+
+    def _scale(self, t):
+        if not self.speed or self.speed <= 0:
+            return 0.
+        return t / self.speed
+
+    def _next_exchange(self, path):
+        with self._lock:
+            i = self._cursors[path]
+            exchanges = self._exchanges[path]
+            if i >= len(exchanges):
+                return None
+            self._cursors[path] = i + 1
+            return exchanges[i]
+
+    def remaining(self):
+        # Recorded commands not replayed yet, by device path
+        with self._lock:
+            return {
+                path: len(self._exchanges[path]) - i
+                for path, i in self._cursors.items()
+                }
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        # Successive calls return successive recorded enumerations
+        with self._lock:
+            if not self._enumerations:
+                return []
+            i = min(self._enumerated, len(self._enumerations) - 1)
+            self._enumerated += 1
+            return [dict(dev) for dev in self._enumerations[i]]
+
+    def device(self):
+        return _ReplayDevice(self)
@@ -17,28 +17,71 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 
+import os
 import sys
 import itertools
-from pathlib import Path
-import struct
+import contextlib
 import time
-import platform
-if (platform.system() == "Linux"):
-    import hidraw as hid
-else:
-    import hid
+
+from ._codec import (
+    DeviceConfig,
+    DeviceInfo,
+    ReportCodec,
+    EEPROM_ADDR,
+    EEPROM_BYTE,
+    )
 
 
 __all__ = [
     'KEYCODES',
     'MODKEYS',
+    'parse_keygroup',
+    'format_keygroup',
     'VerySeriousButtonIoError',
     'VerySeriousButtonNotFound',
     'VerySeriousButtonAccessDenied',
+    'VerySeriousButtonTimeout',
+    'VerySeriousButtonCommandError',
+    'VerySeriousButtonProtocolError',
+    'QueryEvent',
+    'DeviceConfig',
+    'DeviceInfo',
     'VerySeriousButton'
     ]
 
 
+# Device methods mirrored by the async and daemon front ends
+_PUBLIC_METHODS = [
+    'get_device_info',
+    'get_config',
+    'get_cached_config',
+    'invalidate_config_cache',
+    'set_config',
+    'update_config',
+    'set_mode',
+    'read_raw_keyseq_page',
+    'read_raw_keyseq',
+    'write_raw_keyseq_page',
+    'write_keyseq',
+    'write_raw_keyseq',
+    'invalidate_keyseq_cache',
+    'do_query',
+    'get_fuckyou',
+    'reset',
+    'reset_to_bootloader',
+    'init_stored_config',
+    'store_current_config',
+    'load_stored_config',
+    'read_eeprom_byte',
+    'read_eeprom_bytes',
+    'dump_eeprom',
+    'restore_eeprom',
+    'write_eeprom_byte',
+    'write_eeprom_bytes',
+    'get_serialnum',
+    ]
+
+
 KEYCODES = {
     "A":       0x04,
     "B":       0x05,
@@ -189,6 +232,59 @@ MODKEYS = {
     }
 
 
+def parse_keygroup(group_str):
+    # "ctrl+shift+a" -> (modifier bits, [keycodes])
+    pcs = [x.strip().upper() for x in group_str.split("+")]
+    mod = 0
+    keys = []
+    mods_phase = True
+    for n, pc in enumerate(pcs):
+        if (pc not in MODKEYS) or (n == len(pcs)-1):
+            mods_phase = False
+        if mods_phase:
+            mod |= MODKEYS[pc]
+        else:
+            keys.append(KEYCODES[pc])
+    return mod, keys
+
+
+_KEYCODE_NAMES = {code: name for name, code in KEYCODES.items()}
+# Left/right-specific names only
+_MODKEY_NAMES = [
+    (bit, name) for name, bit in MODKEYS.items() if name[0] in "LR"]
+
+
+def format_keygroup(mod, keys):
+    # (modifier bits, [keycodes]) -> "LCTRL+LSHIFT+A"; unused (zero)
+    # keycodes are left out, unknown ones are given in hex
+    names = [name for bit, name in _MODKEY_NAMES if mod & bit]
+    names += [
+        _KEYCODE_NAMES.get(code, "0x%02X" % (code,))
+        for code in keys if code
+        ]
+    return "+".join(names)
+
+
+_hid = None
+
+
+def _load_hid():
+    # Imported on first device access so that merely importing vsbutil
+    # (e.g. for "vsbutil --help") doesn't load the native HID library
+    global _hid
+    if _hid is None:
+        if sys.platform.startswith("linux"):
+            if os.environ.get("VSBUTIL_HID_BACKEND") == "ioctl":
+                # Talk to /dev/hidrawN directly, without hidapi
+                from . import _hidraw as hid
+            else:
+                import hidraw as hid
+        else:
+            import hid
+        _hid = hid
+    return _hid
+
+
 class VerySeriousButtonIoError(IOError):
     pass
 
@@ -201,9 +297,68 @@ class VerySeriousButtonAccessDenied(VerySeriousButtonIoError):
     pass
 
 
+class VerySeriousButtonTimeout(VerySeriousButtonIoError):
+    pass
+
+
+class VerySeriousButtonCommandError(VerySeriousButtonIoError):
+    # The device answered a command with an error response code
+    def __init__(self, message, cmd_id=None, response=None):
+        super().__init__(message)
+        self.cmd_id = cmd_id
+        self.response = response
+
+
+class VerySeriousButtonProtocolError(VerySeriousButtonIoError):
+    # A response that doesn't belong to the command just sent
+    pass
+
+
+class QueryEvent(object):
+    """One do_query() round-trip, as passed to instrumentation listeners.
+
+    `response` is the device's response code (None if it never gave
+    one) and `error` the exception raised, if any. `busy_polls` counts
+    the BUSY replies read while waiting for completion.
+    """
+
+    __slots__ = (
+        'serial', 'cmd_id', 'elapsed', 'busy_polls', 'bytes_sent',
+        'bytes_received', 'response', 'error',
+        )
+
+    def __init__(self, serial, cmd_id, elapsed, busy_polls, bytes_sent,
+                 bytes_received, response, error):
+        self.serial = serial
+        self.cmd_id = cmd_id
+        self.elapsed = elapsed
+        self.busy_polls = busy_polls
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.response = response
+        self.error = error
+
+    @property
+    def command(self):
+        return VerySeriousButton.command_name_for_value(self.cmd_id)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
 class VerySeriousButton(object):
     READ_INTERVAL = 0.02
     READ_TRIES = int(1. / READ_INTERVAL)
+    # Response polling: first re-poll after POLL_INTERVAL_MIN, backing off
+    # by POLL_BACKOFF up to READ_INTERVAL, until READ_TIMEOUT has elapsed
+    READ_TIMEOUT = READ_INTERVAL * READ_TRIES
+    POLL_INTERVAL_MIN = 0.0002
+    POLL_BACKOFF = 2.
+    # Weight of the newest sample in the per-command completion time
+    # estimates, and the fraction of the estimate slept before first poll
+    POLL_ESTIMATE_WEIGHT = 0.25
+    POLL_ESTIMATE_LEAD = 0.8
     USB_VID = 0x16D0
     USB_PID = 0x09D2
     MODE_INACTIVE = 0
@@ -242,6 +397,23 @@ class VerySeriousButton(object):
     VSB_RESP_BUSY = 0x80
     VSB_CMDDATA_LEN = 32
     VSB_FEATREP_SIZE = (VSB_CMDDATA_LEN+2)
+    EEPROM_SIZE = 1024
+    # HID backend: any object providing hid-style enumerate() and device()
+    # (e.g. SimulatedBackend); None selects the platform hidapi module
+    backend = None
+    # Callables passed a QueryEvent after every do_query() on any device;
+    # per-device listeners go in the instance's `listeners` list
+    global_listeners = []
+    # Inventory (e.g. vsbutil.Inventory) that devices are seeded from when
+    # opened and recorded to when closed; None disables it
+    inventory = None
+    # Retry policy (e.g. vsbutil.RetryPolicy) applied to failed commands;
+    # None makes every failure final
+    retry_policy = None
+    # Device info by firmware release (e.g. vsbutil.DeviceInfoCache),
+    # sparing the GETDEVINFO exchange when opening a device; None disables
+    # it
+    info_cache = None
 
     @classmethod
     def mode_string_for_value(cls, x):
@@ -253,8 +425,47 @@ class VerySeriousButton(object):
             }[x]
 
     @classmethod
-    def list_connected(cls):
-        btns = hid.enumerate(cls.USB_VID, cls.USB_PID)
+    def mode_value_for_string(cls, s):
+        # Mode name as in manifests ("joystick" or "gamepad", "singlekey",
+        # "keyseq") or number, e.g. "2" or "0x2"
+        if not isinstance(s, str):
+            return int(s)
+        names = {
+            "joystick": cls.VSB_MODE_JOYSTICK,
+            "gamepad": cls.VSB_MODE_JOYSTICK,
+            "singlekey": cls.VSB_MODE_SINGLEKEY,
+            "keyseq": cls.VSB_MODE_KEYSEQ,
+            }
+        name = s.strip().lower()
+        if name in names:
+            return names[name]
+        return int(name, 0)
+
+    @classmethod
+    def command_name_for_value(cls, x):
+        for name in dir(cls):
+            if name.startswith("VSB_CMD_") and getattr(cls, name) == x:
+                return name[len("VSB_CMD_"):]
+        return f"0x{x:02X}"
+
+    @classmethod
+    def response_name_for_value(cls, x):
+        for name in dir(cls):
+            if name.startswith("VSB_RESP_") and getattr(cls, name) == x:
+                return name[len("VSB_RESP_"):]
+        return f"0x{x:02X}"
+
+    @classmethod
+    def get_backend(cls, backend=None):
+        if backend is not None:
+            return backend
+        if cls.backend is not None:
+            return cls.backend
+        return _load_hid()
+
+    @classmethod
+    def list_connected(cls, backend=None):
+        btns = cls.get_backend(backend).enumerate(cls.USB_VID, cls.USB_PID)
         return [
             (btn["serial_number"], btn["release_number"], btn["path"])
             for btn in btns
@@ -263,8 +474,12 @@ class VerySeriousButton(object):
             if btn['usage_page'] >= cls.HID_USAGE_PAGE_VSB
             ]
 
-    def __init__(self, serial=None):
-        btns = {ser: (path, rls) for (ser, rls, path) in self.list_connected()}
+    def __init__(self, serial=None, backend=None, connected=None,
+                 scheduler=None):
+        self.backend = self.get_backend(backend)
+        if connected is None:
+            connected = self.list_connected(self.backend)
+        btns = {ser: (path, rls) for (ser, rls, path) in connected}
         if not btns:
             raise VerySeriousButtonNotFound("No VerySeriousButtons connected")
         if not serial:
@@ -278,7 +493,32 @@ class VerySeriousButton(object):
             path, rls = btns[serial]
         self.release_number = rls
         self.serial_number = serial
-        self.hid_dev = hid.device()
+        self.path = path
+        self.hid_dev = self.backend.device()
+        if scheduler is not None:
+            # Before opening, so that GETDEVINFO goes through it too
+            scheduler.attach(self)
+        self._codec = ReportCodec(self.REPORTID_VSB, self.VSB_FEATREP_SIZE)
+        # Learned command completion times (seconds), keyed by command ID
+        self.response_time_estimates = {}
+        self._sent_at = None
+        # Transfer stats of the last command, for instrumentation
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        self._busy_polls = 0
+        self.listeners = []
+        # Shadow copy of the device config and open transaction, if any
+        self._config = None
+        self._config_txn = None
+        # Known keyseq page contents, keyed by page number
+        self._pages = {}
+        # When the shadow config was last read from or written to the
+        # device (time.time()), or for one seeded from the inventory, when
+        # it was last confirmed there
+        self._config_checked = None
+        # Device info came from the info cache and no command has succeeded
+        # since
+        self._info_unverified = False
         try:
             self.hid_dev.open_path(path)
         except OSError as e:
@@ -286,54 +526,127 @@ class VerySeriousButton(object):
                 f"Could not access VSB #{serial} at HID driver path {path!r}"
                 ) from e
         self.hid_dev.set_nonblocking(False)
-        info = self.get_device_info()
+        info = None
+        if self.inventory is not None:
+            info = self.inventory.restore(self)
+        if info is None and self.info_cache is not None:
+            info = self.info_cache.get(rls)
+            self._info_unverified = info is not None
+        if info is None:
+            info = self.get_device_info()
+            if self.info_cache is not None:
+                self.info_cache.put(rls, info)
+        self._set_device_info(info)
+
+    def _set_device_info(self, info):
         self.keyseq_page_size = info["keyseq_pagesize"]
         self.keyseq_nkeys = info["keyseq_nkeys"]
         self.num_keyseq_pages = info["keyseq_npages"]
         self.singlekey_nkeys = info["singlekey_nkeys"]
 
     def write_command(self, cmd_id, data=b""):
-        buf = struct.pack(
-            "BBB", self.REPORTID_VSB, cmd_id, 0) + bytearray(data)
-        self.hid_dev.send_feature_report(list(bytearray(buf)))
-
-    def read_response(self):
-        data = None
-        for foo in range(self.READ_TRIES):
-            data = self.hid_dev.get_feature_report(
-                self.REPORTID_VSB, self.VSB_FEATREP_SIZE + 1)
-            if data[0] != self.REPORTID_VSB:
-                raise IOError(
+        self._send_report(self._codec.encode(cmd_id, data))
+
+    def _send_report(self, report):
+        self.hid_dev.send_feature_report(report)
+        self._sent_at = time.monotonic()
+        self._bytes_sent = len(report)
+
+    def read_response(self, cmd_id=None, timeout=None):
+        data = self._poll_response(cmd_id, timeout)
+        return data[1], data[2], bytearray(data[3:])
+
+    def _poll_response(self, cmd_id, timeout):
+        # Returns a view of the whole response report, valid until the
+        # next command
+        sent_at = self._sent_at
+        if sent_at is None:
+            sent_at = time.monotonic()
+        if timeout is None:
+            timeout = self.READ_TIMEOUT
+        deadline = sent_at + timeout
+        estimate = self.response_time_estimates.get(cmd_id)
+        slept = False
+        if estimate and estimate * self.POLL_ESTIMATE_LEAD > (
+                self.POLL_INTERVAL_MIN):
+            # Sleep through most of the expected busy period up front
+            wait = sent_at + estimate * self.POLL_ESTIMATE_LEAD
+            wait -= time.monotonic()
+            if wait > self.POLL_INTERVAL_MIN:
+                self._sleep(min(wait, timeout))
+                slept = True
+        get_report = self.hid_dev.get_feature_report
+        decode = self._codec.decode
+        report_id = self.REPORTID_VSB
+        delay = self.POLL_INTERVAL_MIN
+        self._busy_polls = 0
+        self._bytes_received = 0
+        while True:
+            polled_at = time.monotonic()
+            data = decode(get_report(report_id, self.VSB_FEATREP_SIZE + 1))
+            self._bytes_received += len(data)
+            if data[0] != report_id:
+                raise VerySeriousButtonProtocolError(
                     "Received incorrect report ID (expecting %d, got %d)"
-                    % (self.REPORTID_VSB,data[0])
+                    % (report_id,data[0])
                     )
             if (len(data) > 2) and (data[2] != self.VSB_RESP_BUSY):
                 break
-            data = None
-            time.sleep(self.READ_INTERVAL)
-        if data is None:
-            raise IOError("Device didn't respond!")
-        return data[1], data[2], bytearray(data[3:])
+            self._busy_polls += 1
+            slept = False
+            now = time.monotonic()
+            if now >= deadline:
+                raise VerySeriousButtonTimeout("Device didn't respond!")
+            self._sleep(min(delay, deadline - now))
+            delay = min(delay * self.POLL_BACKOFF, self.READ_INTERVAL)
+        if cmd_id is not None:
+            # The command completed no later than the start of this poll.
+            # If it was already done when we woke from the up-front sleep,
+            # the sleep is all we measured; learn from the shorter lead
+            # time instead, so that overestimates decay
+            elapsed = polled_at - sent_at
+            if slept:
+                elapsed = min(elapsed, estimate * self.POLL_ESTIMATE_LEAD)
+            self._update_response_time_estimate(cmd_id, elapsed)
+        return data
+
+    def _sleep(self, delay):
+        time.sleep(delay)
+
+    def _update_response_time_estimate(self, cmd_id, elapsed):
+        estimate = self.response_time_estimates.get(cmd_id)
+        if estimate is None:
+            estimate = elapsed
+        else:
+            w = self.POLL_ESTIMATE_WEIGHT
+            estimate = (1. - w) * estimate + w * elapsed
+        self.response_time_estimates[cmd_id] = estimate
 
     def get_device_info(self):
-        bytes_ = self.do_query(self.VSB_CMD_GETDEVINFO)
-        return dict(
-            singlekey_nkeys=bytes_[0],
-            keyseq_nkeys=bytes_[1],
-            keyseq_pagesize=bytes_[2],
-            keyseq_npages=bytes_[3],
-            )
+        return DeviceInfo.decode(self._do_query(self.VSB_CMD_GETDEVINFO))
 
     def get_config(self):
-        bytes = self.do_query(self.VSB_CMD_GETCFG)
-        return {
-            "mode": bytes[0],
-            "mods": bytes[1],
-            "keycodes": list(bytes[2:2+self.singlekey_nkeys]),
-            "keyseq_len": bytes[8]
-            }
+        config = DeviceConfig.decode(
+            self._do_query(self.VSB_CMD_GETCFG), self.singlekey_nkeys)
+        self._config = config.copy()
+        self._config_checked = time.time()
+        return config
 
-    def set_config(self, cfg):
+    def get_cached_config(self):
+        # Last config read from or written to the device; only reads it
+        # from the device if there is no shadow copy yet
+        if self._config_txn is not None:
+            config = self._config_txn
+        elif self._config is None:
+            return self.get_config()
+        else:
+            config = self._config
+        return config.copy()
+
+    def invalidate_config_cache(self):
+        self._config = None
+
+    def _normalize_config(self, cfg):
         valid_modes = (
             self.MODE_GAMEPAD,
             self.MODE_SINGLEKEY,
@@ -352,140 +665,319 @@ class VerySeriousButton(object):
         if (keyseq_len < 0) or (keyseq_len > self.num_keyseq_pages):
             raise ValueError(
                 "Invalid keyseq length: " + repr(cfg["keyseq_len"]))
-        cfg_bytes = [mode, mods] + keycodes + [keyseq_len]
-        self.do_query(self.VSB_CMD_SETCFG, data=bytearray(cfg_bytes))
+        return DeviceConfig(mode, mods, keycodes, keyseq_len)
+
+    def set_config(self, cfg):
+        config = self._normalize_config(cfg)
+        if self._config_txn is not None:
+            # Deferred until the enclosing transaction commits
+            self._config_txn.update(config)
+            return
+        self._config = None
+        self._do_query(
+            self.VSB_CMD_SETCFG,
+            report=self._codec.encode_config(self.VSB_CMD_SETCFG, config),
+            )
+        self._config = config
+        self._config_checked = time.time()
+
+    @contextlib.contextmanager
+    def config_transaction(self):
+        """Batch config changes into a single SETCFG.
+
+        Yields a config dict to modify in place; update_config and
+        set_config calls inside the block are applied to it too. On exit
+        the result is written with one SETCFG, or not at all if it matches
+        the shadow copy of the device config. Nested transactions join the
+        outermost one; an exception discards the changes.
+        """
+        if self._config_txn is not None:
+            yield self._config_txn
+            return
+        txn = self.get_cached_config()
+        self._config_txn = txn
+        try:
+            yield txn
+        finally:
+            self._config_txn = None
+        config = self._normalize_config(txn)
+        if config != self._config:
+            self.set_config(config)
 
     def read_raw_keyseq_page(self, i):
-        data = self.do_query(self.VSB_CMD_READPAGE, data=[int(i),])
+        data = self._do_query(self.VSB_CMD_READPAGE, (int(i),))
         if data[0] != i:
             raise IOError(
                 "Requested keyseq page %d, got page %d" % (i,data[0]))
-        return data[1:1+self.keyseq_page_size]
+        page = bytearray(data[1:1+self.keyseq_page_size])
+        self._pages[i] = bytearray(page)
+        return page
 
     def read_raw_keyseq(self):
         ks_len = self.get_config()["keyseq_len"]
-        bytes = []
+        data = bytearray()
         for i in range(ks_len):
-            bytes += self.read_raw_keyseq_page(i)
-        return bytearray(bytes)
+            data += self.read_raw_keyseq_page(i)
+        return data
+
+    def invalidate_keyseq_cache(self):
+        self._pages = {}
 
     def write_raw_keyseq_page(self, i, data):
-        bytes = list(bytearray(data))
+        page = bytearray(data)
         wr_pg = int(i)
         if (wr_pg < 0) or (wr_pg >= self.num_keyseq_pages):
             raise ValueError("Keyseq page number out of range: " + repr(i))
-        if len(bytes) > self.keyseq_page_size:
+        if len(page) > self.keyseq_page_size:
             raise ValueError("Keyseq page data is too long")
-        if len(bytes) < self.keyseq_page_size:
-            bytes += [0]*(self.keyseq_page_size - len(bytes))
-        self.do_query(self.VSB_CMD_WRITEPAGE, [wr_pg] + bytes)
+        if len(page) < self.keyseq_page_size:
+            page += bytes(self.keyseq_page_size - len(page))
+        self._pages.pop(wr_pg, None)
+        self._do_query(
+            self.VSB_CMD_WRITEPAGE,
+            report=self._codec.encode_page(
+                self.VSB_CMD_WRITEPAGE, wr_pg, page),
+            )
+        self._pages[wr_pg] = page
 
-    def write_keyseq(self, keyseq):
+    def write_keyseq(self, keyseq, diff=False):
         if len(keyseq) > self.num_keyseq_pages:
             raise ValueError(
                 f"Key sequence too long (length {len(keyseq)}, "
                 f"maximum {self.num_keyseq_pages})"
                 )
-        i = 0
-        for mod, keycodes in keyseq:
+        pages = []
+        for i, (mod, keycodes) in enumerate(keyseq):
             if len(keycodes) > self.keyseq_nkeys:
                 raise ValueError(
                     f"Too many keys in key group {i} "
                     f"(got {len(keycodes)}, max {self.keyseq_nkeys})"
                     )
-            self.write_raw_keyseq_page(i, [mod] + list(keycodes))
-            i += 1
-        self.update_config(keyseq_len=i)
+            pages.append([mod] + list(keycodes))
+        return self._write_keyseq_pages(pages, diff)
 
-    def write_raw_keyseq(self, data):
+    def write_raw_keyseq(self, data, diff=False):
         bytes_ = list(bytearray(data))
-        i = 0
+        pages = []
         while True:
-            start = i * self.keyseq_page_size
+            start = len(pages) * self.keyseq_page_size
             end = start + self.keyseq_page_size
             if not bytes_[start:end]:
                 break
-            self.write_raw_keyseq_page(i, bytes_[start:end])
-            i += 1
-        self.update_config(keyseq_len=i)
+            pages.append(bytes_[start:end])
+        return self._write_keyseq_pages(pages, diff)
+
+    def _write_keyseq_pages(self, pages, diff):
+        # With diff, pages whose current contents (from the page cache, or
+        # read back from the device) already match are not rewritten
+        summary = dict(written=[], skipped=[])
+        for i, page in enumerate(pages):
+            page = bytes(bytearray(page))
+            page += bytes(self.keyseq_page_size - len(page))
+            if diff and i < self.num_keyseq_pages:
+                current = self._pages.get(i)
+                if current is None:
+                    current = self.read_raw_keyseq_page(i)
+                if bytes(current) == page:
+                    summary["skipped"].append(i)
+                    continue
+            self.write_raw_keyseq_page(i, page)
+            summary["written"].append(i)
+        self.update_config(keyseq_len=len(pages))
+        return summary
 
     def update_config(self, **kwargs):
-        config = self.get_config()
-        for key, value in kwargs.items():
-            if key not in config:
-                raise KeyError(f"{key!r} is not a valid config parameter name")
-            config[key] = value
-        self.set_config(config)
-
-    def do_query(self, cmd_id, data=b""):
-        self.write_command(cmd_id, data)
-        rcmd, rresp, rdata = self.read_response()
+        with self.config_transaction() as config:
+            for key, value in kwargs.items():
+                if key not in config:
+                    raise KeyError(
+                        f"{key!r} is not a valid config parameter name")
+                config[key] = value
+
+    def do_query(self, cmd_id, data=b"", timeout=None):
+        return bytearray(self._do_query(cmd_id, data, timeout))
+
+    def _do_query(self, cmd_id, data=b"", timeout=None, report=None):
+        # Like do_query(), but returns a view of the response data (valid
+        # until the next command) and can send a report the caller has
+        # already encoded with self._codec
+        if self._info_unverified:
+            return self._verifying_query(cmd_id, data, timeout, report)
+        if self.retry_policy is not None:
+            return self.retry_policy.query(self, cmd_id, data, timeout, report)
+        return self._observed_query(cmd_id, data, timeout, report)
+
+    def _verifying_query(self, cmd_id, data, timeout, report):
+        # First command on a device opened with cached device info. If the
+        # device rejects it, the info may be wrong (and the command built
+        # on it), so ask the device and fix the cache before failing
+        self._info_unverified = False
+        try:
+            return self._do_query(cmd_id, data, timeout, report)
+        except (VerySeriousButtonCommandError,
+                VerySeriousButtonProtocolError):
+            self.info_cache.forget(self.release_number)
+            info = self.get_device_info()
+            self._set_device_info(info)
+            self.info_cache.put(self.release_number, info)
+            raise
+
+    def _observed_query(self, cmd_id, data, timeout, report):
+        # One attempt at a command, reported to the listeners
+        if not (self.listeners or self.global_listeners):
+            return self._query(cmd_id, data, timeout, report)
+        t0 = time.perf_counter()
+        self._bytes_sent = self._bytes_received = self._busy_polls = 0
+        error = None
+        try:
+            return self._query(cmd_id, data, timeout, report)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if error is None:
+                response = self.VSB_RESP_OK
+            else:
+                response = getattr(error, "response", None)
+            event = QueryEvent(
+                self.serial_number,
+                cmd_id,
+                time.perf_counter() - t0,
+                self._busy_polls,
+                self._bytes_sent,
+                self._bytes_received,
+                response,
+                error,
+                )
+            for listener in self.listeners + self.global_listeners:
+                if error is None:
+                    listener(event)
+                    continue
+                try:
+                    listener(event)
+                except Exception:
+                    # Must not replace the command's own error
+                    pass
+
+    def _query(self, cmd_id, data, timeout, report):
+        if report is None:
+            report = self._codec.encode(cmd_id, data)
+        self.hid_dev.send_feature_report(report)
+        self._sent_at = time.monotonic()
+        self._bytes_sent = len(report)
+        response = self._poll_response(cmd_id, timeout)
+        rcmd, rresp, rdata = response[1], response[2], self._codec.payload
         if rcmd != cmd_id:
-            raise IOError(
+            raise VerySeriousButtonProtocolError(
                 f"Command ID returned by the device (0x{rcmd:02X}) "
                 f"doesn't match the command ID sent (0x{cmd_id:02X})"
                 )
+        if rresp == self.VSB_RESP_OK:
+            return rdata
         if rresp == self.VSB_RESP_NULL:
-            raise IOError("Got a null response code")
+            msg = "Got a null response code"
         elif rresp == self.VSB_RESP_BADCMD:
-            raise IOError(f"Device reported 0x{rcmd:02X} is a bad command ID")
+            msg = f"Device reported 0x{rcmd:02X} is a bad command ID"
         elif rresp == self.VSB_RESP_BADCS:
-            raise IOError("Device reported stored configuration is corrupt")
+            msg = "Device reported stored configuration is corrupt"
         elif rresp == self.VSB_RESP_BADIDX:
-            raise IOError(
-                f"Device reported {rdata[0]} is a bad keyseq page number")
+            msg = f"Device reported {rdata[0]} is a bad keyseq page number"
         elif rresp == self.VSB_RESP_ERR:
-            raise IOError("Device reported a general error")
-        elif rresp != self.VSB_RESP_OK:
-            raise IOError(
-                f"Device returned unrecognized response code 0x{rresp:02X}")
-        return rdata
+            msg = "Device reported a general error"
+        else:
+            msg = f"Device returned unrecognized response code 0x{rresp:02X}"
+        raise VerySeriousButtonCommandError(msg, cmd_id, rresp)
+
+    def _resync(self, timeout=None):
+        # After a response that didn't match the command sent, run a
+        # harmless command to completion so that whatever stale response
+        # the device had pending is out of the way
+        self._query(self.VSB_CMD_GETDEVINFO, b"", timeout, None)
+
+    def _reopen(self):
+        # Open the device again, at its current path, e.g. after it was
+        # reset or replugged. Its RAM config may have been lost; keyseq
+        # pages live in EEPROM and survive
+        if self.hid_dev is None:
+            raise ValueError("Device is closed")
+        paths = {
+            ser: path for (ser, rls, path) in self.list_connected(self.backend)
+            }
+        if self.serial_number not in paths:
+            raise VerySeriousButtonNotFound(
+                f"VerySeriousButton {self.serial_number!r} has gone away")
+        self.hid_dev.close()
+        self.path = paths[self.serial_number]
+        try:
+            self.hid_dev.open_path(self.path)
+        except OSError as e:
+            raise VerySeriousButtonAccessDenied(
+                f"Could not access VSB #{self.serial_number} at HID driver "
+                f"path {self.path!r}"
+                ) from e
+        self.hid_dev.set_nonblocking(False)
+        self._sent_at = None
+        self.invalidate_config_cache()
 
     def get_fuckyou(self):
-        data = self.do_query(self.VSB_CMD_FUCKYOU)
+        data = bytes(self._do_query(self.VSB_CMD_FUCKYOU))
         return data.split(b"\x00",1)[0].decode("ascii")
 
     def reset(self):
-        self.do_query(self.VSB_CMD_RESET)
+        self._do_query(self.VSB_CMD_RESET)
+        # The device comes back with its stored config
+        self.invalidate_config_cache()
         self.close()
 
     def reset_to_bootloader(self):
-        self.do_query(self.VSB_CMD_DFU)
+        self._do_query(self.VSB_CMD_DFU)
+        self.invalidate_config_cache()
         self.close()
 
     def set_mode(self, mode):
         self.update_config(mode=mode)
 
     def init_stored_config(self):
-        self.do_query(self.VSB_CMD_WIPECFG)
+        self.invalidate_config_cache()
+        self._do_query(self.VSB_CMD_WIPECFG)
 
     def store_current_config(self):
-        self.do_query(self.VSB_CMD_SAVECFG)
+        self._do_query(self.VSB_CMD_SAVECFG)
 
     def load_stored_config(self):
-        self.do_query(self.VSB_CMD_LOADCFG)
+        self.invalidate_config_cache()
+        self._do_query(self.VSB_CMD_LOADCFG)
 
     def read_eeprom_byte(self, addr):
-        data = self.do_query(
-            self.VSB_CMD_EEPREAD, data=struct.pack(">H", addr))
-        raddr = struct.unpack(">H", bytes(data[0:2]))[0]
+        data = self._do_query(
+            self.VSB_CMD_EEPREAD,
+            report=self._codec.encode_struct(
+                self.VSB_CMD_EEPREAD, EEPROM_ADDR, addr),
+            )
+        raddr, value = EEPROM_BYTE.unpack_from(data)
         if raddr != addr:
             raise IOError(
                 f"Device replied with EEPROM read address 0x{raddr:02X} "
                 f"(expected 0x{addr:02X})"
                 )
-        return data[2]
+        return value
 
-    def read_eeprom_bytes(self, addr, n):
-        bytes = []
+    def iter_eeprom_bytes(self, addr, n):
         for i in range(n):
-            bytes.append(self.read_eeprom_byte(addr+i))
-        return bytearray(bytes)
+            yield self.read_eeprom_byte(addr+i)
+
+    def read_eeprom_bytes(self, addr, n):
+        return bytearray(self.iter_eeprom_bytes(addr, n))
 
     def write_eeprom_byte(self, addr, v):
-        data = self.do_query(
-            self.VSB_CMD_EEPWRITE, data=struct.pack(">HB", addr, v))
-        raddr = struct.unpack(">H", bytes(data[0:2]))[0]
+        # Keyseq pages live in EEPROM too
+        self.invalidate_keyseq_cache()
+        data = self._do_query(
+            self.VSB_CMD_EEPWRITE,
+            report=self._codec.encode_struct(
+                self.VSB_CMD_EEPWRITE, EEPROM_BYTE, addr, v),
+            )
+        raddr, = EEPROM_ADDR.unpack_from(data)
         if raddr != addr:
             raise IOError(
                 f"Device replied with EEPROM read address 0x{raddr:02X} "
@@ -496,12 +988,74 @@ class VerySeriousButton(object):
         for i, v in enumerate(vs):
             self.write_eeprom_byte(addr+i, v)
 
+    def dump_eeprom(self, f, addr=0, n=None, progress=None, chunk_size=64):
+        """Stream EEPROM contents to binary file object `f`.
+
+        Reads `n` bytes (default: up to EEPROM_SIZE) starting at `addr`,
+        writing them out every `chunk_size` bytes and calling
+        `progress(done, total)` after each chunk. Returns the byte count.
+        """
+        if n is None:
+            n = self.EEPROM_SIZE - addr
+        chunk = bytearray()
+        done = 0
+        for v in self.iter_eeprom_bytes(addr, n):
+            chunk.append(v)
+            if len(chunk) >= chunk_size:
+                f.write(chunk)
+                done += len(chunk)
+                chunk = bytearray()
+                if progress is not None:
+                    progress(done, n)
+        if chunk:
+            f.write(chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, n)
+        return done
+
+    def restore_eeprom(self, data, addr=0, current=None, diff=True,
+                       progress=None):
+        """Write image `data` to EEPROM starting at `addr`.
+
+        With diff, each byte is compared with the current contents (taken
+        from `current` if given, else read back from the device) and only
+        differing bytes are written. `progress(done, total)` is called
+        after each byte. Returns a dict of written and skipped addresses.
+        """
+        data = bytearray(data)
+        if addr + len(data) > self.EEPROM_SIZE:
+            raise ValueError(
+                f"Image of {len(data)} bytes at 0x{addr:03X} doesn't fit "
+                f"in {self.EEPROM_SIZE} bytes of EEPROM"
+                )
+        if current is not None and len(current) < len(data):
+            raise ValueError("Current EEPROM image is shorter than data")
+        summary = dict(written=[], skipped=[])
+        for i, v in enumerate(data):
+            if diff and current is not None:
+                cur = current[i]
+            elif diff:
+                cur = self.read_eeprom_byte(addr+i)
+            if diff and cur == v:
+                summary["skipped"].append(addr+i)
+            else:
+                self.write_eeprom_byte(addr+i, v)
+                summary["written"].append(addr+i)
+            if progress is not None:
+                progress(i+1, len(data))
+        return summary
+
     def get_serialnum(self):
-        data = self.do_query(self.VSB_CMD_GETSERIAL)
+        data = self._do_query(self.VSB_CMD_GETSERIAL)
         l = data[0]
-        return data[1:1+l].decode()
+        return bytes(data[1:1+l]).decode()
 
     def close(self):
         if self.hid_dev is not None:
-            self.hid_dev.close()
+            try:
+                if self.inventory is not None:
+                    self.inventory.record(self)
+            finally:
+                self.hid_dev.close()
         self.hid_dev = None
@@ -0,0 +1,599 @@
+import sys
+import time
+
+from ._vsbutil import VerySeriousButton
+from . import __version__
+
+
+# Simulated timing roughly matching a real unit on a full-speed USB port
+SIM_TRANSFER_TIME = 0.001
+SIM_LATENCY = {
+    VerySeriousButton.VSB_CMD_SETCFG: 0.001,
+    VerySeriousButton.VSB_CMD_SAVECFG: 0.030,
+    VerySeriousButton.VSB_CMD_WIPECFG: 0.030,
+    VerySeriousButton.VSB_CMD_WRITEPAGE: 0.008,
+    VerySeriousButton.VSB_CMD_EEPWRITE: 0.0035,
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100.
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class QueryRecorder(object):
+    """Records do_query round-trips and their latencies on one device."""
+
+    def __init__(self, vsb):
+        self.vsb = vsb
+        self.queries = []
+        self.reports_sent = 0
+        self.reports_received = 0
+
+    def __enter__(self):
+        self.vsb.listeners.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.vsb.listeners.remove(self)
+
+    def __call__(self, event):
+        self.queries.append((event.cmd_id, event.elapsed))
+        self.reports_sent += 1
+        self.reports_received += event.busy_polls + (
+            event.response is not None)
+
+
+def _setup_joystick(vsb, opts):
+    vsb.update_config(mode=vsb.VSB_MODE_JOYSTICK, keycodes=[], mods=0)
+
+
+def _setup_keyseq(vsb, opts):
+    vsb.write_keyseq(_max_keyseq(vsb))
+
+
+def _max_keyseq(vsb):
+    return [
+        (i & 0x0F, [0x04 + (i % 26)])
+        for i in range(vsb.num_keyseq_pages)
+        ]
+
+
+def _op_setkey(vsb, opts):
+    vsb.update_config(
+        mode=vsb.VSB_MODE_SINGLEKEY, keycodes=[0x06], mods=0x01)
+
+
+def _op_setkeyseq(vsb, opts):
+    with vsb.config_transaction() as cfg:
+        vsb.write_keyseq(_max_keyseq(vsb))
+        cfg["mode"] = vsb.VSB_MODE_KEYSEQ
+    vsb.store_current_config()
+
+
+def _op_updatekeyseq(vsb, opts):
+    # Change only the last key group, rewriting changed pages only
+    keyseq = _max_keyseq(vsb)
+    keyseq[-1] = (0, [0x2C])
+    vsb.write_keyseq(keyseq, diff=True)
+
+
+def _op_getkeyseq(vsb, opts):
+    vsb.read_raw_keyseq()
+
+
+def _op_eepread(vsb, opts):
+    vsb.read_eeprom_bytes(opts.eeprom_addr, opts.eeprom_bytes)
+
+
+def _op_eepwrite(vsb, opts):
+    vsb.write_eeprom_bytes(
+        opts.eeprom_addr,
+        [i & 0xFF for i in range(opts.eeprom_bytes)]
+        )
+
+
+# name: (setup, operation); setup runs untimed before each repetition
+OPERATIONS = {
+    "setkey": (_setup_joystick, _op_setkey),
+    "setkeyseq": (_setup_joystick, _op_setkeyseq),
+    "updatekeyseq": (_setup_keyseq, _op_updatekeyseq),
+    "getkeyseq": (_setup_keyseq, _op_getkeyseq),
+    "eepread": (None, _op_eepread),
+    "eepwrite": (None, _op_eepwrite),
+    }
+
+
+def make_simulated_backend():
+    from ._simulator import SimulatedBackend
+    return SimulatedBackend(
+        transfer_time=SIM_TRANSFER_TIME, latency=SIM_LATENCY)
+
+
+def run_benchmarks(vsb, opts, names=None):
+    names = names or list(OPERATIONS)
+    results = {}
+    latencies = {}
+    for name in names:
+        setup, op = OPERATIONS[name]
+        wall_times = []
+        for rep in range(opts.repeat):
+            if setup is not None:
+                setup(vsb, opts)
+            # Start cold, like a fresh CLI invocation
+            vsb.invalidate_config_cache()
+            vsb.invalidate_keyseq_cache()
+            with QueryRecorder(vsb) as rec:
+                t0 = time.perf_counter()
+                op(vsb, opts)
+                wall_times.append(time.perf_counter() - t0)
+            for cmd_id, elapsed in rec.queries:
+                cmd_name = vsb.command_name_for_value(cmd_id)
+                latencies.setdefault(cmd_name, []).append(elapsed)
+        # Round-trip counts are from the last repetition
+        by_cmd = {}
+        for cmd_id, elapsed in rec.queries:
+            cmd_name = vsb.command_name_for_value(cmd_id)
+            by_cmd[cmd_name] = by_cmd.get(cmd_name, 0) + 1
+        results[name] = dict(
+            repeat=opts.repeat,
+            round_trips=len(rec.queries),
+            round_trips_by_command=by_cmd,
+            reports_sent=rec.reports_sent,
+            reports_received=rec.reports_received,
+            wall_time=dict(
+                min=min(wall_times),
+                median=percentile(wall_times, 50),
+                max=max(wall_times),
+                ),
+            )
+    commands = {
+        cmd_name: dict(
+            count=len(values),
+            p50=percentile(values, 50),
+            p99=percentile(values, 99),
+            mean=sum(values) / len(values),
+            )
+        for cmd_name, values in sorted(latencies.items())
+        }
+    return dict(operations=results, commands=commands)
+
+
+# Benchmarks that don't drive a (simulated) device through OPERATIONS
+PSEUDO_OPERATIONS = ["startup", "codec", "hidraw"]
+# Host CPU microbenchmarks: too sensitive to machine load to gate every
+# run on, so they only run when asked for
+MICROBENCHMARKS = ["codec", "hidraw"]
+# Allowed relative slowdown of the microbenchmarks against a baseline
+CPU_TOLERANCE = 0.5
+
+
+# CLI invocation timed by the startup benchmark, and modules it must not
+# load because they are only needed once a device or feature is used
+STARTUP_ARGV = ["vsbutil", "--version"]
+STARTUP_FORBIDDEN_MODULES = [
+    "vsbutil.bench",
+    "hid",
+    "hidraw",
+    "asyncio",
+    "concurrent.futures",
+    "socket",
+    "json",
+    "pathlib",
+    ]
+
+
+def _parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package" lines;
+    # top-level imports have a single space of indentation
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2]
+        depth = len(name) - len(name.lstrip(" "))
+        modules[name.strip()] = (depth, int(fields[1]))
+    return modules
+
+
+def measure_startup(repeat, argv=STARTUP_ARGV):
+    """Time `argv` through the vsbutil.cli:run entry point in a fresh
+    interpreter, using -X importtime to see what gets imported."""
+    import os
+    import subprocess
+    code = (
+        f"import sys; sys.argv = {argv!r}; "
+        f"from vsbutil.cli import run; sys.exit(run())"
+        )
+    env = dict(os.environ)
+    pkg_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [pkg_parent] + [p for p in [env.get("PYTHONPATH")] if p])
+    wall_times = []
+    import_times = []
+    for rep in range(repeat):
+        t0 = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            )
+        wall_times.append(time.perf_counter() - t0)
+        if proc.returncode != 0:
+            raise RuntimeError(
+                f"{' '.join(argv)} exited with status {proc.returncode}")
+        modules = _parse_importtime(proc.stderr)
+        import_times.append(sum(
+            cumulative * 1e-6
+            for name, (depth, cumulative) in modules.items()
+            if depth == 1 and name.split(".")[0] == "vsbutil"
+            ))
+    return dict(
+        argv=argv,
+        repeat=repeat,
+        wall_time=dict(
+            min=min(wall_times),
+            median=percentile(wall_times, 50),
+            max=max(wall_times),
+            ),
+        import_time=dict(
+            min=min(import_times),
+            median=percentile(import_times, 50),
+            max=max(import_times),
+            ),
+        modules_loaded=len(modules),
+        forbidden_modules_loaded=sorted(
+            name for name in STARTUP_FORBIDDEN_MODULES if name in modules),
+        )
+
+
+class _LoopbackDevice(object):
+    # hid.device stand-in that answers every command immediately, so the
+    # codec microbenchmarks measure only host-side cost. Like hidapi, it
+    # returns a fresh list of ints per report.
+
+    INFO = [6, 6, 7, 64]
+    CONFIG = [VerySeriousButton.VSB_MODE_JOYSTICK] + [0] * 8
+
+    def __init__(self):
+        self.response = [0] * (VerySeriousButton.VSB_FEATREP_SIZE + 1)
+
+    def open_path(self, path):
+        pass
+
+    def set_nonblocking(self, value):
+        pass
+
+    def close(self):
+        pass
+
+    def send_feature_report(self, report):
+        # hidapi copies the report into a C buffer the same way
+        report = bytes(report)
+        cmd_id = report[1]
+        if cmd_id == VerySeriousButton.VSB_CMD_GETDEVINFO:
+            data = self.INFO
+        elif cmd_id == VerySeriousButton.VSB_CMD_GETCFG:
+            data = self.CONFIG
+        else:
+            data = report[3:]
+        resp = self.response
+        resp[0:3] = [report[0], cmd_id, VerySeriousButton.VSB_RESP_OK]
+        resp[3:3+len(data)] = data
+        del resp[VerySeriousButton.VSB_FEATREP_SIZE + 1:]
+
+    def get_feature_report(self, report_id, max_length):
+        return self.response[:max_length]
+
+
+class _LoopbackBackend(object):
+
+    def enumerate(self, vid, pid):
+        return [dict(
+            serial_number="LOOP0001",
+            release_number=0,
+            path=b"loopback",
+            usage_page=VerySeriousButton.HID_USAGE_PAGE_VSB,
+            )]
+
+    def device(self):
+        return _LoopbackDevice()
+
+
+class _LoopbackHidraw(object):
+    # Fake fd and ioctl for the hidraw backend, answering like
+    # _LoopbackDevice; reports are copied in and out of the caller's
+    # buffer, as the kernel does
+
+    def __init__(self):
+        self.responses = {}
+
+    def open(self, path, flags):
+        fd = len(self.responses) + 3
+        self.responses[fd] = bytearray(VerySeriousButton.VSB_FEATREP_SIZE + 1)
+        return fd
+
+    def close(self, fd):
+        del self.responses[fd]
+
+    def ioctl(self, fd, request, buf, mutate_flag=True):
+        resp = self.responses[fd]
+        size = (request >> 16) & 0x3FFF
+        if request & 0xFF == 0x06:
+            cmd_id = buf[1]
+            if cmd_id == VerySeriousButton.VSB_CMD_GETDEVINFO:
+                data = _LoopbackDevice.INFO
+            elif cmd_id == VerySeriousButton.VSB_CMD_GETCFG:
+                data = _LoopbackDevice.CONFIG
+            else:
+                data = buf[3:size]
+            resp[3:3+len(data)] = bytes(data)
+            resp[0:3] = bytes([buf[0], cmd_id, VerySeriousButton.VSB_RESP_OK])
+            return size
+        n = min(size, len(resp))
+        buf[:n] = resp[:n]
+        return n
+
+
+class _LoopbackHidrawBackend(_LoopbackBackend):
+
+    def __init__(self):
+        self.kernel = _LoopbackHidraw()
+
+    def device(self):
+        from ._hidraw import HidrawDevice
+        k = self.kernel
+        return HidrawDevice(ioctl=k.ioctl, os_open=k.open, os_close=k.close)
+
+
+# Commands timed by the codec microbenchmarks
+CODEC_COMMANDS = {
+    "getconfig": lambda vsb: vsb.get_config(),
+    "setconfig": lambda vsb: vsb.set_config(dict(
+        mode=vsb.VSB_MODE_SINGLEKEY, mods=0x01, keycodes=[0x06],
+        keyseq_len=0)),
+    "readpage": lambda vsb: vsb.read_raw_keyseq_page(0),
+    "writepage": lambda vsb: vsb.write_raw_keyseq_page(0, b"\x02\x0B"),
+    "eepread": lambda vsb: vsb.read_eeprom_byte(0x100),
+    "eepwrite": lambda vsb: vsb.write_eeprom_byte(0x100, 0x55),
+    }
+CODEC_ITERATIONS = 5000
+
+
+def measure_codec(repeat, iterations=CODEC_ITERATIONS,
+                  device_class=VerySeriousButton, backend=None):
+    """Hammer each of CODEC_COMMANDS against a zero-latency loopback
+    device (or a device of `backend`). Reports host CPU time per command
+    in the fastest of `repeat` runs, the one least disturbed by other
+    load, and the peak memory allocated while executing one command (via
+    tracemalloc)."""
+    import tracemalloc
+    if backend is None:
+        backend = _LoopbackBackend()
+    vsb = device_class(backend=backend)
+    results = {}
+    try:
+        for name, command in CODEC_COMMANDS.items():
+            times = []
+            for rep in range(repeat):
+                t0 = time.process_time()
+                for i in range(iterations):
+                    command(vsb)
+                times.append((time.process_time() - t0) / iterations)
+            command(vsb)
+            tracemalloc.start()
+            try:
+                peaks = []
+                for i in range(100):
+                    base = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    command(vsb)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - base)
+            finally:
+                tracemalloc.stop()
+            results[name] = dict(
+                iterations=iterations,
+                cpu_time=min(times),
+                alloc_bytes=percentile(peaks, 50),
+                )
+    finally:
+        vsb.close()
+    return results
+
+
+HIDRAW_HARDWARE_ITERATIONS = 50
+
+
+def measure_hidraw(repeat, hardware=False):
+    """CODEC_COMMANDS through the hidraw ioctl backend, and with
+    `hardware` through hidapi for comparison. Without `hardware` it runs
+    against a loopback device, to be compared with measure_codec()."""
+    if not hardware:
+        return dict(
+            ioctl=measure_codec(repeat, backend=_LoopbackHidrawBackend()))
+    from ._hidraw import HidrawBackend
+    from ._vsbutil import _load_hid
+    iterations = HIDRAW_HARDWARE_ITERATIONS
+    return dict(
+        hidapi=measure_codec(repeat, iterations, backend=_load_hid()),
+        ioctl=measure_codec(repeat, iterations, backend=HidrawBackend()),
+        )
+
+
+def _compare_codec(label, cur_results, base_results, tolerance):
+    # `tolerance` applies to CPU time; allocations must not grow at all
+    regressions = []
+    for name, base in base_results.items():
+        cur = cur_results.get(name)
+        if cur is None:
+            continue
+        if cur["cpu_time"] > base["cpu_time"] * (1. + tolerance):
+            regressions.append(
+                f"{label} {name}: {cur['cpu_time']*1e6:.1f} us/command "
+                f"(baseline {base['cpu_time']*1e6:.1f} us, "
+                f"+{tolerance:.0%} allowed)"
+                )
+        if cur["alloc_bytes"] > base["alloc_bytes"]:
+            regressions.append(
+                f"{label} {name}: {cur['alloc_bytes']:.0f} bytes allocated "
+                f"per command (baseline {base['alloc_bytes']:.0f})"
+                )
+    return regressions
+
+
+def compare(result, baseline, tolerance, cpu_tolerance=CPU_TOLERANCE):
+    regressions = []
+    cur = result.get("startup")
+    base = baseline.get("startup")
+    if cur is not None:
+        for name in cur["forbidden_modules_loaded"]:
+            regressions.append(f"startup: imports {name}")
+    if cur is not None and base is not None:
+        for key in ("wall_time", "import_time"):
+            cur_t = cur[key]["median"]
+            base_t = base[key]["median"]
+            if cur_t > base_t * (1. + tolerance):
+                regressions.append(
+                    f"startup: median {key.replace('_', ' ')} "
+                    f"{cur_t*1e3:.1f} ms (baseline {base_t*1e3:.1f} ms, "
+                    f"+{tolerance:.0%} allowed)"
+                    )
+    regressions += _compare_codec(
+        "codec", result.get("codec", {}), baseline.get("codec", {}),
+        cpu_tolerance)
+    for path, base in baseline.get("hidraw", {}).items():
+        regressions += _compare_codec(
+            f"hidraw {path}", result.get("hidraw", {}).get(path, {}), base,
+            cpu_tolerance)
+    for name, base in baseline.get("operations", {}).items():
+        cur = result["operations"].get(name)
+        if cur is None:
+            continue
+        if cur["round_trips"] > base["round_trips"]:
+            regressions.append(
+                f"{name}: {cur['round_trips']} round-trips "
+                f"(baseline {base['round_trips']})"
+                )
+        cur_t = cur["wall_time"]["median"]
+        base_t = base["wall_time"]["median"]
+        if cur_t > base_t * (1. + tolerance):
+            regressions.append(
+                f"{name}: median {cur_t*1e3:.1f} ms "
+                f"(baseline {base_t*1e3:.1f} ms, +{tolerance:.0%} allowed)"
+                )
+    for cmd_name, base in baseline.get("commands", {}).items():
+        cur = result["commands"].get(cmd_name)
+        if cur is None:
+            continue
+        if cur["p50"] > base["p50"] * (1. + tolerance):
+            regressions.append(
+                f"{cmd_name}: p50 {cur['p50']*1e3:.2f} ms "
+                f"(baseline {base['p50']*1e3:.2f} ms, "
+                f"+{tolerance:.0%} allowed)"
+                )
+    return regressions
+
+
+def run(opts):
+    import json
+    import platform
+    names = opts.operations or list(OPERATIONS) + [
+        name for name in PSEUDO_OPERATIONS if name not in MICROBENCHMARKS]
+    unknown = [
+        name for name in names
+        if name not in OPERATIONS and name not in PSEUDO_OPERATIONS
+        ]
+    if unknown:
+        print(
+            f"Unknown benchmark operation(s): {', '.join(unknown)} "
+            f"(known: {', '.join(list(OPERATIONS) + PSEUDO_OPERATIONS)})",
+            file=sys.stderr
+            )
+        return 2
+    result = dict(
+        vsbutil_version=__version__,
+        python=platform.python_version(),
+        backend="hardware" if opts.hardware else "simulated",
+        timestamp=time.time(),
+        operations={},
+        commands={},
+        )
+    device_ops = [name for name in names if name in OPERATIONS]
+    if device_ops:
+        backend = None if opts.hardware else make_simulated_backend()
+        vsb = VerySeriousButton(serial=opts.serial, backend=backend)
+        try:
+            result.update(run_benchmarks(vsb, opts, device_ops))
+        finally:
+            vsb.close()
+        result.update(release_number=vsb.release_number)
+    if "startup" in names:
+        result["startup"] = measure_startup(opts.repeat)
+    if "codec" in names:
+        result["codec"] = measure_codec(opts.repeat)
+    if "hidraw" in names:
+        result["hidraw"] = measure_hidraw(opts.repeat, opts.hardware)
+
+    for name, op in result["operations"].items():
+        print(
+            f"{name:12s} {op['wall_time']['median']*1e3:9.1f} ms  "
+            f"{op['round_trips']:5d} round-trips  "
+            f"{op['reports_received']:5d} reads"
+            )
+    for cmd_name, cmd in result["commands"].items():
+        print(
+            f"{cmd_name:12s} p50 {cmd['p50']*1e3:7.2f} ms  "
+            f"p99 {cmd['p99']*1e3:7.2f} ms  (n={cmd['count']})"
+            )
+    if "startup" in result:
+        startup = result["startup"]
+        print(
+            f"{'startup':12s} {startup['wall_time']['median']*1e3:9.1f} ms  "
+            f"(vsbutil imports {startup['import_time']['median']*1e3:.1f} ms, "
+            f"{startup['modules_loaded']} modules loaded)"
+            )
+        for name in startup["forbidden_modules_loaded"]:
+            print(f"WARNING: startup imports {name}", file=sys.stderr)
+    for name, codec in result.get("codec", {}).items():
+        print(
+            f"{'codec ' + name:16s} {codec['cpu_time']*1e6:7.2f} us/command  "
+            f"{codec['alloc_bytes']:6.0f} bytes allocated"
+            )
+    hidraw = result.get("hidraw", {})
+    # Real hidapi with --hardware, else the codec loopback if it ran
+    hidapi_results = hidraw.get("hidapi", result.get("codec", {}))
+    for name, ioctl in hidraw.get("ioctl", {}).items():
+        line = (
+            f"{'hidraw ' + name:16s} {ioctl['cpu_time']*1e6:7.2f} us/command  "
+            f"{ioctl['alloc_bytes']:6.0f} bytes allocated"
+            )
+        hidapi = hidapi_results.get(name)
+        if hidapi is not None:
+            line += (
+                f"  (hidapi {hidapi['cpu_time']*1e6:.2f} us, "
+                f"{hidapi['alloc_bytes']:.0f} bytes)"
+                )
+        print(line)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            result, baseline, opts.tolerance, opts.cpu_tolerance)
+        for msg in regressions:
+            print(f"REGRESSION: {msg}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
@@ -1,59 +1,340 @@
 import argparse
-from pathlib import Path
+import os
 import sys
+import time
 
-from ._vsbutil import VerySeriousButton, MODKEYS, KEYCODES
-from .__init__ import __version__
+from ._vsbutil import VerySeriousButton, format_keygroup, parse_keygroup
+from . import __version__
 
 
 def parse_hex(x):
     return int(x.strip().split("0x", 1)[-1], base=16)
 
 
+def positive_int(x):
+    n = int(x)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {n}")
+    return n
+
+
+# Commands without arguments, that can be given several at once
+QUERY_COMMANDS = [
+    "getserial", "getdevinfo", "getconfig", "getkeyseq", "getfuckyou"]
+
+
+def add_bench_arguments(parser):
+    parser.add_argument(
+        "operations",
+        metavar="OP",
+        nargs="*",
+        help="operation(s) to benchmark, e.g. setkeyseq, eepread or "
+             "startup (default: all but the codec and hidraw CPU "
+             "microbenchmarks)"
+        )
+    parser.add_argument(
+        "--hardware",
+        action="store_true",
+        help="run against a real VSB instead of the simulator "
+             "(overwrites its configuration and EEPROM contents)"
+        )
+    parser.add_argument(
+        "--repeat",
+        type=positive_int,
+        default=3,
+        help="repetitions per operation"
+        )
+    parser.add_argument(
+        "--eeprom-addr",
+        type=lambda x: int(x, 0),
+        default=0x100,
+        help="start address for eepread/eepwrite"
+        )
+    parser.add_argument(
+        "--eeprom-bytes",
+        type=int,
+        default=256,
+        help="number of bytes for eepread/eepwrite"
+        )
+    parser.add_argument(
+        "-o", "--output", metavar="FILE", help="write JSON results to FILE")
+    parser.add_argument(
+        "--baseline",
+        metavar="FILE",
+        help="compare against JSON results in FILE; exit 1 on regression"
+        )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed relative slowdown against the baseline "
+             "(default: %(default)s)"
+        )
+    parser.add_argument(
+        "--cpu-tolerance",
+        type=float,
+        default=0.5,
+        help="allowed relative slowdown of the codec and hidraw CPU "
+             "microbenchmarks against the baseline (default: %(default)s)"
+        )
+
+
 def handle_cmdline_args(argv):
     ap = argparse.ArgumentParser(
         prog=argv[0], description="Very Serious Button service tool")
-    ap.add_argument(
+    target = ap.add_mutually_exclusive_group()
+    target.add_argument(
         "--serial",
         default=None,
         help="serial number of VSB unit to connect to"
         )
+    target.add_argument(
+        "--serials",
+        default=None,
+        type=lambda x: [ser.strip() for ser in x.split(",") if ser.strip()],
+        help="comma-separated serial numbers of VSB units to run the "
+             "command on concurrently"
+        )
+    target.add_argument(
+        "--all",
+        action="store_true",
+        help="run the command on all connected VSB units concurrently"
+        )
+    ap.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=8,
+        help="maximum number of units to talk to at once with "
+             "--serials/--all (default: %(default)s)"
+        )
+    ap.add_argument(
+        "--hub-jobs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="maximum number of feature report transfers in progress at "
+             "once per USB hub with --serials/--all (default: no limit)"
+        )
+    ap.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        metavar="N",
+        help="retry commands that are safe to repeat up to N times after "
+             "a timeout, garbled response or USB error (default: fail at "
+             "once)"
+        )
+    ap.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="talk to the device(s) directly even if a vsbutil daemon "
+             "is running"
+        )
+    ap.add_argument(
+        "--stats",
+        action="store_true",
+        help="print per-command HID statistics to stderr when done "
+             "(talks to the device(s) directly)"
+        )
+    ap.add_argument(
+        "--stats-file",
+        metavar="FILE",
+        default=None,
+        help="write per-command HID statistics to FILE, in Prometheus "
+             "text format if it ends in .prom, JSON otherwise"
+        )
+    ap.add_argument(
+        "--inventory",
+        metavar="FILE",
+        default=os.environ.get("VSBUTIL_INVENTORY"),
+        help="record devices in SQLite database FILE, and skip reading "
+             "device info and recently confirmed configs from the devices "
+             "(default: $VSBUTIL_INVENTORY; talks to the device(s) "
+             "directly)"
+        )
+    ap.add_argument(
+        "--inventory-max-age",
+        metavar="SECONDS",
+        type=float,
+        default=None,
+        help="trust configs in the inventory for this long after they "
+             "were last read from or written to the device, skipping "
+             "commands that would change nothing (default: always read "
+             "them from the device)"
+        )
+    ap.add_argument(
+        "--devinfo-cache",
+        metavar="FILE",
+        default=os.environ.get("VSBUTIL_DEVINFO_CACHE") or None,
+        help="remember device info per firmware release in FILE and trust "
+             "it when opening devices of a known release, sending no "
+             "command; only for devices whose geometry is known to match "
+             "their release (default: $VSBUTIL_DEVINFO_CACHE, or off)"
+        )
+    ap.add_argument(
+        "--record",
+        metavar="FILE",
+        default=None,
+        help="append every feature report exchanged with the device(s) to "
+             "transcript FILE (talks to the device(s) directly)"
+        )
+    ap.add_argument(
+        "--replay",
+        metavar="FILE",
+        default=None,
+        help="talk to the devices recorded in transcript FILE instead of "
+             "real ones"
+        )
+    ap.add_argument(
+        "--replay-speed",
+        metavar="FACTOR",
+        type=float,
+        default=1.,
+        help="make replayed devices respond FACTOR times faster than "
+             "recorded; 0 for immediately (default: %(default)s)"
+        )
+    ap.add_argument(
+        "--json",
+        action="store_true",
+        help="print one JSON object per device (NDJSON), with decoded "
+             "results and timings, as each device finishes"
+        )
     ap.add_argument(
         "--version", action="store_true", help="print version of this software"
         )
     subparser = ap.add_subparsers(dest="cmd")
-    subparser.add_parser("list", help="list serial numbers of attached VSBs")
-    subparser.add_parser("getserial", help="get VSB serial number")
-    subparser.add_parser("getdevinfo", help="get VSB device info")
-    subparser.add_parser("getconfig", help="get VSB device configuration")
+    # Lets --json follow the command too, as in "vsbutil getconfig --json"
+    json_output = argparse.ArgumentParser(add_help=False)
+    json_output.add_argument(
+        "--json",
+        action="store_true",
+        default=argparse.SUPPRESS,
+        help="print one JSON object per device (NDJSON), like the global "
+             "--json"
+        )
+    list_ = subparser.add_parser(
+        "list", help="list serial numbers of attached VSBs")
+    list_.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and report VSBs as they are plugged in or "
+             "removed"
+        )
+    inventory = subparser.add_parser(
+        "inventory",
+        help="list the VSBs recorded in the --inventory database, without "
+             "talking to them"
+        )
+    inventory.add_argument(
+        "--mode",
+        default=None,
+        help="only list VSBs last known to be in this mode (joystick, "
+             "singlekey, keyseq or a number)"
+        )
+    inventory.add_argument(
+        "--release",
+        type=int,
+        default=None,
+        help="only list VSBs with this firmware release number"
+        )
+    transcript = subparser.add_parser(
+        "transcript", help="print the commands in a --record transcript")
+    transcript.add_argument("file", metavar="FILE", help="transcript file")
+    queries = [
+        subparser.add_parser(
+            "getserial",
+            parents=[json_output],
+            help="get VSB serial number"
+            ),
+        subparser.add_parser(
+            "getdevinfo",
+            parents=[json_output],
+            help="get VSB device info"
+            ),
+        subparser.add_parser(
+            "getconfig",
+            parents=[json_output],
+            help="get VSB device configuration"
+            ),
+        ]
     subparser.add_parser(
         "wipeconfig",
+        parents=[json_output],
         help="initialize stored configuration to factory defaults"
         )
     subparser.add_parser(
-        "saveconfig", help="store current configuration to EEPROM")
+        "saveconfig",
+        parents=[json_output],
+        help="store current configuration to EEPROM"
+        )
     subparser.add_parser(
-        "loadconfig", help="read stored configuration from EEPROM")
-    subparser.add_parser("getfuckyou", help="retrieve a fuckyou")
-    setjoy = subparser.add_parser("setjoy", help="set VSB to gamepad mode")
+        "loadconfig",
+        parents=[json_output],
+        help="read stored configuration from EEPROM"
+        )
+    queries.append(
+        subparser.add_parser(
+            "getfuckyou",
+            parents=[json_output],
+            help="retrieve a fuckyou"
+            ))
+    setjoy = subparser.add_parser(
+        "setjoy",
+        parents=[json_output],
+        help="set VSB to gamepad mode"
+        )
     setkey = subparser.add_parser(
-        "setkey", help="set VSB to single keyboard key mode")
+        "setkey",
+        parents=[json_output],
+        help="set VSB to single keyboard key mode"
+        )
     setkey.add_argument(
         "keygroup",
         metavar="KEYS",
         help="plus-separated group of key names, e.g. 'LALT+LSHIFT+F'"
         )
     setkeys = subparser.add_parser(
-        "setkeyseq", help="set VSB to keyboard sequence mode")
+        "setkeyseq",
+        parents=[json_output],
+        help="set VSB to keyboard sequence mode"
+        )
     setkeys.add_argument(
         "keygroups",
         metavar="KEYS",
         nargs="+",
         help="plus-separated group(s) of key names"
         )
-    subparser.add_parser(
-        "getkeyseq", help="read back the (raw) stored key sequence data")
-    eepread = subparser.add_parser("eepread", help="read byte(s) from EEPROM")
+    setkeys.add_argument(
+        "--text",
+        action="store_true",
+        help="type KEYS as text, with {KEYS} for named key groups (e.g. "
+             "'{ctrl+c}', '{enter}'), each on a page of its own; typed "
+             "characters are packed into as few pages as possible"
+        )
+    setkeys.add_argument(
+        "--diff",
+        action="store_true",
+        help="read back the stored key sequence and only rewrite pages "
+             "that differ"
+        )
+    queries.append(subparser.add_parser(
+        "getkeyseq",
+        parents=[json_output],
+        help="read back the (raw) stored key sequence data"
+        ))
+    for query in queries:
+        query.add_argument(
+            "more",
+            metavar="CMD",
+            nargs="*",
+            help="further commands to run in the same session (any of "
+                 + ", ".join(QUERY_COMMANDS) + ")"
+            )
+    eepread = subparser.add_parser(
+        "eepread",
+        parents=[json_output],
+        help="read byte(s) from EEPROM"
+        )
     eepread.add_argument(
         "addr", metavar="ADDR", type=parse_hex, help="start address in hex")
     eepread.add_argument(
@@ -64,7 +345,11 @@ def handle_cmdline_args(argv):
         default=1,
         help="number of bytes to read"
         )
-    eepwrite = subparser.add_parser("eepwrite", help="write byte(s) to EEPROM")
+    eepwrite = subparser.add_parser(
+        "eepwrite",
+        parents=[json_output],
+        help="write byte(s) to EEPROM"
+        )
     eepwrite.add_argument("addr", metavar="ADDR", type=int)
     eepwrite.add_argument(
         "values",
@@ -73,108 +358,808 @@ def handle_cmdline_args(argv):
         type=parse_hex,
         help="byte value(s) to write, in hex"
         )
-    subparser.add_parser("reset", help="make VSB initiate a hardware reset")
-    subparser.add_parser("dfu", help="make VSB jump into USB DFU bootloader")
-    return ap.parse_args(argv[1:])
-
-
-def parse_keygroup(group_str):
-    pcs = [x.strip().upper() for x in group_str.split("+")]
-    mod = 0
-    keys = []
-    mods_phase = True
-    for n, pc in enumerate(pcs):
-        if (pc not in MODKEYS) or (n == len(pcs)-1):
-            mods_phase = False
-        if mods_phase:
-            mod |= MODKEYS[pc]
+    add_bench_arguments(subparser.add_parser(
+        "bench", help="benchmark provisioning operations"))
+    eepdump = subparser.add_parser(
+        "eepdump",
+        parents=[json_output],
+        help="save EEPROM contents to a binary image file"
+        )
+    eepdump.add_argument(
+        "file",
+        metavar="FILE",
+        help="image file to write; '{serial}' is replaced by the serial "
+             "number"
+        )
+    eepdump.add_argument(
+        "--addr",
+        type=parse_hex,
+        default=0,
+        help="start address in hex (default: 0)"
+        )
+    eepdump.add_argument(
+        "--nbytes",
+        type=int,
+        default=None,
+        help="number of bytes to read (default: to the end of EEPROM)"
+        )
+    eeprestore = subparser.add_parser(
+        "eeprestore",
+        parents=[json_output],
+        help="write a binary image file back to EEPROM"
+        )
+    eeprestore.add_argument(
+        "file",
+        metavar="FILE",
+        help="image file to read; '{serial}' is replaced by the serial "
+             "number"
+        )
+    eeprestore.add_argument(
+        "--addr",
+        type=parse_hex,
+        default=0,
+        help="start address in hex (default: 0)"
+        )
+    eeprestore.add_argument(
+        "--full",
+        action="store_true",
+        help="write every byte instead of only those that differ"
+        )
+    apply = subparser.add_parser(
+        "apply",
+        parents=[json_output],
+        help="bring VSB(s) to the state described in a JSON or TOML manifest, "
+             "skipping settings that are already in place"
+        )
+    apply.add_argument(
+        "file",
+        metavar="MANIFEST",
+        help="manifest file (.json or .toml); applies to the devices it "
+             "names unless --serial/--serials/--all is given"
+        )
+    apply.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the commands that would be sent without sending them"
+        )
+    serve = subparser.add_parser(
+        "serve",
+        help="run a daemon that keeps all VSBs open and executes commands "
+             "from other vsbutil invocations"
+        )
+    serve.add_argument(
+        "--socket",
+        metavar="PATH",
+        default=None,
+        help="Unix socket to listen on (default: $VSBUTIL_SOCKET, "
+             "$XDG_RUNTIME_DIR/vsbutil.sock or /tmp/vsbutil-UID.sock)"
+        )
+    monitor = subparser.add_parser(
+        "monitor",
+        help="watch the input reports of a VSB in gamepad or keyboard mode "
+             "and report their rate and timing"
+        )
+    monitor.add_argument(
+        "--duration",
+        metavar="SECONDS",
+        type=float,
+        default=None,
+        help="stop after this long (default: on Ctrl-C)"
+        )
+    monitor.add_argument(
+        "--ring-size",
+        metavar="N",
+        type=int,
+        default=None,
+        help="input reports to buffer between processing passes "
+             "(default: 8192)"
+        )
+    soak = subparser.add_parser(
+        "soak",
+        parents=[json_output],
+        help="run a mix of commands against VSB(s) under sustained load, "
+             "reporting throughput, latency, BUSY polls, errors and drift per "
+             "time window"
+        )
+    soak.add_argument(
+        "--duration",
+        metavar="SECONDS",
+        type=float,
+        default=None,
+        help="stop after this long in total (default: on Ctrl-C)"
+        )
+    soak.add_argument(
+        "--count",
+        metavar="N",
+        type=int,
+        default=None,
+        help="stop after N commands in total, over all devices"
+        )
+    soak.add_argument(
+        "--mix",
+        metavar="CMD=WEIGHT,...",
+        default="getcfg=4,readpage=3,eepread=3",
+        help="commands to run and their relative frequency, from getcfg, "
+             "readpage, writepage, eepread and savecfg (default: "
+             "%(default)s); writepage and savecfg rewrite the EEPROM with "
+             "its current contents, which wears it"
+        )
+    soak.add_argument(
+        "--window",
+        metavar="SECONDS",
+        type=float,
+        default=60.,
+        help="length of the time windows statistics are kept for "
+             "(default: %(default)s)"
+        )
+    soak.add_argument(
+        "--drift-threshold",
+        metavar="FRACTION",
+        type=float,
+        default=0.5,
+        help="report latency drift when a command's p50 or p99 latency in "
+             "the last window exceeds the first by this fraction, or "
+             "throughput drops by it (default: %(default)s)"
+        )
+    soak.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        default=None,
+        help="save the results to JSON FILE after every window"
+        )
+    soak.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the interrupted run saved in the --checkpoint FILE, "
+             "with its settings and devices"
+        )
+    subparser.add_parser(
+        "reset",
+        parents=[json_output],
+        help="make VSB initiate a hardware reset"
+        )
+    subparser.add_parser(
+        "dfu",
+        parents=[json_output],
+        help="make VSB jump into USB DFU bootloader"
+        )
+    opts = ap.parse_args(argv[1:])
+    opts.cmds = [opts.cmd] + (getattr(opts, "more", None) or [])
+    unknown = [cmd for cmd in opts.cmds[1:] if cmd not in QUERY_COMMANDS]
+    if unknown:
+        ap.error("only these commands can be combined: "
+                 + ", ".join(QUERY_COMMANDS))
+    return opts
+
+
+def progress_printer(opts):
+    # Progress on stderr, for interactive single-device runs only
+    if (opts.all or opts.serials or getattr(opts, "remote", False)
+            or not sys.stderr.isatty()):
+        return None
+    def progress(done, total):
+        end = "\n" if done >= total else ""
+        print(f"\r{done}/{total} bytes", end=end, file=sys.stderr, flush=True)
+    return progress
+
+
+def load_manifest(opts):
+    # Parsed once and shared by all the devices "apply" runs on
+    if getattr(opts, "manifest", None) is None:
+        from ._manifest import Manifest
+        opts.manifest = Manifest.load(opts.file)
+    return opts.manifest
+
+
+def execute(vsb, opts, out=print):
+    cmds = getattr(opts, "cmds", None) or [opts.cmd]
+    if getattr(opts, "json", False):
+        out(json_record(vsb, opts, cmds))
+        return
+    for cmd in cmds:
+        execute_command(vsb, opts, cmd, out)
+
+
+def config_to_json(cfg):
+    return dict(
+        mode=cfg["mode"],
+        mode_name=VerySeriousButton.mode_string_for_value(cfg["mode"]),
+        mods=cfg["mods"],
+        keycodes=[x for x in cfg["keycodes"] if x != 0],
+        keys=format_keygroup(cfg["mods"], cfg["keycodes"]),
+        keyseq_len=cfg["keyseq_len"],
+        )
+
+
+def keyseq_to_json(vsb):
+    data = vsb.read_raw_keyseq()
+    size = vsb.keyseq_page_size
+    pages = [data[i:i+size] for i in range(0, len(data), size)]
+    return dict(
+        raw=bytes(data).hex(),
+        keys=[
+            format_keygroup(page[0], page[1:1+vsb.keyseq_nkeys])
+            for page in pages
+            ],
+        )
+
+
+JSON_QUERIES = {
+    "getserial": lambda vsb: vsb.get_serialnum(),
+    "getdevinfo": lambda vsb: vsb.get_device_info().to_dict(),
+    "getconfig": lambda vsb: config_to_json(vsb.get_config()),
+    "getkeyseq": keyseq_to_json,
+    "getfuckyou": lambda vsb: vsb.get_fuckyou(),
+    }
+
+
+def json_record(vsb, opts, cmds):
+    # Results of `cmds` on one device, as a line of JSON; other commands
+    # give the lines they would print
+    import json
+    results = {}
+    timing = {}
+    started = time.perf_counter()
+    for cmd in cmds:
+        t0 = time.perf_counter()
+        query = JSON_QUERIES.get(cmd)
+        if query is not None:
+            results[cmd] = query(vsb)
+        else:
+            lines = []
+            execute_command(vsb, opts, cmd, lines.append)
+            results[cmd] = lines
+        timing[cmd] = time.perf_counter() - t0
+    return json.dumps(dict(
+        serial=vsb.serial_number,
+        release=vsb.release_number,
+        ok=True,
+        results=results,
+        timing=timing,
+        elapsed=time.perf_counter() - started,
+        ))
+
+
+def json_error(serial, error, name=None):
+    import json
+    return json.dumps(dict(
+        serial=serial,
+        ok=False,
+        error=name or type(error).__name__,
+        message=str(error),
+        ))
+
+
+def execute_command(vsb, opts, cmd, out=print):
+    if cmd == "getserial":
+        out(vsb.get_serialnum())
+    elif cmd == "getdevinfo":
+        info = vsb.get_device_info()
+        for key in info:
+            out("%16s = %s" % (key, info[key]))
+    elif cmd == "getconfig":
+        cfg = vsb.get_config()
+        info = dict(
+            mode="%d (%s)" %
+                 (cfg["mode"], vsb.mode_string_for_value(cfg["mode"]),),
+            keycodes=", ".join(
+                "0x%02X" % (x,) for x in cfg["keycodes"] if x != 0),
+            mods="0x%02X" % (cfg["mods"],),
+            keyseq_len="%d" % (cfg["keyseq_len"],),
+            )
+        for key, value in info.items():
+            out(f"{key:16s} = {value}")
+    elif cmd == "wipeconfig":
+        vsb.init_stored_config()
+        out("Stored configuration initialized to factory defaults.")
+    elif cmd == "saveconfig":
+        vsb.store_current_config()
+        out("Current configuration stored.")
+    elif cmd == "loadconfig":
+        vsb.load_stored_config()
+        out("Stored configuration loaded.")
+    elif cmd == "getfuckyou":
+        out(vsb.get_fuckyou())
+    elif cmd == "setkey":
+        mod, keys = parse_keygroup(opts.keygroup)
+        vsb.update_config(
+            mode=vsb.VSB_MODE_SINGLEKEY,
+            keycodes=keys,
+            mods=mod,
+            )
+        out("Configured for single-key mode.")
+    elif cmd == "setjoy":
+        vsb.update_config(
+            mode=vsb.VSB_MODE_JOYSTICK,
+            )
+        out("Configured for gamepad mode.")
+    elif cmd == "getkeyseq":
+        out(" ".join("%02X" % (b,) for b in vsb.read_raw_keyseq()))
+    elif cmd == "setkeyseq":
+        if opts.text:
+            from ._keyseq import compile_keyseq
+            keygroups = compile_keyseq(
+                " ".join(opts.keygroups),
+                vsb.keyseq_nkeys,
+                vsb.num_keyseq_pages,
+                )
         else:
-            keys.append(KEYCODES[pc])
-    return mod, keys
+            keygroups = [parse_keygroup(x) for x in opts.keygroups]
+        with vsb.config_transaction() as cfg:
+            summary = vsb.write_keyseq(keygroups, diff=opts.diff)
+            cfg["mode"] = vsb.VSB_MODE_KEYSEQ
+        vsb.store_current_config()
+        out("Configured for key sequence mode; key sequence stored; "
+            "current configuration stored.")
+        if opts.text:
+            out("Key sequence is %d page(s) long." % (len(keygroups),))
+        if opts.diff:
+            out("%d page(s) written, %d unchanged." % (
+                len(summary["written"]), len(summary["skipped"])))
+    elif cmd == "eepread":
+        out(" ".join(
+            "%02X" % (b,) for b in vsb.read_eeprom_bytes(
+                opts.addr, opts.nbytes)
+            ))
+    elif cmd == "eepwrite":
+        vsb.write_eeprom_bytes(opts.addr, opts.values)
+        out("%d bytes written to EEPROM." % (len(opts.values),))
+    elif cmd == "eepdump":
+        path = opts.file.format(serial=vsb.serial_number)
+        with open(path, "wb") as f:
+            n = vsb.dump_eeprom(
+                f, opts.addr, opts.nbytes, progress=progress_printer(opts))
+        out("%d bytes of EEPROM saved to %s." % (n, path))
+    elif cmd == "eeprestore":
+        path = opts.file.format(serial=vsb.serial_number)
+        with open(path, "rb") as f:
+            data = f.read()
+        summary = vsb.restore_eeprom(
+            data,
+            opts.addr,
+            diff=not opts.full,
+            progress=progress_printer(opts),
+            )
+        out("%d bytes written to EEPROM, %d unchanged." % (
+            len(summary["written"]), len(summary["skipped"])))
+    elif cmd == "apply":
+        from ._manifest import plan_device, apply_plan
+        spec = load_manifest(opts).spec_for(vsb.serial_number)
+        if spec is None:
+            out("Not in manifest; nothing to do.")
+            return
+        plan = plan_device(vsb, spec)
+        if not plan:
+            out("Already in the target state.")
+        elif opts.dry_run:
+            for line in plan.describe():
+                out(line)
+        else:
+            apply_plan(vsb, plan)
+            out("Applied %d command(s): %s." % (len(plan), ", ".join(
+                f"{n} {cmd}" for cmd, n in plan.counts().items())))
+    elif cmd == "reset":
+        vsb.reset()
+        out("Performing reset in 1 second.")
+    elif cmd == "dfu":
+        vsb.reset_to_bootloader()
+        out("Jumping to bootloader in 1 second.")
+    else:
+        out("No command given (try --help)")
+
+
+def print_device_result(serial, lines=None, error=None, as_json=False,
+                        error_name=None):
+    if as_json:
+        # Records carry the serial number; flush so that each device's
+        # record goes out as soon as it is done
+        if error is None:
+            for line in lines:
+                print(line, flush=True)
+        else:
+            print(json_error(serial, error, error_name), flush=True)
+    elif error is None:
+        for line in lines:
+            print(f"{serial}: {line}")
+    else:
+        print(f"{serial}: error: {error}", file=sys.stderr)
+
+
+def print_multi_summary(total, failed):
+    print(
+        f"{total - len(failed)} of {total} device(s) succeeded"
+        + (f"; failed: {', '.join(failed)}" if failed else "."),
+        file=sys.stderr
+        )
+    return 1 if failed else 0
+
+
+def run_multi(opts):
+    from ._multi import run_on_devices
+    from ._scheduler import TransferScheduler
+    scheduler = TransferScheduler(opts.hub_jobs)
+
+    def operation(vsb):
+        lines = []
+        execute(vsb, opts, out=lines.append)
+        return lines
+
+    results = run_on_devices(
+        operation,
+        serials=opts.serials,
+        max_workers=opts.jobs,
+        callback=lambda res: print_device_result(
+            res.serial, res.result, res.error, opts.json),
+        scheduler=scheduler,
+        )
+    if opts.stats:
+        for line in scheduler.summary():
+            print(line, file=sys.stderr)
+    failed = [res.serial for res in results.values() if not res.ok]
+    return print_multi_summary(len(results), failed)
+
+
+def connect_daemon(opts):
+    if opts.no_daemon or opts.cmd in (
+            None, "serve", "bench", "monitor", "soak"):
+        return None
+    if (opts.stats or opts.stats_file or opts.inventory or opts.record
+            or opts.replay):
+        # These all need the devices to be driven from this process
+        return None
+    if opts.cmd == "list" and opts.watch:
+        return None
+    from ._daemon import DaemonClient
+    return DaemonClient.connect()
+
+
+def run_remote(client, opts):
+    # Same as the local code paths, but executed by the daemon
+    if opts.cmd == "list":
+        found = client.list_connected()
+        print(f"Found {len(found)} device(s)" + (":" if found else "."))
+        for serial_no, release_no, dev_path in found:
+            print(serial_no)
+        return 0
+    request_opts = dict(vars(opts), remote=True)
+    request_opts.pop("manifest", None)
+    if getattr(opts, "file", None):
+        request_opts["file"] = os.path.abspath(opts.file)
+    if opts.all:
+        serials = "all"
+    elif opts.serials:
+        serials = opts.serials
+    else:
+        serials = [opts.serial] if opts.serial else None
+    if not (opts.all or opts.serials):
+        reply, = client.execute(request_opts, serials)
+        if not reply["ok"]:
+            if opts.json:
+                print_device_result(
+                    opts.serial, error=reply["message"], as_json=True,
+                    error_name=reply["error"])
+                return 1
+            from ._daemon import _raise_error
+            _raise_error(reply)
+        for line in reply["lines"]:
+            print(line)
+        return 0
+    failed = []
+    total = 0
+    for reply in client.execute(request_opts, serials):
+        total += 1
+        if reply["ok"]:
+            print_device_result(
+                reply["serial"], reply["lines"], as_json=opts.json)
+        else:
+            failed.append(reply["serial"])
+            print_device_result(
+                reply["serial"], error=reply["message"], as_json=opts.json,
+                error_name=reply["error"])
+    return print_multi_summary(total, failed)
+
+
+def list_inventory(inventory, opts):
+    mode = None
+    if opts.mode is not None:
+        mode = VerySeriousButton.mode_value_for_string(opts.mode)
+    entries = inventory.query(mode=mode, release_number=opts.release)
+    print(f"{len(entries)} device(s) in inventory" + (":" if entries else "."))
+    for entry in entries:
+        if entry.config is None:
+            state = "config unknown"
+        else:
+            state = "%s, keyseq_len %d, fingerprint %s" % (
+                VerySeriousButton.mode_string_for_value(entry.config["mode"]),
+                entry.config["keyseq_len"],
+                entry.fingerprint or "unknown",
+                )
+        checked = "unconfirmed"
+        if entry.checked is not None:
+            checked = "checked " + time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(entry.checked))
+        print(f"{entry.serial} (release {entry.release_number}): "
+              f"{state}; {checked}")
+    return 0
+
+
+def print_transcript(path):
+    from ._transcript import read_transcript, iter_exchanges
+    for exchange in iter_exchanges(read_transcript(path)):
+        cmd = VerySeriousButton.command_name_for_value(exchange.cmd_id)
+        if exchange.response is None:
+            result = "no response"
+        else:
+            result = "%s after %.2f ms" % (
+                VerySeriousButton.response_name_for_value(
+                    exchange.response_code),
+                exchange.ready_after * 1e3,
+                )
+        print("%s: %s %s -> %s, %d busy" % (
+            exchange.path.decode("utf-8", "replace"),
+            cmd,
+            exchange.sent[3:].hex(),
+            result,
+            len(exchange.busy),
+            ))
+    return 0
+
+
+def monitor_input(opts):
+    from ._monitor import InputMonitor
+    if opts.all or opts.serials:
+        print("monitor works on one VSB at a time (use --serial)",
+              file=sys.stderr)
+        return 2
+    monitor = InputMonitor(serial=opts.serial, ring_size=opts.ring_size)
+    print(f"Monitoring {monitor.serial_number}; press Ctrl-C to stop.",
+          file=sys.stderr)
+    deadline = None
+    if opts.duration is not None:
+        deadline = time.monotonic() + opts.duration
+    with monitor:
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                time.sleep(0.1)
+                monitor.poll()
+        except KeyboardInterrupt:
+            pass
+    for line in monitor.summary():
+        print(line)
+    return 0
+
+
+def soak(opts):
+    import json
+    import signal
+    from ._scheduler import TransferScheduler
+    from ._soak import SoakTest, parse_mix
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    scheduler = None
+    if opts.all or opts.serials:
+        scheduler = TransferScheduler(opts.hub_jobs)
+    if opts.resume:
+        if not opts.checkpoint:
+            print("--resume needs --checkpoint FILE", file=sys.stderr)
+            return 2
+        test = SoakTest.resume(opts.checkpoint, scheduler=scheduler)
+    else:
+        if opts.checkpoint and os.path.exists(opts.checkpoint):
+            print(f"{opts.checkpoint} exists; use --resume to continue "
+                  "that run", file=sys.stderr)
+            return 2
+        try:
+            mix = parse_mix(opts.mix)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        test = SoakTest(
+            mix,
+            duration=opts.duration,
+            count=opts.count,
+            window=opts.window,
+            checkpoint=opts.checkpoint,
+            drift_threshold=opts.drift_threshold,
+            scheduler=scheduler,
+            )
+    serials = None
+    if opts.serials:
+        serials = opts.serials
+    elif opts.serial:
+        serials = [opts.serial]
+    elif opts.all:
+        serials = [
+            ser for (ser, rls, path) in VerySeriousButton.list_connected()]
+    if not opts.json:
+        test.on_window = lambda w: print(test.format_window(w), flush=True)
+    signal.signal(signal.SIGTERM, terminate)
+    interrupted = False
+    try:
+        test.run(serials)
+    except KeyboardInterrupt:
+        interrupted = True
+    if opts.json:
+        print(json.dumps(test.to_dict(), sort_keys=True))
+    else:
+        for line in test.summary():
+            print(line)
+    if interrupted:
+        if opts.checkpoint:
+            print(f"Interrupted; continue with --checkpoint "
+                  f"{opts.checkpoint} --resume", file=sys.stderr)
+        return 130
+    totals = test.totals()
+    return 1 if totals["failed"] or test.drifting else 0
+
+
+def serve(opts):
+    import signal
+    from ._daemon import DaemonServer
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    from ._scheduler import TransferScheduler
+    server = DaemonServer(
+        opts.socket,
+        max_workers=opts.jobs,
+        scheduler=TransferScheduler(opts.hub_jobs),
+        )
+    signal.signal(signal.SIGTERM, terminate)
+    print(f"Serving on {server.socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 
 def run():
     opts = handle_cmdline_args(sys.argv)
 
     if opts.version:
-        print(f"{Path(sys.argv[0]).name} version {__version__}")
+        print(f"{os.path.basename(sys.argv[0])} version {__version__}")
         return 0
+    policy = None
+    if opts.retries:
+        from ._recovery import RetryPolicy
+        policy = VerySeriousButton.retry_policy = RetryPolicy(opts.retries)
+    # Transcripts need every command, GETDEVINFO included, to be sent, and
+    # benchmarks shouldn't leave their simulated devices in the cache
+    if opts.devinfo_cache and not (
+            opts.record or opts.replay or opts.cmd == "bench"):
+        from ._infocache import DeviceInfoCache
+        VerySeriousButton.info_cache = DeviceInfoCache(opts.devinfo_cache)
+    try:
+        return run_with_stats(opts, policy)
+    finally:
+        VerySeriousButton.retry_policy = None
+        VerySeriousButton.info_cache = None
+
+
+def run_with_stats(opts, policy=None):
+    if not (opts.stats or opts.stats_file):
+        return run_command(opts)
+    from ._metrics import Metrics
+    metrics = Metrics()
+    VerySeriousButton.global_listeners.append(metrics)
+    try:
+        return run_command(opts)
+    finally:
+        VerySeriousButton.global_listeners.remove(metrics)
+        if opts.stats:
+            for line in metrics.summary():
+                print(line, file=sys.stderr)
+            if policy is not None:
+                for line in policy.summary():
+                    print(line, file=sys.stderr)
+        if opts.stats_file:
+            metrics.write(opts.stats_file)
+
+
+def run_command(opts):
+    if opts.cmd == "transcript":
+        return print_transcript(opts.file)
+    if not (opts.record or opts.replay):
+        return run_inventory_command(opts)
+    from ._transcript import RecordingBackend, ReplayBackend
+    if opts.replay:
+        backend = ReplayBackend(opts.replay, speed=opts.replay_speed)
+    else:
+        backend = VerySeriousButton.get_backend()
+    if opts.record:
+        backend = RecordingBackend(backend, opts.record)
+    VerySeriousButton.backend = backend
+    try:
+        return run_inventory_command(opts)
+    finally:
+        VerySeriousButton.backend = None
+        if opts.record:
+            backend.close()
+
+
+def run_inventory_command(opts):
+    if not opts.inventory:
+        if opts.cmd == "inventory":
+            print("No inventory given (use --inventory FILE)", file=sys.stderr)
+            return 1
+        return run_device_command(opts)
+    from ._inventory import Inventory
+    inventory = Inventory(opts.inventory, max_age=opts.inventory_max_age)
+    if opts.cmd == "inventory":
+        with inventory:
+            return list_inventory(inventory, opts)
+    VerySeriousButton.inventory = inventory
+    try:
+        return run_device_command(opts)
+    finally:
+        VerySeriousButton.inventory = None
+        inventory.close()
+
+
+def run_device_command(opts):
+    if opts.cmd == "serve":
+        return serve(opts)
+    if opts.cmd == "apply":
+        manifest = load_manifest(opts)
+    if opts.cmd == "apply" and not (opts.serial or opts.serials or opts.all):
+        # Default to the devices the manifest names
+        if manifest.all_devices:
+            opts.all = True
+        else:
+            opts.serials = manifest.serials
+    client = connect_daemon(opts)
+    if client is not None:
+        with client:
+            return run_remote(client, opts)
     if opts.cmd == "list":
-        found = VerySeriousButton.list_connected()
+        from ._registry import DeviceRegistry
+        registry = DeviceRegistry()
+        found = registry.list_connected()
         print(f"Found {len(found)} device(s)" + (":" if found else "."))
         for serial_no, release_no, dev_path in found:
             print(serial_no)
+        if opts.watch:
+            registry.subscribe(
+                on_arrival=lambda ser, rls, path: print(
+                    f"+ {ser}", flush=True),
+                on_removal=lambda ser, rls, path: print(
+                    f"- {ser}", flush=True),
+                )
+            try:
+                with registry:
+                    while True:
+                        time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
         return 0
+    if opts.cmd == "bench":
+        from . import bench
+        return bench.run(opts)
+    if opts.cmd == "monitor":
+        return monitor_input(opts)
+    if opts.cmd == "soak":
+        return soak(opts)
 
+    if opts.all or opts.serials:
+        return run_multi(opts)
+    if opts.json:
+        try:
+            vsb = VerySeriousButton(serial=opts.serial)
+            try:
+                execute(vsb, opts)
+            finally:
+                vsb.close()
+        except IOError as e:
+            print_device_result(opts.serial, error=e, as_json=True)
+            return 1
+        return 0
     vsb = VerySeriousButton(serial=opts.serial)
     try:
-        if opts.cmd == "getserial":
-            print(vsb.get_serialnum())
-        elif opts.cmd == "getdevinfo":
-            info = vsb.get_device_info()
-            for key in info:
-                print("%16s = %s" % (key, info[key]))
-        elif opts.cmd == "getconfig":
-            cfg = vsb.get_config()
-            info = dict(
-                mode="%d (%s)" %
-                     (cfg["mode"], vsb.mode_string_for_value(cfg["mode"]),),
-                keycodes=", ".join(
-                    "0x%02X" % (x,) for x in cfg["keycodes"] if x != 0),
-                mods="0x%02X" % (cfg["mods"],),
-                keyseq_len="%d" % (cfg["keyseq_len"],),
-                )
-            for key, value in info.items():
-                print(f"{key:16s} = {value}")
-        elif opts.cmd == "wipeconfig":
-            vsb.init_stored_config()
-            print("Stored configuration initialized to factory defaults.")
-        elif opts.cmd == "saveconfig":
-            vsb.store_current_config()
-            print("Current configuration stored.")
-        elif opts.cmd == "loadconfig":
-            vsb.load_stored_config()
-            print("Stored configuration loaded.")
-        elif opts.cmd == "getfuckyou":
-            print(vsb.get_fuckyou())
-        elif opts.cmd == "setkey":
-            mod, keys = parse_keygroup(opts.keygroup)
-            vsb.update_config(
-                mode=vsb.VSB_MODE_SINGLEKEY,
-                keycodes=keys,
-                mods=mod,
-                )
-            print("Configured for single-key mode.")
-        elif opts.cmd == "setjoy":
-            vsb.update_config(
-                mode=vsb.VSB_MODE_JOYSTICK,
-                )
-            print("Configured for gamepad mode.")
-        elif opts.cmd == "getkeyseq":
-            print(" ".join("%02X" % (b,) for b in vsb.read_raw_keyseq()))
-        elif opts.cmd == "setkeyseq":
-            keygroups = [parse_keygroup(x) for x in opts.keygroups]
-            vsb.write_keyseq(keygroups)
-            vsb.update_config(mode=vsb.VSB_MODE_KEYSEQ)
-            vsb.store_current_config()
-            print("Configured for key sequence mode; key sequence stored; "
-                  "current configuration stored.")
-        elif opts.cmd == "eepread":
-            print(" ".join(
-                "%02X" % (b,) for b in vsb.read_eeprom_bytes(
-                    opts.addr, opts.nbytes)
-                ))
-        elif opts.cmd == "eepwrite":
-            vsb.write_eeprom_bytes(opts.addr, opts.values)
-            print("%d bytes written to EEPROM." % (len(opts.values),))
-        elif opts.cmd == "reset":
-            vsb.reset()
-            print("Performing reset in 1 second.")
-        elif opts.cmd == "dfu":
-            vsb.reset_to_bootloader()
-            print("Jumping to bootloader in 1 second.")
-        else:
-            print("No command given (try --help)")
+        execute(vsb, opts)
     finally:
         vsb.close()
     return 0